@@ -0,0 +1,373 @@
+"""
+Local end-to-end load test: LF0 -> (fake Lex ->) LF1 -> fake SQS -> LF2 -> fake SES,
+with LF2's enrichment against fake DynamoDB and a local fake OpenSearch server.
+
+    python benchmarks/e2e_loadtest.py --conversations 500 --concurrency 16 \
+        --latency-ms opensearch=20 --latency-ms ses=40 --error-rate ses=0.02 \
+        --env CONSUMER_MODE=batch --env MAX_PER_RUN=50
+
+Prints one JSON report: messages/sec, p50/p95/p99 latency (chat turn and
+enqueue -> email sent) and backend calls per delivered message.
+
+The index-sync paths of LF2 run against the same fakes with --scenario:
+
+    python benchmarks/e2e_loadtest.py --scenario seed --catalog-size 100000 \
+        --bulk-item-error-rate 0.01 --env SEED_SEGMENTS=8
+    python benchmarks/e2e_loadtest.py --scenario stream --catalog-size 20000 --stream-batch 100
+
+seed: {"seed": true} reindex of the whole table (seconds, docs/sec, _bulk retries,
+and whether it fits in one Lambda timeout). stream: the table's DynamoDB Stream
+(INSERT, then MODIFY/REMOVE of a share of the rows) delivered in batches the way the
+event source mapping does, retrying from each reported failure; the index must end
+up equal to the table.
+"""
+import argparse, asyncio, contextlib, json, os, random, statistics, sys, threading, time, uuid
+from concurrent.futures import ThreadPoolExecutor
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, "..", "lambda-functions"))
+sys.path.insert(0, HERE)
+
+from fakes import FakeDynamoDB, FakeLex, FakeOpenSearch, FakeSES, FakeSQS, make_catalog  # noqa: E402
+
+CUISINES = ["italian", "chinese", "mexican", "indian", "japanese", "thai"]
+REGION = "us-east-1"
+QUEUE_URL = "https://sqs.us-east-1.amazonaws.com/000000000000/DiningRequestsQueue"
+LAMBDA_MAX_TIMEOUT_S = 900
+
+
+class FakeContext:
+    def __init__(self, timeout_ms: int = 60000):
+        self.aws_request_id = str(uuid.uuid4())
+        self._deadline = time.time() + timeout_ms / 1000.0
+
+    def get_remaining_time_in_millis(self) -> int:
+        return max(0, int((self._deadline - time.time()) * 1000))
+
+
+def percentiles(xs: list[float]) -> dict:
+    if not xs:
+        return {"p50": None, "p95": None, "p99": None, "max": None}
+    xs = sorted(xs)
+    pick = lambda q: xs[min(len(xs) - 1, int(round(q * (len(xs) - 1))))]  # noqa: E731
+    return {"p50": round(pick(0.50), 2), "p95": round(pick(0.95), 2), "p99": round(pick(0.99), 2),
+            "max": round(xs[-1], 2), "mean": round(statistics.fmean(xs), 2)}
+
+
+def _kv(pairs: list[str], cast=float) -> dict:
+    return {k: cast(v) for k, v in (p.split("=", 1) for p in pairs)}
+
+
+def conversation(i: int, small_talk: bool = False) -> list[str]:
+    turns = ["I need restaurant suggestions", "Manhattan", CUISINES[i % len(CUISINES)],
+             str(1 + i % 6), "2030-01-01", "19:00", f"user{i}@example.com"]
+    return ["Hi!"] + turns + ["thanks"] if small_talk else turns
+
+
+def _backends(args):
+    latency, errors = _kv(args.latency_ms), _kv(args.error_rate)
+    return lambda name: {"latency_ms": latency.get(name, 0.0), "error_rate": errors.get(name, 0.0), "seed": args.seed}
+
+
+def _environment(args, fake_os):
+    os.environ.update({
+        "AWS_ACCESS_KEY_ID": "local", "AWS_SECRET_ACCESS_KEY": "local", "AWS_DEFAULT_REGION": REGION,
+        "LEX_BOT_ID": "local", "LEX_BOT_ALIAS_ID": "local", "QUEUE_URL": QUEUE_URL,
+        "DDB_TABLE": "yelp-restaurants", "OPENSEARCH_ENDPOINT": fake_os.endpoint,
+        "SES_SENDER": "concierge@example.com", "REGION": REGION,
+        "CATALOG_SNAPSHOT_PATH": os.environ.get("CATALOG_SNAPSHOT_PATH", "/nonexistent/catalog.snap"),
+        # heartbeats on the same compressed clock as the visibility timeouts they extend
+        "HEARTBEAT_INTERVAL": str(10 * args.visibility_scale),
+    })
+    os.environ.update(_kv(args.env, str))
+
+
+def _backend_report(*backends) -> dict:
+    return {b.name: {"calls": dict(b.calls), "errors": dict(b.errors), "total": b.total_calls()} for b in backends}
+
+
+def run(args) -> dict:
+    if args.scenario == "seed":
+        return run_seed(args)
+    if args.scenario == "stream":
+        return run_stream(args)
+    backend = _backends(args)
+    catalog = make_catalog(args.catalog_size, [c.title() for c in CUISINES], seed=args.seed)
+    fake_os = FakeOpenSearch(bulk_item_error_rate=args.bulk_item_error_rate, **backend("opensearch"))
+    _environment(args, fake_os)
+
+    import aws_clients
+    import lambda_function_0 as lf0
+    import lambda_function_1 as lf1
+    import lambda_function_2 as lf2
+
+    # OpenSearch holds what the seeder would have indexed
+    for it in catalog:
+        doc = lf2.os_doc_from_item(it)
+        if doc:
+            fake_os.docs[doc["business_id"]] = doc
+
+    sent_at: dict[str, float] = {}
+    enqueued_at: dict[str, float] = {}
+    sent_lock = threading.Lock()
+
+    def on_send(to_addr):
+        with sent_lock:
+            sent_at.setdefault(to_addr, time.perf_counter())
+
+    sqs = FakeSQS(visibility_scale=args.visibility_scale, **backend("sqs"))
+    ddb = FakeDynamoDB("yelp-restaurants", catalog, **backend("dynamodb"))
+    ses = FakeSES(on_send=on_send, max_send_rate=args.ses_max_send_rate, **backend("ses"))
+    lex = FakeLex(lf1.lambda_handler, **backend("lex"))
+    for region in (None, REGION):
+        aws_clients.register_client("sqs", sqs, region)
+        aws_clients.register_client("dynamodb", ddb, region)
+        aws_clients.register_client("ses", ses, region)
+        aws_clients.register_client("lexv2-runtime", lex, region)
+
+    turn_ms: list[float] = []
+    turn_lock = threading.Lock()
+
+    def chat(i: int):
+        # with --small-talk the browser starts without a sessionId and reuses LF0's
+        session_id = None if args.small_talk else str(uuid.uuid4())
+        for text in conversation(i, args.small_talk):
+            started = time.perf_counter()
+            resp = lf0.lambda_handler({"body": json.dumps({"message": text, "sessionId": session_id})}, FakeContext())
+            session_id = json.loads(resp["body"])["sessionId"]
+            with turn_lock:
+                turn_ms.append((time.perf_counter() - started) * 1000)
+        enqueued_at[f"user{i}@example.com"] = time.perf_counter()
+
+    producers_done = threading.Event()
+    invocations = [0]
+
+    def consume():
+        while True:
+            if producers_done.is_set() and sqs.depth() == 0:
+                return
+            res = lf2.lambda_handler({}, FakeContext(args.lf2_timeout_ms))
+            invocations[0] += 1
+            if not res.get("processed") and not res.get("errors"):
+                time.sleep(args.poll_interval)  # empty receive (or only in-flight retries left)
+
+    worker_report = {}
+
+    def consume_worker():
+        # one long-running worker process instead of Lambda invocations (--env WORKER_POLLERS=...)
+        import worker
+        w = worker.Worker(wait_seconds=1)
+
+        async def until_drained():
+            task = asyncio.ensure_future(w.run(install_signals=False))
+            while not (producers_done.is_set() and sqs.depth() == 0):
+                await asyncio.sleep(args.poll_interval)
+            w.stop()
+            worker_report.update(await task)
+        asyncio.run(until_drained())
+
+    started = time.perf_counter()
+    if args.worker:
+        consumers = [threading.Thread(target=consume_worker, daemon=True)]
+    else:
+        consumers = [threading.Thread(target=consume, daemon=True) for _ in range(args.consumers)]
+    for t in consumers:
+        t.start()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+        list(pool.map(chat, range(args.conversations)))
+    producers_done.set()
+    deadline = time.time() + args.drain_timeout
+    for t in consumers:
+        t.join(max(0.0, deadline - time.time()))
+    elapsed = time.perf_counter() - started
+    fake_os.close()
+
+    delivered = len(sent_at)
+    e2e_ms = [(sent_at[k] - enqueued_at[k]) * 1000 for k in sent_at if k in enqueued_at]
+    backends = _backend_report(lex, sqs, fake_os, ddb, ses)
+    return {
+        "conversations": args.conversations,
+        "delivered": delivered,
+        "undelivered": args.conversations - delivered,
+        "seconds": round(elapsed, 3),
+        "messages_per_sec": round(delivered / elapsed, 2) if elapsed else None,
+        "lf2_invocations": invocations[0],
+        "worker": worker_report or None,
+        "lf0_small_talk": dict(lf0.small_talk_stats),
+        "chat_turn_ms": percentiles(turn_ms),
+        "enqueue_to_email_ms": percentiles(e2e_ms),
+        "backend_calls_per_message": {name: round(b["total"] / delivered, 3) if delivered else None
+                                      for name, b in backends.items()},
+        "backends": backends,
+        "env": _kv(args.env, str),
+    }
+
+
+def run_seed(args) -> dict:
+    backend = _backends(args)
+    catalog = make_catalog(args.catalog_size, [c.title() for c in CUISINES], seed=args.seed)
+    fake_os = FakeOpenSearch(bulk_item_error_rate=args.bulk_item_error_rate, **backend("opensearch"))
+    _environment(args, fake_os)
+
+    import aws_clients
+    import lambda_function_2 as lf2
+
+    ddb = FakeDynamoDB("yelp-restaurants", catalog, **backend("dynamodb"))
+    for region in (None, REGION):
+        aws_clients.register_client("dynamodb", ddb, region)
+
+    expected = sum(1 for it in catalog if lf2.os_doc_from_item(it))
+    started = time.perf_counter()
+    stats = lf2.lambda_handler({"seed": True}, FakeContext(args.lf2_timeout_ms))
+    elapsed = time.perf_counter() - started
+    fake_os.close()
+    return {
+        "scenario": "seed",
+        "catalog_size": args.catalog_size,
+        "seed": stats,
+        "seconds": round(elapsed, 3),
+        "indexed_docs": len(fake_os.docs),
+        "missing_docs": expected - len(fake_os.docs),
+        "index_mapping": sorted(fake_os.mappings.get(lf2.ES_INDEX, {})),
+        "refreshes": fake_os.refreshes,
+        "fits_lambda_timeout": elapsed < LAMBDA_MAX_TIMEOUT_S,
+        "backends": _backend_report(fake_os, ddb),
+        "env": _kv(args.env, str),
+    }
+
+
+def stream_records(catalog: list[dict], seed: int) -> list[dict]:
+    """INSERT of every row, then a MODIFY of ~20% and a REMOVE of ~5% of them, in table order."""
+    rng = random.Random(seed)
+    records, seq = [], 0
+
+    def record(name, item):
+        nonlocal seq
+        seq += 1
+        change = {"Keys": {"business_id": item["business_id"]}, "SequenceNumber": f"{seq:021d}",
+                  "StreamViewType": "NEW_IMAGE"}
+        if name != "REMOVE":
+            change["NewImage"] = item
+        records.append({"eventID": str(seq), "eventName": name, "eventSource": "aws:dynamodb",
+                        "awsRegion": REGION, "dynamodb": change})
+
+    for it in catalog:
+        record("INSERT", it)
+    for it in rng.sample(catalog, len(catalog) // 5):
+        record("MODIFY", {**it, "Rating": {"N": str(rng.choice([3, 3.5, 4, 4.5, 5]))},
+                          "CuisineSet": {"SS": [rng.choice(CUISINES).title()]}})
+    for it in rng.sample(catalog, len(catalog) // 20):
+        record("REMOVE", it)
+    return records
+
+
+def run_stream(args) -> dict:
+    backend = _backends(args)
+    catalog = make_catalog(args.catalog_size, [c.title() for c in CUISINES], seed=args.seed)
+    fake_os = FakeOpenSearch(bulk_item_error_rate=args.bulk_item_error_rate, **backend("opensearch"))
+    _environment(args, fake_os)
+
+    import lambda_function_2 as lf2
+
+    # The index already exists (seeded earlier): the handler takes the _mapping path
+    fake_os.mappings[lf2.ES_INDEX] = dict(lf2.INDEX_MAPPING["properties"])
+    records = stream_records(catalog, args.seed)
+
+    # What the index should hold once every record is applied in order
+    expected: dict[str, dict] = {}
+    for rec in records:
+        bid = rec["dynamodb"]["Keys"]["business_id"]["S"]
+        doc = None if rec["eventName"] == "REMOVE" else lf2.os_doc_from_item(rec["dynamodb"]["NewImage"])
+        if doc is None:
+            expected.pop(bid, None)
+        else:
+            expected[bid] = doc
+
+    # Event source mapping with ReportBatchItemFailures: resume from the reported record
+    batch_ms: list[float] = []
+    invocations = retried_batches = 0
+    pos, stuck, failures_here = 0, False, 0
+    started = time.perf_counter()
+    while pos < len(records):
+        batch = records[pos:pos + args.stream_batch]
+        t0 = time.perf_counter()
+        res = lf2.lambda_handler({"Records": batch}, FakeContext(args.lf2_timeout_ms))
+        batch_ms.append((time.perf_counter() - t0) * 1000)
+        invocations += 1
+        failed = res.get("batchItemFailures") or []
+        if not failed:
+            pos, failures_here = pos + len(batch), 0
+            continue
+        seqs = [r["dynamodb"]["SequenceNumber"] for r in batch]
+        resume = pos + seqs.index(failed[0]["itemIdentifier"])
+        failures_here = failures_here + 1 if resume == pos else 1
+        if failures_here > args.stream_max_retries:
+            stuck = True
+            break
+        retried_batches += 1
+        pos = resume
+    elapsed = time.perf_counter() - started
+    fake_os.close()
+
+    mismatched = sum(1 for bid in expected.keys() | fake_os.docs.keys() if expected.get(bid) != fake_os.docs.get(bid))
+    return {
+        "scenario": "stream",
+        "catalog_size": args.catalog_size,
+        "records": len(records),
+        "stream_batch": args.stream_batch,
+        "invocations": invocations,
+        "retried_batches": retried_batches,
+        "stuck": stuck,
+        "seconds": round(elapsed, 3),
+        "records_per_sec": round(pos / elapsed, 1) if elapsed else None,
+        "batch_ms": percentiles(batch_ms),
+        "index_matches_table": not mismatched and not stuck,
+        "mismatched_docs": mismatched,
+        "index_mapping": sorted(fake_os.mappings.get(lf2.ES_INDEX, {})),
+        "backends": _backend_report(fake_os),
+        "env": _kv(args.env, str),
+    }
+
+
+def main(argv=None):
+    p = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    p.add_argument("--scenario", choices=("chat", "seed", "stream"), default="chat",
+                   help="chat turns through LF0..LF2 (default), a full reindex, or stream sync")
+    p.add_argument("--conversations", type=int, default=200)
+    p.add_argument("--concurrency", type=int, default=8, help="parallel chat sessions through LF0")
+    p.add_argument("--consumers", type=int, default=2, help="parallel LF2 invocations draining the queue")
+    p.add_argument("--catalog-size", type=int, default=5000)
+    p.add_argument("--latency-ms", action="append", default=[], metavar="BACKEND=MS",
+                   help="injected latency per call: lex, sqs, opensearch, dynamodb, ses")
+    p.add_argument("--error-rate", action="append", default=[], metavar="BACKEND=RATE",
+                   help="fraction of calls that fail with a throttling error")
+    p.add_argument("--env", action="append", default=[], metavar="KEY=VALUE", help="extra Lambda env vars")
+    p.add_argument("--lf2-timeout-ms", type=int, default=60000)
+    p.add_argument("--poll-interval", type=float, default=0.01)
+    p.add_argument("--visibility-scale", type=float, default=0.02,
+                   help="shrinks SQS visibility timeouts so retries of failed messages happen within the run")
+    p.add_argument("--ses-max-send-rate", type=float, default=1000.0,
+                   help="MaxSendRate the fake SES quota reports (LF2 paces its sends to it; 14 = sandbox)")
+    p.add_argument("--worker", action="store_true",
+                   help="consume with lambda-functions/worker.py (asyncio, long-running) instead of LF2 invocations")
+    p.add_argument("--small-talk", action="store_true",
+                   help="open each conversation with a greeting and end it with a thank-you")
+    p.add_argument("--bulk-item-error-rate", type=float, default=0.0,
+                   help="fraction of _bulk items the fake OpenSearch rejects with 429 (per-item retries)")
+    p.add_argument("--stream-batch", type=int, default=100, help="records per stream invocation (BatchSize)")
+    p.add_argument("--stream-max-retries", type=int, default=50,
+                   help="give up when the same record fails this many times in a row")
+    p.add_argument("--drain-timeout", type=float, default=120.0)
+    p.add_argument("--seed", type=int, default=7)
+    p.add_argument("--lambda-logs", default=os.devnull, help="file for the Lambdas' log_json output")
+    args = p.parse_args(argv)
+
+    # Lambdas log one JSON line per event to stdout; keep them out of the report
+    with open(args.lambda_logs, "w") as logs, contextlib.redirect_stdout(logs):
+        report = run(args)
+    print(json.dumps(report, indent=2, sort_keys=True))
+    return report
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,469 @@
+"""
+In-process stand-ins for Lex, SQS, DynamoDB, OpenSearch and SES used by the
+load-test harness. Every backend counts its calls and can inject latency and
+errors; OpenSearch is a real local HTTP server so LF2's OpenSearchClient
+(pooling, gzip, retries) is exercised end to end.
+"""
+import gzip, json, random, threading, time, uuid
+from collections import Counter, deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from botocore.exceptions import ClientError
+
+
+class Backend:
+    def __init__(self, name: str, latency_ms: float = 0.0, error_rate: float = 0.0, seed: int | None = None):
+        self.name = name
+        self.latency_ms = latency_ms
+        self.error_rate = error_rate
+        self.calls = Counter()
+        self.errors = Counter()
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def _call(self, op: str, error_code: str = "ThrottlingException"):
+        with self._lock:
+            self.calls[op] += 1
+            fail = self._rng.random() < self.error_rate
+            if fail:
+                self.errors[op] += 1
+        if self.latency_ms:
+            time.sleep(self.latency_ms / 1000.0)
+        if fail:
+            raise ClientError({"Error": {"Code": error_code, "Message": f"injected {self.name} error"}}, op)
+
+    def total_calls(self) -> int:
+        return sum(self.calls.values())
+
+
+# ---------- SQS ----------
+class FakeSQS(Backend):
+    def __init__(self, visibility_scale: float = 1.0, **kw):
+        super().__init__("sqs", **kw)
+        self.visibility_scale = visibility_scale  # < 1 replays retries faster than real time
+        self._queue = deque()        # visible messages
+        self._inflight = {}          # receipt handle -> (message, visible_at)
+        self._cv = threading.Condition()
+
+    def _requeue_expired(self):
+        now = time.time()
+        for rh, (m, visible_at) in list(self._inflight.items()):
+            if visible_at <= now:
+                del self._inflight[rh]
+                self._queue.append(m)
+
+    def depth(self) -> int:
+        with self._cv:
+            self._requeue_expired()
+            return len(self._queue) + len(self._inflight)
+
+    def send_message(self, QueueUrl, MessageBody, MessageAttributes=None, **kw):
+        self._call("SendMessage")
+        m = {
+            "MessageId": str(uuid.uuid4()),
+            "Body": MessageBody,
+            "Attributes": {"ApproximateReceiveCount": "0", "SentTimestamp": str(int(time.time() * 1000))},
+            "MessageAttributes": MessageAttributes or {},
+        }
+        with self._cv:
+            self._queue.append(m)
+            self._cv.notify()
+        return {"MessageId": m["MessageId"]}
+
+    def send_message_batch(self, QueueUrl, Entries):
+        out = []
+        for e in Entries:
+            r = self.send_message(QueueUrl, e["MessageBody"], e.get("MessageAttributes"))
+            out.append({"Id": e["Id"], "MessageId": r["MessageId"]})
+        return {"Successful": out, "Failed": []}
+
+    def receive_message(self, QueueUrl, MaxNumberOfMessages=1, WaitTimeSeconds=0, VisibilityTimeout=30, **kw):
+        self._call("ReceiveMessage")
+        deadline = time.time() + WaitTimeSeconds
+        out = []
+        with self._cv:
+            while True:
+                self._requeue_expired()
+                while self._queue and len(out) < MaxNumberOfMessages:
+                    m = self._queue.popleft()
+                    m["Attributes"]["ApproximateReceiveCount"] = str(int(m["Attributes"]["ApproximateReceiveCount"]) + 1)
+                    rh = str(uuid.uuid4())
+                    self._inflight[rh] = (m, time.time() + VisibilityTimeout * self.visibility_scale)
+                    out.append({**m, "ReceiptHandle": rh, "Attributes": dict(m["Attributes"])})
+                remaining = deadline - time.time()
+                if out or remaining <= 0:
+                    break
+                self._cv.wait(min(remaining, 0.05))
+        return {"Messages": out} if out else {}
+
+    def delete_message(self, QueueUrl, ReceiptHandle):
+        self._call("DeleteMessage")
+        with self._cv:
+            self._inflight.pop(ReceiptHandle, None)
+        return {}
+
+    def delete_message_batch(self, QueueUrl, Entries):
+        self._call("DeleteMessageBatch")
+        with self._cv:
+            for e in Entries:
+                self._inflight.pop(e["ReceiptHandle"], None)
+        return {"Successful": [{"Id": e["Id"]} for e in Entries], "Failed": []}
+
+    def change_message_visibility(self, QueueUrl, ReceiptHandle, VisibilityTimeout):
+        self._call("ChangeMessageVisibility")
+        with self._cv:
+            if ReceiptHandle in self._inflight:
+                m, _ = self._inflight[ReceiptHandle]
+                self._inflight[ReceiptHandle] = (m, time.time() + VisibilityTimeout * self.visibility_scale)
+        return {}
+
+    def change_message_visibility_batch(self, QueueUrl, Entries):
+        self._call("ChangeMessageVisibilityBatch")
+        ok, failed = [], []
+        with self._cv:
+            for e in Entries:
+                if e["ReceiptHandle"] in self._inflight:
+                    m, _ = self._inflight[e["ReceiptHandle"]]
+                    self._inflight[e["ReceiptHandle"]] = (m, time.time() + e["VisibilityTimeout"] * self.visibility_scale)
+                    ok.append({"Id": e["Id"]})
+                else:
+                    failed.append({"Id": e["Id"], "Code": "ReceiptHandleIsInvalid", "SenderFault": True})
+        return {"Successful": ok, "Failed": failed}
+
+
+# ---------- DynamoDB ----------
+class FakeDynamoDB(Backend):
+    """The restaurants table (attribute-value JSON) plus any other table put_item is used on."""
+
+    def __init__(self, table: str, items: list[dict], pk: str = "business_id", **kw):
+        super().__init__("dynamodb", **kw)
+        self.table = table
+        self.pk = pk
+        self.tables = {table: {it[pk]["S"]: it for it in items}}
+
+    def batch_get_item(self, RequestItems):
+        self._call("BatchGetItem", "ProvisionedThroughputExceededException")
+        responses = {}
+        for table, req in RequestItems.items():
+            rows = self.tables.get(table, {})
+            attrs = None
+            if req.get("ProjectionExpression"):
+                names = req.get("ExpressionAttributeNames", {})
+                attrs = [names.get(a.strip(), a.strip()) for a in req["ProjectionExpression"].split(",")]
+            out = []
+            for key in req["Keys"]:
+                it = rows.get(next(iter(key.values()))["S"])
+                if it is not None:
+                    out.append({k: v for k, v in it.items() if attrs is None or k in attrs})
+            responses[table] = out
+        return {"Responses": responses, "UnprocessedKeys": {}}
+
+    def scan(self, TableName, Segment=0, TotalSegments=1, ExclusiveStartKey=None, Limit=1000, **kw):
+        self._call("Scan", "ProvisionedThroughputExceededException")
+        rows = [it for i, it in enumerate(self.tables.get(TableName, {}).values()) if i % TotalSegments == Segment]
+        start = ExclusiveStartKey["_pos"]["N"] if ExclusiveStartKey else 0
+        start = int(start)
+        page = rows[start:start + Limit]
+        resp = {"Items": page}
+        if start + Limit < len(rows):
+            resp["LastEvaluatedKey"] = {"_pos": {"N": str(start + Limit)}}
+        return resp
+
+    def put_item(self, TableName, Item, ConditionExpression=None, **kw):
+        self._call("PutItem")
+        rows = self.tables.setdefault(TableName, {})
+        key = next(iter(Item.values()))["S"]
+        # Only the idempotency claim uses a condition here: treat it as "not already present"
+        if ConditionExpression and key in rows:
+            raise ClientError({"Error": {"Code": "ConditionalCheckFailedException", "Message": ""}}, "PutItem")
+        rows[key] = Item
+        return {}
+
+    def get_item(self, TableName, Key, **kw):
+        self._call("GetItem")
+        it = self.tables.get(TableName, {}).get(next(iter(Key.values()))["S"])
+        return {"Item": it} if it else {}
+
+    def update_item(self, TableName, Key, ExpressionAttributeValues=None, **kw):
+        self._call("UpdateItem")
+        it = self.tables.setdefault(TableName, {}).setdefault(next(iter(Key.values()))["S"], dict(Key))
+        if ":done" in (ExpressionAttributeValues or {}):
+            it["status"] = ExpressionAttributeValues[":done"]
+        return {}
+
+    def delete_item(self, TableName, Key, **kw):
+        self._call("DeleteItem")
+        self.tables.get(TableName, {}).pop(next(iter(Key.values()))["S"], None)
+        return {}
+
+
+# ---------- SES ----------
+class FakeSES(Backend):
+    def __init__(self, on_send=None, max_send_rate: float = 14.0, **kw):
+        super().__init__("ses", **kw)
+        self.max_send_rate = max_send_rate  # 14/s is the SES sandbox quota
+        self.on_send = on_send or (lambda to_addr: None)
+        self.templates = {}
+
+    def send_email(self, Source, Destination, Message, **kw):
+        self._call("SendEmail", "Throttling")
+        for to_addr in Destination["ToAddresses"]:
+            self.on_send(to_addr)
+        return {"MessageId": str(uuid.uuid4())}
+
+    def get_template(self, TemplateName):
+        self._call("GetTemplate", "Throttling")
+        if TemplateName not in self.templates:
+            raise ClientError({"Error": {"Code": "TemplateDoesNotExist", "Message": ""}}, "GetTemplate")
+        return {"Template": self.templates[TemplateName]}
+
+    def create_template(self, Template):
+        self._call("CreateTemplate", "Throttling")
+        with self._lock:
+            if Template["TemplateName"] in self.templates:
+                raise ClientError({"Error": {"Code": "AlreadyExists", "Message": ""}}, "CreateTemplate")
+            self.templates[Template["TemplateName"]] = Template
+        return {}
+
+    def update_template(self, Template):
+        self._call("UpdateTemplate", "Throttling")
+        self.templates[Template["TemplateName"]] = Template
+        return {}
+
+    def send_bulk_templated_email(self, Source, Template, Destinations, **kw):
+        self._call("SendBulkTemplatedEmail", "Throttling")
+        status = []
+        for d in Destinations:
+            if self._rng.random() < self.error_rate:
+                status.append({"Status": "MessageRejected", "Error": "injected ses error"})
+                continue
+            for to_addr in d["Destination"]["ToAddresses"]:
+                self.on_send(to_addr)
+            status.append({"Status": "Success", "MessageId": str(uuid.uuid4())})
+        return {"Status": status}
+
+    def get_send_quota(self):
+        self._call("GetSendQuota")
+        return {"Max24HourSend": 200000.0, "MaxSendRate": self.max_send_rate, "SentLast24Hours": 0.0}
+
+
+# ---------- Lex (drives LF1 like the real bot would) ----------
+SLOT_ORDER = ["city", "cuisine", "guests", "date", "time", "email"]
+
+
+class FakeLex(Backend):
+    """
+    Minimal Lex V2 runtime: the first utterance starts DiningSuggestionsIntent
+    ("hi"/"thanks" map to the small-talk intents), every later utterance fills the
+    slot LF1 last elicited, and once all slots are set LF1 runs as the fulfillment hook.
+    """
+
+    def __init__(self, lf1_handler, **kw):
+        super().__init__("lex", **kw)
+        self.lf1 = lf1_handler
+        self.sessions = {}
+
+    def _event(self, session_id, intent, slots, source, text):
+        return {
+            "sessionId": session_id,
+            "inputTranscript": text,
+            "invocationSource": source,
+            "sessionState": {
+                "intent": {"name": intent, "slots": slots, "state": "InProgress"},
+                "originatingRequestId": f"{session_id}-req",
+                "sessionAttributes": self.sessions.get(session_id, {}).get("attrs", {}),
+            },
+        }
+
+    def recognize_text(self, botId, botAliasId, localeId, sessionId, text, sessionState=None, **kw):
+        self._call("RecognizeText")
+        sess = self.sessions.setdefault(sessionId, {"intent": None, "slots": {}, "eliciting": None, "attrs": {}})
+        if sessionState and sessionState.get("sessionAttributes"):
+            sess["attrs"].update(sessionState["sessionAttributes"])
+
+        if sess["intent"] is None:
+            lowered = text.strip().lower()
+            if lowered in ("hi", "hello", "hey"):
+                return self._reply(sessionId, self.lf1(self._event(sessionId, "GreetingIntent", {}, "FulfillmentCodeHook", text), None))
+            if lowered in ("thanks", "thank you"):
+                return self._reply(sessionId, self.lf1(self._event(sessionId, "ThankYouIntent", {}, "FulfillmentCodeHook", text), None))
+            sess["intent"] = "DiningSuggestionsIntent"
+        elif sess["eliciting"]:
+            sess["slots"][sess["eliciting"]] = {"value": {"originalValue": text, "interpretedValue": text}}
+
+        missing = [s for s in SLOT_ORDER if s not in sess["slots"]]
+        source = "DialogCodeHook" if missing else "FulfillmentCodeHook"
+        resp = self.lf1(self._event(sessionId, sess["intent"], dict(sess["slots"]), source, text), None)
+        action = resp["sessionState"]["dialogAction"]
+        if action["type"] == "ElicitSlot":
+            sess["eliciting"] = action["slotToElicit"]
+        elif action["type"] == "Delegate":
+            sess["eliciting"] = missing[0] if missing else None
+            if not resp.get("messages") and missing:
+                resp["messages"] = [{"contentType": "PlainText", "content": f"What {missing[0]}?"}]
+        else:  # Close
+            self.sessions.pop(sessionId, None)
+        return self._reply(sessionId, resp)
+
+    def _reply(self, session_id, lf1_resp):
+        return {
+            "sessionId": session_id,
+            "messages": lf1_resp.get("messages", []),
+            "sessionState": lf1_resp.get("sessionState", {}),
+            "interpretations": [{"intent": lf1_resp.get("sessionState", {}).get("intent", {})}],
+        }
+
+
+# ---------- OpenSearch (local HTTP server) ----------
+class FakeOpenSearch(Backend):
+    """Serves _search (term + geo_bounding_box filters), _msearch, _bulk, _refresh, index
+    creation and _mapping PUTs on 127.0.0.1; 429 is the injected error: for the whole
+    request at error_rate, and per _bulk item at bulk_item_error_rate."""
+
+    def __init__(self, docs: dict[str, dict] | None = None, bulk_item_error_rate: float = 0.0, **kw):
+        super().__init__("opensearch", **kw)
+        self.docs = dict(docs or {})
+        self.bulk_item_error_rate = bulk_item_error_rate
+        self.mappings: dict[str, dict] = {}  # index -> mapped properties
+        self.refreshes = 0
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def _serve(self, method: str):
+                body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+                if self.headers.get("content-encoding") == "gzip":
+                    body = gzip.decompress(body)
+                try:
+                    status, out = fake.handle(self.path, body, method)
+                except ClientError:
+                    status, out = 429, {"error": "injected opensearch error"}
+                data = json.dumps(out).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def do_GET(self):
+                self._serve("GET")
+
+            def do_POST(self):
+                self._serve("POST")
+
+            def do_PUT(self):
+                self._serve("PUT")
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.server.daemon_threads = True
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.endpoint = f"http://127.0.0.1:{self.server.server_port}"
+
+    def close(self):
+        self.server.shutdown()
+
+    def _search(self, q: dict) -> dict:
+        query = q.get("query", {})
+        inner = query.get("function_score", {}).get("query", query)
+        filters = inner.get("bool", {}).get("filter", [inner]) if "bool" in inner else [inner]
+        matches = list(self.docs.values())
+        for f in filters:
+            if "term" in f:
+                (field, value), = f["term"].items()
+                matches = [d for d in matches if d.get(field) == value]
+            elif "geo_bounding_box" in f:
+                (field, box), = f["geo_bounding_box"].items()
+                tl, br = box["top_left"], box["bottom_right"]
+                matches = [d for d in matches if d.get(field)
+                           and br["lat"] <= d[field]["lat"] <= tl["lat"] and tl["lon"] <= d[field]["lon"] <= br["lon"]]
+        size = q.get("size", 10)
+        picks = self._rng.sample(matches, min(size, len(matches)))
+        src = q.get("_source")
+        hits = [{"_id": d["business_id"],
+                 "_source": {k: v for k, v in d.items() if not isinstance(src, list) or k in src}} for d in picks]
+        return {"hits": {"total": {"value": len(matches)}, "hits": hits}}
+
+    def _put(self, parts: list[str], body: dict):
+        index = parts[0]
+        if len(parts) == 1:
+            if index in self.mappings:
+                return 400, {"error": {"type": "resource_already_exists_exception",
+                                       "reason": f"index [{index}] already exists"}, "status": 400}
+            self.mappings[index] = dict(body.get("mappings", {}).get("properties", {}))
+            return 200, {"acknowledged": True, "shards_acknowledged": True, "index": index}
+        if parts[1] == "_mapping" and index in self.mappings:
+            props = body.get("properties", {})
+            clash = [f for f, spec in props.items() if f in self.mappings[index] and self.mappings[index][f] != spec]
+            if clash:
+                return 400, {"error": {"type": "illegal_argument_exception",
+                                       "reason": f"mapper [{clash[0]}] cannot be changed"}, "status": 400}
+            self.mappings[index].update(props)
+            return 200, {"acknowledged": True}
+        return 404, {"error": {"type": "index_not_found_exception", "reason": f"no such index [{index}]"}, "status": 404}
+
+    def _bulk(self, body: bytes) -> dict:
+        lines = [json.loads(x) for x in body.decode("utf-8").splitlines() if x.strip()]
+        items, errors, i = [], False, 0
+        while i < len(lines):
+            (action, meta), = lines[i].items()
+            step = 1 if action == "delete" else 2
+            with self._lock:
+                rejected = self._rng.random() < self.bulk_item_error_rate
+                if rejected:
+                    self.errors["_bulk_item"] += 1
+            if rejected:
+                errors = True
+                items.append({action: {"_id": meta["_id"], "status": 429,
+                                       "error": {"type": "es_rejected_execution_exception"}}})
+            elif action == "delete":
+                found = self.docs.pop(meta["_id"], None) is not None
+                items.append({action: {"_id": meta["_id"], "status": 200 if found else 404}})
+            else:
+                self.docs[meta["_id"]] = lines[i + 1]
+                items.append({action: {"_id": meta["_id"], "status": 201}})
+            i += step
+        return {"errors": errors, "items": items}
+
+    def handle(self, path: str, body: bytes, method: str = "POST"):
+        parts = [p for p in path.split("?")[0].split("/") if p]
+        op = parts[-1] if parts else ""
+        self._call(op if op.startswith("_") else f"{method} {op}")
+        if method == "PUT":
+            return self._put(parts, json.loads(body or b"{}"))
+        if op == "_refresh":
+            with self._lock:
+                self.refreshes += 1
+            return 200, {"_shards": {"total": 1, "successful": 1, "failed": 0}}
+        if op == "_search":
+            return 200, self._search(json.loads(body or b"{}"))
+        if op == "_msearch":
+            lines = [json.loads(x) for x in body.decode("utf-8").splitlines() if x.strip()]
+            return 200, {"responses": [self._search(q) for q in lines[1::2]]}
+        if op == "_bulk":
+            return 200, self._bulk(body)
+        return 404, {"error": {"type": "unsupported_operation", "reason": f"{method} {path}"}, "status": 404}
+
+
+# ---------- fixtures ----------
+def make_catalog(n: int, cuisines: list[str], seed: int = 7) -> list[dict]:
+    """n restaurants in DynamoDB attribute-value JSON, shaped like yelp_to_dynamo's items."""
+    rng = random.Random(seed)
+    items = []
+    for i in range(n):
+        lat, lon = 40.70 + rng.random() * 0.12, -74.02 + rng.random() * 0.08
+        items.append({
+            "business_id": {"S": f"biz-{i:06d}"},
+            "Name": {"S": f"Restaurant {i}"},
+            "Address": {"S": f"{rng.randint(1, 999)} Broadway, New York, NY 100{rng.randint(1, 40):02d}"},
+            "Coordinates": {"M": {"latitude": {"N": f"{lat:.6f}"}, "longitude": {"N": f"{lon:.6f}"}}},
+            "NumberOfReviews": {"N": str(rng.randint(0, 5000))},
+            "Rating": {"N": str(rng.choice([3, 3.5, 4, 4.5, 5]))},
+            "ZipCode": {"S": f"100{rng.randint(1, 40):02d}"},
+            "CuisineSet": {"SS": rng.sample(cuisines, rng.randint(1, 2))},
+            "insertedAtTimestamp": {"S": "2025-01-01T00:00:00+00:00"},
+        })
+    return items
@@ -0,0 +1,208 @@
+"""
+Micro-benchmarks for the pure-CPU code on the per-message paths.
+
+    python benchmarks/micro.py                      # all benchmarks, JSON to stdout
+    python benchmarks/micro.py -k unwrap --quick    # subset, fewer repeats
+    python benchmarks/micro.py -o new.json --compare baseline.json
+
+The JSON is stable (sorted keys, fixed fixture seeds) so runs can be diffed
+or checked into CI as a baseline; --compare prints new/old ratios per benchmark.
+"""
+import argparse, json, os, platform, statistics, sys, tempfile, timeit
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, "..", "lambda-functions"))
+sys.path.insert(0, HERE)
+
+from fakes import make_catalog  # noqa: E402
+
+os.environ.setdefault("AWS_DEFAULT_REGION", "us-east-1")
+os.environ.setdefault("LEX_BOT_ID", "bench")
+os.environ.setdefault("LEX_BOT_ALIAS_ID", "bench")
+os.environ.setdefault("QUEUE_URL", "https://sqs.us-east-1.amazonaws.com/000000000000/bench")
+os.environ.setdefault("DDB_TABLE", "yelp-restaurants")
+os.environ.setdefault("OPENSEARCH_ENDPOINT", "http://127.0.0.1:9")
+os.environ.setdefault("SES_SENDER", "bench@example.com")
+os.environ.setdefault("CATALOG_SNAPSHOT_PATH", "/nonexistent/catalog.snap")
+
+CUISINES = ["Italian", "Chinese", "Mexican", "Indian", "Japanese", "Thai"]
+
+
+# ---------- fixtures ----------
+def api_gateway_event(text="I'd like Thai food for 4 people tomorrow at 7pm", session_id="c0ffee00-0000-4000-8000-000000000000"):
+    """What LF0 gets from API Gateway (REST proxy integration)."""
+    return {
+        "resource": "/chatbot", "path": "/chatbot", "httpMethod": "POST",
+        "headers": {"Content-Type": "application/json", "Accept-Encoding": "gzip, deflate, br",
+                    "User-Agent": "Mozilla/5.0", "X-Forwarded-For": "203.0.113.7"},
+        "queryStringParameters": None,
+        "requestContext": {"requestId": "bench", "stage": "prod", "identity": {"sourceIp": "203.0.113.7"}},
+        "body": json.dumps({"message": text, "sessionId": session_id,
+                            "messages": [{"type": "unstructured", "unstructured": {"text": text}}]}),
+        "isBase64Encoded": False,
+    }
+
+
+def lex_slots(filled=True):
+    values = {"city": "Manhattan", "cuisine": "Thai", "guests": "4", "date": "2030-01-01",
+              "time": "19:00", "email": "someone@example.com"}
+    return {name: ({"value": {"originalValue": v, "interpretedValue": v, "resolvedValues": [v]}}
+                   if filled or name in ("city", "cuisine") else None)
+            for name, v in values.items()}
+
+
+class _FakeDDB:
+    """Returns the requested keys from an attribute-value catalog (no network)."""
+
+    def __init__(self, table, items):
+        self.table = table
+        self.rows = {it["business_id"]["S"]: it for it in items}
+
+    def batch_get_item(self, RequestItems):
+        keys = RequestItems[self.table]["Keys"]
+        return {"Responses": {self.table: [self.rows[k["business_id"]["S"]] for k in keys]}}
+
+
+# ---------- benchmarks ----------
+def build_benchmarks(sizes: list[int]) -> dict:
+    import aws_clients
+    import lambda_function_0 as lf0
+    import lambda_function_1 as lf1
+    import lambda_function_2 as lf2
+    import catalog_snapshot
+    import ddb_codec
+    import geo
+    import small_talk
+
+    benches = {}
+
+    # LF0: body parsing, each helper parsing on its own vs. the handler's single parse
+    event = api_gateway_event()
+    benches["lf0.parse_request"] = lambda: (lf0._get_message(event), lf0._get_session_id(event))
+
+    def parse_once():
+        body = lf0._parse_body(event)
+        return lf0._get_message(event, body), lf0._get_session_id(event, body)
+    benches["lf0.parse_request_once"] = parse_once
+
+    # LF0: compact reply, gzip-encoded when over RESPONSE_GZIP_MIN_BYTES
+    big = {"message": "x" * 2048, "sessionId": "s"}
+    benches["lf0.respond_gzip"] = lambda: lf0._respond(event, 200, big)
+
+    # LF0: small-talk matcher, a hit and a miss that has to fall through to Lex
+    benches["lf0.small_talk_match.hit"] = lambda: small_talk.match("Thank you so much!")
+    benches["lf0.small_talk_match.miss"] = lambda: small_talk.match("I'd like Thai food for 4 people tomorrow")
+
+    # LF1: slot validation
+    full, partial = lex_slots(True), lex_slots(False)
+    benches["lf1.validate.complete"] = lambda: lf1.validate(full)
+    benches["lf1.validate.missing_slot"] = lambda: lf1.validate(partial)
+    benches["lf1.val"] = lambda: lf1.val(full, "email")
+
+    # LF2: email body for SUGGESTION_COUNT picks
+    picks = [{"business_id": f"biz-{i}", "Name": f"Restaurant {i}", "Address": f"{i} Broadway, New York, NY"}
+             for i in range(lf2.SUGGESTION_COUNT)]
+    benches["lf2.format_email"] = lambda: lf2.format_email("thai", 4, "19:00", picks)
+
+    catalogs = {n: make_catalog(n, CUISINES, seed=n) for n in sizes}
+
+    # LF2: DynamoDB enrichment decode (cache cleared so every call decodes)
+    small = catalogs[min(sizes)]
+    fake = _FakeDDB(lf2.DDB_TABLE, small)
+    aws_clients.register_client("dynamodb", fake, lf2.REGION)
+    ids = [it["business_id"]["S"] for it in small[:lf2.SUGGESTION_COUNT]]
+
+    def enrich():
+        lf2._detail_cache.clear()
+        return lf2.batch_get_ddb_items_by_business_ids(ids)
+    benches["lf2.batch_get_unwrap"] = enrich
+
+    for n, items in catalogs.items():
+        # Seeder: attribute-value decode of a scanned catalog
+        benches[f"lf2.seed_unwrap.{n}"] = lambda items=items: list(ddb_codec.iter_items(items))
+        benches[f"lf2.seed_unwrap_projected.{n}"] = lambda items=items: list(
+            ddb_codec.iter_items(items, lf2.SEED_ATTRS))
+        # Seeder: NDJSON bulk lines for the whole catalog
+        benches[f"lf2.seed_bulk_lines.{n}"] = lambda items=items: [
+            lf2._index_op(d) for d in map(lf2.os_doc_from_item, items) if d]
+
+    # LF2: snapshot sampling, whole cuisine vs. one city's geohash cells
+    snap_path = os.path.join(tempfile.mkdtemp(prefix="micro-"), "catalog.snap")
+    catalog_snapshot.write_snapshot(snap_path, ddb_codec.iter_items(catalogs[max(sizes)]))
+    snap = catalog_snapshot.load(snap_path)
+    manhattan = geo.CITY_BOXES["manhattan"]
+    benches["lf2.snapshot_sample"] = lambda: snap.sample("thai", lf2.SUGGESTION_COUNT)
+    benches["lf2.snapshot_sample_city"] = lambda: snap.sample("thai", lf2.SUGGESTION_COUNT, bbox=manhattan)
+
+    return benches
+
+
+def measure(fn, repeat: int, min_time: float) -> dict:
+    timer = timeit.Timer(fn)
+    number, _ = timer.autorange()
+    # autorange targets ~0.2s; scale to min_time per repeat
+    number = max(1, int(number * min_time / 0.2))
+    runs = [t / number for t in timer.repeat(repeat=repeat, number=number)]
+    return {
+        "loops": number,
+        "repeat": repeat,
+        "median_us": round(statistics.median(runs) * 1e6, 3),
+        "min_us": round(min(runs) * 1e6, 3),
+        "stdev_us": round(statistics.stdev(runs) * 1e6, 3) if len(runs) > 1 else 0.0,
+    }
+
+
+def main(argv=None):
+    p = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    p.add_argument("-k", "--filter", default="", help="only benchmarks whose name contains this")
+    p.add_argument("--sizes", default="5000,100000", help="catalog sizes for the seeder benchmarks")
+    p.add_argument("--repeat", type=int, default=7)
+    p.add_argument("--min-time", type=float, default=0.2, help="seconds per repeat")
+    p.add_argument("--quick", action="store_true", help="3 repeats of ~0.05s, 5k catalog only")
+    p.add_argument("-o", "--output", help="also write the JSON report here")
+    p.add_argument("--compare", help="baseline JSON report to compare medians against")
+    args = p.parse_args(argv)
+
+    sizes = [int(x) for x in args.sizes.split(",")]
+    if args.quick:
+        args.repeat, args.min_time, sizes = 3, 0.05, [min(sizes)]
+
+    # LF modules log at import; keep the report clean
+    with open(os.devnull, "w") as devnull:
+        stdout, sys.stdout = sys.stdout, devnull
+        try:
+            benches = build_benchmarks(sizes)
+        finally:
+            sys.stdout = stdout
+
+    results = {}
+    for name, fn in sorted(benches.items()):
+        if args.filter in name:
+            results[name] = measure(fn, args.repeat, args.min_time)
+            print(f"{name:32s} {results[name]['median_us']:>14.3f} us", file=sys.stderr)
+
+    report = {
+        "python": platform.python_version(),
+        "implementation": platform.python_implementation(),
+        "machine": platform.machine(),
+        "benchmarks": results,
+    }
+    text = json.dumps(report, indent=2, sort_keys=True)
+    print(text)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text + "\n")
+
+    if args.compare:
+        with open(args.compare) as f:
+            base = json.load(f)["benchmarks"]
+        for name, r in results.items():
+            if name in base:
+                ratio = r["median_us"] / base[name]["median_us"]
+                print(f"{name:32s} {ratio:6.2f}x  ({base[name]['median_us']:.3f} -> {r['median_us']:.3f} us)",
+                      file=sys.stderr)
+    return report
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,89 @@
+import json, os, threading, time
+
+# Imported first by every Lambda, so this is (close to) the start of the init phase
+_INIT_STARTED = time.perf_counter()
+
+import boto3
+from botocore.config import Config
+
+CONNECT_TIMEOUT = float(os.environ.get("AWS_CONNECT_TIMEOUT", "2"))
+READ_TIMEOUT = float(os.environ.get("AWS_READ_TIMEOUT", "5"))
+MAX_ATTEMPTS = int(os.environ.get("AWS_MAX_ATTEMPTS", "3"))
+MAX_POOL_CONNECTIONS = int(os.environ.get("AWS_MAX_POOL_CONNECTIONS", "20"))
+
+# Calls that legitimately take longer than READ_TIMEOUT
+READ_TIMEOUT_OVERRIDES = {
+    "sqs": 25.0,             # long polling waits up to 20s
+    "lexv2-runtime": 10.0,   # recognize_text runs the LF1 code hook
+}
+
+_clients: dict[tuple[str, str | None, int | None], object] = {}
+_stand_ins: dict[tuple[str, str | None], object] = {}
+_lock = threading.Lock()
+client_init_ms: dict[str, float] = {}
+_function: str | None = None  # set by record_init, tags the client_init lines
+
+
+def _config(service: str, max_attempts: int | None = None) -> Config:
+    # A single attempt means the caller retries (throttle.Throttle): botocore's
+    # adaptive rate limiter would only be a second controller in front of it.
+    # (botocore's "max_attempts" counts retries; total_max_attempts includes the first call.)
+    retries = ({"mode": "standard", "total_max_attempts": 1} if max_attempts == 1
+               else {"mode": "adaptive", "max_attempts": max_attempts or MAX_ATTEMPTS})
+    return Config(
+        connect_timeout=CONNECT_TIMEOUT,
+        read_timeout=READ_TIMEOUT_OVERRIDES.get(service, READ_TIMEOUT),
+        retries=retries,
+        max_pool_connections=MAX_POOL_CONNECTIONS,
+        tcp_keepalive=True,
+    )
+
+
+def get_client(service: str, region_name: str | None = None, max_attempts: int | None = None):
+    """
+    boto3 client created on first use and kept for the container's lifetime.
+    Nothing is built at import, so e.g. a seed event never pays for SES.
+    max_attempts overrides AWS_MAX_ATTEMPTS (1 = no botocore retries).
+    """
+    key = (service, region_name, max_attempts)
+    client = _clients.get(key)
+    if client is not None:
+        return client
+    with _lock:  # boto3 client creation is not thread-safe
+        client = _clients.get(key)
+        if client is None and (service, region_name) in _stand_ins:
+            client = _clients[key] = _stand_ins[(service, region_name)]
+        if client is None:
+            started = time.perf_counter()
+            client = boto3.client(service, region_name=region_name, config=_config(service, max_attempts))
+            client_init_ms[service] = round((time.perf_counter() - started) * 1000, 2)
+            _clients[key] = client
+            # Once per client per container: the cost moved out of the init phase
+            # into the first invocation that needs it (compare with lambda_init)
+            print(json.dumps({"level": "INFO", "event": "client_init", "function": _function,
+                              "service": service, "init_ms": client_init_ms[service]}))
+    return client
+
+
+def register_client(service: str, client, region_name: str | None = None):
+    """Install a stand-in (tests, local benchmarks) in place of the real client, for any max_attempts."""
+    with _lock:
+        _stand_ins[(service, region_name)] = client
+        for key in [k for k in _clients if k[:2] == (service, region_name)]:
+            del _clients[key]
+
+
+def reset_clients():
+    with _lock:
+        _clients.clear()
+        _stand_ins.clear()
+        client_init_ms.clear()
+
+
+def record_init(function_name: str) -> float:
+    """Call at the end of a Lambda module: logs how long its init phase took."""
+    global _function
+    _function = function_name
+    init_ms = round((time.perf_counter() - _INIT_STARTED) * 1000, 2)
+    print(json.dumps({"level": "INFO", "event": "lambda_init", "function": function_name, "init_ms": init_ms}))
+    return init_ms
@@ -0,0 +1,197 @@
+import bisect, itertools, math, mmap, os, random, struct, sys, time
+from array import array
+
+import geo
+
+# ---------- Binary layout (little-endian) ----------
+# header   : magic, version, n_records, n_cuisines, n_members, pool_size, grid_precision, built_at
+# strings  : u32[3*n_records + n_cuisines + 1] offsets into pool
+#            record i -> strings 3i (business_id), 3i+1 (Name), 3i+2 (Address)
+#            cuisine k -> string 3*n_records + k (lowercase cuisine name)
+# cuisines : u32[n_cuisines + 1] offsets into members
+# members  : u32[n_members] record indices, grouped by cuisine, sorted by cell within a cuisine
+# cells    : u32[n_members] geohash (grid_precision) of each member, NO_CELL without coordinates
+# coords   : f32[2*n_records] latitude, longitude per record (~1 m precision; NaN without coordinates)
+# pool     : utf-8 bytes
+MAGIC = b"DCSNAP\x00\x01"
+VERSION = 2
+HEADER = struct.Struct("<8s6Id")
+GRID_PRECISION = 6   # ~1.2 x 0.6 km cells; must fit in u32 (<= 6)
+NO_CELL = 0xFFFFFFFF
+
+
+def write_snapshot(path: str, records, built_at: float | None = None) -> dict:
+    """
+    records: iterable of dicts with business_id, Name, Address, CuisineSet (str or list)
+    and optionally Coordinates {"latitude", "longitude"}.
+    Written to a temp file and renamed so readers never see a partial snapshot.
+    """
+    pool = bytearray()
+    str_offsets = array("I")
+    coords = array("f")
+    cell_of: list[int] = []
+    by_cuisine: dict[str, list[int]] = {}
+
+    def _add(s):
+        str_offsets.append(len(pool))
+        pool.extend((s or "").encode("utf-8"))
+
+    n = 0
+    for r in records:
+        bid = r.get("business_id")
+        cuisines = r.get("CuisineSet") or []
+        if isinstance(cuisines, str):
+            cuisines = [cuisines]
+        if not bid or not cuisines:
+            continue
+        _add(str(bid))
+        _add(r.get("Name"))
+        _add(r.get("Address"))
+        lat, lon = _coordinates(r.get("Coordinates"))
+        coords.extend((lat, lon))
+        cell_of.append(NO_CELL if math.isnan(lat) else geo.encode(lat, lon, GRID_PRECISION))
+        for c in {str(c).lower() for c in cuisines}:
+            by_cuisine.setdefault(c, []).append(n)
+        n += 1
+
+    cuisine_names = sorted(by_cuisine)
+    for c in cuisine_names:
+        _add(c)
+    str_offsets.append(len(pool))
+
+    cuisine_offsets, members, cells = array("I", [0]), array("I"), array("I")
+    for c in cuisine_names:
+        ordered = sorted(by_cuisine[c], key=cell_of.__getitem__)
+        members.extend(ordered)
+        cells.extend(cell_of[i] for i in ordered)
+        cuisine_offsets.append(len(members))
+
+    if sys.byteorder != "little":
+        for a in (str_offsets, cuisine_offsets, members, cells, coords):
+            a.byteswap()
+
+    built_at = time.time() if built_at is None else built_at
+    tmp = f"{path}.tmp"
+    with open(tmp, "wb") as f:
+        f.write(HEADER.pack(MAGIC, VERSION, n, len(cuisine_names), len(members), len(pool),
+                            GRID_PRECISION, built_at))
+        str_offsets.tofile(f)
+        cuisine_offsets.tofile(f)
+        members.tofile(f)
+        cells.tofile(f)
+        coords.tofile(f)
+        f.write(pool)
+    os.replace(tmp, path)
+    return {"records": n, "cuisines": len(cuisine_names), "bytes": os.path.getsize(path)}
+
+
+class CatalogSnapshot:
+    """Read-only, memory-mapped view of a snapshot written by write_snapshot."""
+
+    def __init__(self, path: str):
+        with open(path, "rb") as f:
+            self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, n, nc, nm, pool_size, precision, built_at = HEADER.unpack_from(self._mm, 0)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError(f"Not a catalog snapshot (v{VERSION}): {path}")
+        if sys.byteorder != "little":
+            raise ValueError("Catalog snapshots are little-endian only")
+
+        self.path = path
+        self.built_at = built_at
+        self.n_records = n
+        self.grid_precision = precision
+
+        view = memoryview(self._mm)
+        pos = HEADER.size
+        n_strings = 3 * n + nc
+        self._str_offsets = view[pos:pos + 4 * (n_strings + 1)].cast("I")
+        pos += 4 * (n_strings + 1)
+        self._cuisine_offsets = view[pos:pos + 4 * (nc + 1)].cast("I")
+        pos += 4 * (nc + 1)
+        self._members = view[pos:pos + 4 * nm].cast("I")
+        pos += 4 * nm
+        self._cells = view[pos:pos + 4 * nm].cast("I")
+        pos += 4 * nm
+        self._coords = view[pos:pos + 8 * n].cast("f")
+        pos += 8 * n
+        self._pool = view[pos:pos + pool_size]
+
+        # Only the (small) cuisine name -> slot table is materialized
+        self._cuisines = {self._str(3 * n + k): k for k in range(nc)}
+
+    def _str(self, i: int) -> str:
+        return str(self._pool[self._str_offsets[i]:self._str_offsets[i + 1]], "utf-8")
+
+    def age_seconds(self) -> float:
+        return time.time() - self.built_at
+
+    def cuisines(self) -> list[str]:
+        return list(self._cuisines)
+
+    def has_cuisine(self, cuisine: str) -> bool:
+        return cuisine.lower() in self._cuisines
+
+    def record(self, i: int) -> dict:
+        return {"business_id": self._str(3 * i), "Name": self._str(3 * i + 1), "Address": self._str(3 * i + 2)}
+
+    def _inside(self, p: int, bbox: tuple) -> bool:
+        i = self._members[p]
+        return geo.in_bbox(self._coords[2 * i], self._coords[2 * i + 1], bbox)
+
+    def _geo_candidates(self, lo: int, hi: int, bbox: tuple, n: int, rng) -> list[int]:
+        # members[lo:hi] are sorted by cell: each covering range is one bisect pair
+        spans = []
+        for c_lo, c_hi in geo.cover(bbox, self.grid_precision):
+            a = bisect.bisect_left(self._cells, c_lo, lo, hi)
+            b = bisect.bisect_left(self._cells, c_hi, a, hi)
+            if a < b:
+                spans.append((a, b))
+        total = sum(b - a for a, b in spans)
+        if total > 8 * n:
+            # Cells overhang the box only at its edges, so rejection sampling finds
+            # n points in a few tries without checking every candidate
+            ends = list(itertools.accumulate(b - a for a, b in spans))
+            picks: set[int] = set()
+            for _ in range(20 * n):
+                k = rng.randrange(total)
+                s = bisect.bisect_right(ends, k)
+                p = spans[s][1] - (ends[s] - k)
+                if p not in picks and self._inside(p, bbox):
+                    picks.add(p)
+                    if len(picks) == n:
+                        return list(picks)
+        inside = [p for a, b in spans for p in range(a, b) if self._inside(p, bbox)]
+        return rng.sample(inside, min(n, len(inside)))
+
+    def sample(self, cuisine: str, n: int, rng=random, bbox: tuple | None = None) -> list[dict]:
+        """n random restaurants of a cuisine, restricted to bbox (south, west, north, east) if given."""
+        k = self._cuisines.get(cuisine.lower())
+        if k is None:
+            return []
+        lo, hi = self._cuisine_offsets[k], self._cuisine_offsets[k + 1]
+        if bbox is not None:
+            picks = self._geo_candidates(lo, hi, bbox, n, rng)
+        else:
+            picks = rng.sample(range(lo, hi), min(n, hi - lo))
+        return [self.record(self._members[p]) for p in picks]
+
+
+def _coordinates(c) -> tuple[float, float]:
+    try:
+        return float(c["latitude"]), float(c["longitude"])
+    except (TypeError, KeyError, ValueError):
+        return math.nan, math.nan
+
+
+def load(path: str, max_age_seconds: float | None = None) -> CatalogSnapshot | None:
+    """Returns None when the snapshot is missing, unreadable or older than max_age_seconds."""
+    if not path or not os.path.exists(path):
+        return None
+    try:
+        snap = CatalogSnapshot(path)
+    except (OSError, ValueError, struct.error):
+        return None
+    if max_age_seconds is not None and snap.age_seconds() > max_age_seconds:
+        return None
+    return snap
@@ -0,0 +1,62 @@
+from decimal import Decimal
+
+# ---------- DynamoDB attribute-value JSON -> Python ----------
+# One decoder per number type, built once at import. Strings (the bulk of our
+# attributes) take a direct fast path, everything else one table lookup.
+# Numbers are float by default (what LF2 has always returned) or Decimal when asked.
+
+def _same(v):
+    return v
+
+def _make_decoder(num):
+    table = {}
+
+    def decode(av: dict):
+        s = av.get("S")
+        if s is not None:
+            return s
+        for tag in av:
+            f = table.get(tag)
+            return f(av[tag]) if f else None
+        return None
+
+    table.update({
+        "N": num,
+        "BOOL": _same,
+        "NULL": lambda v: None,
+        "M": lambda v: {k: decode(x) for k, x in v.items()},
+        "L": lambda v: [decode(x) for x in v],
+        "SS": list,
+        "NS": lambda v: [num(x) for x in v],
+        "B": _same,
+        "BS": list,
+    })
+    return decode
+
+_decode_float = _make_decoder(float)
+_decode_decimal = _make_decoder(Decimal)
+
+
+def unwrap(av: dict, decimals: bool = False):
+    """{"S": "x"} -> "x"; unknown/empty attribute values -> None."""
+    return (_decode_decimal if decimals else _decode_float)(av)
+
+
+def unwrap_item(item: dict, attrs=None, decimals: bool = False) -> dict:
+    """Decode an item; with attrs, only those attributes are decoded (and returned)."""
+    decode = _decode_decimal if decimals else _decode_float
+    if attrs is None:
+        return {k: decode(v) for k, v in item.items()}
+    return {k: decode(item[k]) for k in attrs if k in item}
+
+
+def iter_items(items, attrs=None, decimals: bool = False):
+    """Lazily decode an iterable of items (e.g. one scan page)."""
+    decode = _decode_decimal if decimals else _decode_float
+    if attrs is None:
+        for it in items:
+            yield {k: decode(v) for k, v in it.items()}
+    else:
+        for it in items:
+            yield {k: decode(it[k]) for k in attrs if k in it}
+
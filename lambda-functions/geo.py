@@ -0,0 +1,91 @@
+import re
+from functools import lru_cache
+
+# ---------- City -> bounding box ----------
+# (south, west, north, east) in degrees for the areas we have restaurants in.
+# LF1's city slot is free text ("Manhattan", "nyc", "Brooklyn, NY"), see normalize_city.
+CITY_BOXES = {
+    "manhattan":     (40.6995, -74.0200, 40.8820, -73.9070),
+    "brooklyn":      (40.5707, -74.0420, 40.7395, -73.8334),
+    "queens":        (40.5417, -73.9626, 40.8007, -73.7004),
+    "bronx":         (40.7855, -73.9339, 40.9153, -73.7654),
+    "staten island": (40.4960, -74.2557, 40.6490, -74.0522),
+    "new york":      (40.4774, -74.2591, 40.9176, -73.7004),
+}
+CITY_ALIASES = {
+    "nyc": "new york", "new york city": "new york", "ny": "new york",
+    "the bronx": "bronx", "manhattan nyc": "manhattan",
+}
+
+def normalize_city(city: str | None) -> str | None:
+    """'  Brooklyn, NY ' -> 'brooklyn'; aliases resolved; None for empty input."""
+    if not city:
+        return None
+    name = re.sub(r"\s+", " ", str(city).split(",")[0]).strip().lower()
+    return CITY_ALIASES.get(name, name) or None
+
+def bbox_for_city(city: str | None, boxes: dict | None = None) -> tuple | None:
+    """Bounding box for a city slot value, None when we don't know the city."""
+    name = normalize_city(city)
+    return (CITY_BOXES if boxes is None else boxes).get(name) if name else None
+
+def in_bbox(lat: float, lon: float, bbox: tuple) -> bool:
+    south, west, north, east = bbox
+    return south <= lat <= north and west <= lon <= east
+
+# ---------- Integer geohashes ----------
+# A geohash of precision p is 5*p bits interleaving longitude (first) and latitude
+# halvings; the integer form sorts like the base32 string, and every cell of a
+# coarser precision is one contiguous range of finer cells.
+
+def _split_bits(precision: int) -> tuple[int, int]:
+    bits = 5 * precision
+    return (bits + 1) // 2, bits // 2  # lon bits, lat bits
+
+def _grid(lat: float, lon: float, lon_bits: int, lat_bits: int) -> tuple[int, int]:
+    x = min(int((lon + 180.0) / 360.0 * (1 << lon_bits)), (1 << lon_bits) - 1)
+    y = min(int((lat + 90.0) / 180.0 * (1 << lat_bits)), (1 << lat_bits) - 1)
+    return max(x, 0), max(y, 0)
+
+def _interleave(x: int, y: int, lon_bits: int, lat_bits: int) -> int:
+    h = 0
+    for k in range(lon_bits + lat_bits):
+        if k % 2 == 0:
+            lon_bits -= 1
+            h = (h << 1) | ((x >> lon_bits) & 1)
+        else:
+            lat_bits -= 1
+            h = (h << 1) | ((y >> lat_bits) & 1)
+    return h
+
+def encode(lat: float, lon: float, precision: int) -> int:
+    lon_bits, lat_bits = _split_bits(precision)
+    x, y = _grid(lat, lon, lon_bits, lat_bits)
+    return _interleave(x, y, lon_bits, lat_bits)
+
+@lru_cache(maxsize=256)  # one entry per (city box, precision) in practice
+def cover(bbox: tuple, precision: int, max_cells: int = 64) -> tuple[tuple[int, int], ...]:
+    """
+    Sorted, merged [lo, hi) ranges of precision-`precision` geohashes whose cells
+    cover bbox. Uses the finest precision <= `precision` that needs at most
+    max_cells cells, so a large box costs a few wide ranges instead of many cells.
+    Cells overhang the box: callers check points exactly where it matters.
+    """
+    south, west, north, east = bbox
+    for p in range(precision, 0, -1):
+        lon_bits, lat_bits = _split_bits(p)
+        x0, y0 = _grid(south, west, lon_bits, lat_bits)
+        x1, y1 = _grid(north, east, lon_bits, lat_bits)
+        if (x1 - x0 + 1) * (y1 - y0 + 1) <= max_cells or p == 1:
+            break
+    shift = 5 * (precision - p)
+    cells = sorted(_interleave(x, y, lon_bits, lat_bits)
+                   for x in range(x0, x1 + 1) for y in range(y0, y1 + 1))
+    ranges: list[tuple[int, int]] = []
+    for c in cells:
+        lo, hi = c << shift, (c + 1) << shift
+        if ranges and ranges[-1][1] == lo:
+            ranges[-1] = (ranges[-1][0], hi)
+        else:
+            ranges.append((lo, hi))
+    return tuple(ranges)
@@ -0,0 +1,120 @@
+import threading
+import time
+from collections import OrderedDict
+
+from botocore.exceptions import ClientError
+
+import aws_clients
+
+NEW, COMPLETED, IN_PROGRESS = "new", "completed", "in_progress"
+
+
+def key_for(msg_body: dict) -> str | None:
+    """Idempotency key from the ids LF1 puts in the payload; None = can't dedupe this one."""
+    request_id = msg_body.get("requestId")
+    if not request_id:
+        return None
+    return f"{msg_body.get('sessionId') or '-'}#{request_id}"
+
+
+class IdempotencyStore:
+    """
+    DynamoDB-backed "have we done this request?" record (table PK: `pk` string,
+    TTL attribute: `expiresAt`), with an in-process LRU of completed keys in front.
+
+    claim()    -> NEW (caller owns the work), COMPLETED (skip it) or IN_PROGRESS
+                  (another consumer holds it; leave the message for later)
+    complete() -> after the email went out
+    release()  -> after a failure, so the SQS retry can claim it again
+    """
+
+    def __init__(self, table: str, region: str | None = None, ttl_seconds: int = 24 * 3600,
+                 lock_seconds: int = 60, cache_size: int = 10000):
+        self.table = table
+        self.region = region
+        self.ttl_seconds = ttl_seconds
+        self.lock_seconds = lock_seconds  # a crashed consumer's claim expires after this
+        self.cache_size = cache_size
+        self._completed: "OrderedDict[str, float]" = OrderedDict()
+        self.stats = {"cache_hits": 0, "claimed": 0, "duplicates": 0, "in_progress": 0}
+        self._lock = threading.Lock()  # cache + stats are shared by worker threads
+
+    def _ddb(self):
+        return aws_clients.get_client("dynamodb", self.region)
+
+    def _count(self, *names: str):
+        with self._lock:
+            for name in names:
+                self.stats[name] += 1
+
+    def _remember(self, key: str, expires: float):
+        with self._lock:
+            self._completed[key] = expires
+            self._completed.move_to_end(key)
+            while len(self._completed) > self.cache_size:
+                self._completed.popitem(last=False)
+
+    def claim(self, key: str) -> str:
+        now = time.time()
+        with self._lock:
+            expires = self._completed.get(key)
+            if expires is not None:
+                if expires > now:
+                    self.stats["cache_hits"] += 1
+                    self.stats["duplicates"] += 1
+                    return COMPLETED
+                del self._completed[key]
+
+        try:
+            self._ddb().put_item(
+                TableName=self.table,
+                Item={
+                    "pk": {"S": key},
+                    "status": {"S": "IN_PROGRESS"},
+                    "lockUntil": {"N": str(int(now + self.lock_seconds))},
+                    "expiresAt": {"N": str(int(now + self.ttl_seconds))},
+                },
+                ConditionExpression=("attribute_not_exists(pk) OR expiresAt < :now"
+                                     " OR (#s = :inprog AND lockUntil < :now)"),
+                ExpressionAttributeNames={"#s": "status"},
+                ExpressionAttributeValues={":now": {"N": str(int(now))}, ":inprog": {"S": "IN_PROGRESS"}},
+            )
+            self._count("claimed")
+            return NEW
+        except ClientError as e:
+            if e.response.get("Error", {}).get("Code") != "ConditionalCheckFailedException":
+                raise
+
+        item = self._ddb().get_item(TableName=self.table, Key={"pk": {"S": key}},
+                                    ConsistentRead=True).get("Item", {})
+        if item.get("status", {}).get("S") == "COMPLETED":
+            self._remember(key, float(item.get("expiresAt", {}).get("N", now + self.ttl_seconds)))
+            self._count("duplicates")
+            return COMPLETED
+        self._count("in_progress")
+        return IN_PROGRESS
+
+    def complete(self, key: str):
+        expires = int(time.time() + self.ttl_seconds)
+        self._ddb().update_item(
+            TableName=self.table,
+            Key={"pk": {"S": key}},
+            UpdateExpression="SET #s = :done, expiresAt = :exp REMOVE lockUntil",
+            ExpressionAttributeNames={"#s": "status"},
+            ExpressionAttributeValues={":done": {"S": "COMPLETED"}, ":exp": {"N": str(expires)}},
+        )
+        self._remember(key, expires)
+
+    def release(self, key: str):
+        try:
+            self._ddb().delete_item(
+                TableName=self.table,
+                Key={"pk": {"S": key}},
+                ConditionExpression="#s = :inprog",
+                ExpressionAttributeNames={"#s": "status"},
+                ExpressionAttributeValues={":inprog": {"S": "IN_PROGRESS"}},
+            )
+        except ClientError as e:
+            # Already completed by someone else, or already gone: nothing to release
+            if e.response.get("Error", {}).get("Code") != "ConditionalCheckFailedException":
+                raise
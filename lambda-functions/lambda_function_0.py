@@ -1,13 +1,39 @@
-import json, os, uuid, logging, boto3
+import aws_clients  # first: times the init phase
+import base64, gzip, json, os, random, uuid, logging
+from collections import OrderedDict
+
+import small_talk
+import tracing
 
 logger = logging.getLogger()
 logger.setLevel(logging.INFO)
 
-LEX = boto3.client("lexv2-runtime")
 BOT_ID = os.environ["LEX_BOT_ID"]
 BOT_ALIAS_ID = os.environ["LEX_BOT_ALIAS_ID"]
 BOT_LOCALE = os.environ.get("LEX_BOT_LOCALE", "en_US")
 
+# "full" = reply + Lex sessionState/interpretations (original), "compact" = reply + sessionId
+# (+ a slot summary when asked for). Clients can pick per request: {"compact": true,
+# "slots": true} in the body, or X-Response-Mode: compact / X-Include-Slots: true headers.
+RESPONSE_MODE = os.environ.get("RESPONSE_MODE", "full").lower()
+# gzip response bodies of at least RESPONSE_GZIP_MIN_BYTES when Accept-Encoding allows it.
+# Off by default: a REST API needs binary media types (*/*) so API Gateway decodes the
+# base64 body; HTTP APIs handle isBase64Encoded natively.
+RESPONSE_GZIP = os.environ.get("RESPONSE_GZIP", "off").lower() == "on"
+RESPONSE_GZIP_MIN_BYTES = int(os.environ.get("RESPONSE_GZIP_MIN_BYTES", "1024"))
+# Fraction of chat turns whose full API Gateway event is logged (1 = every event)
+EVENT_LOG_SAMPLE_RATE = float(os.environ.get("EVENT_LOG_SAMPLE_RATE", "0.01"))
+
+# "on" = answer greeting/thank-you messages locally when no dialog is in progress
+SMALL_TALK = os.environ.get("SMALL_TALK", "on").lower() == "on"
+SESSION_CACHE_SIZE = int(os.environ.get("SESSION_CACHE_SIZE", "10000"))
+SMALL_TALK_REPORT_EVERY = int(os.environ.get("SMALL_TALK_REPORT_EVERY", "100"))  # turns between hit-rate lines
+
+def log_json(level: str, **fields):
+    print(json.dumps({"level": level, **fields}, ensure_ascii=False))
+
+tracer = tracing.Tracer("lf0", log_json)
+
 def _parse_body(event):
     body = event.get("body")
     if isinstance(body, str):
@@ -17,59 +43,175 @@ def _parse_body(event):
             body = {}
     return body or {}
 
-def _get_message(event):
-    body = _parse_body(event)
+def _get_message(event, body=None):
+    body = _parse_body(event) if body is None else body
     qsp  = event.get("queryStringParameters") or {}
     return body.get("message") or body.get("text") or qsp.get("message")
 
-def _get_session_id(event):
-    body = _parse_body(event)
-    qsp  = event.get("queryStringParameters") or {}
+def _client_session_id(event, body):
+    qsp = event.get("queryStringParameters") or {}
+    return body.get("sessionId") or qsp.get("sessionId")
+
+def _get_session_id(event, body=None):
+    body = _parse_body(event) if body is None else body
 
     # Prefer client-provided sessionId (body or query)
-    sid = body.get("sessionId") or qsp.get("sessionId")
+    sid = _client_session_id(event, body)
     if not sid:
         # Generate once per browser tab; front-end should persist & resend this
         sid = str(uuid.uuid4())
     return sid
 
+def _header(event, name: str):
+    # API Gateway keeps the client's header casing
+    name = name.lower()
+    for k, v in (event.get("headers") or {}).items():
+        if k.lower() == name:
+            return v
+    return None
+
+def _flag(value) -> bool:
+    return value is True or str(value).lower() in ("1", "true", "yes", "compact")
+
+def _response_options(event, body) -> tuple[bool, bool]:
+    """(compact, include_slots) for this request."""
+    mode = body.get("compact")
+    if mode is None:
+        mode = _header(event, "X-Response-Mode") or RESPONSE_MODE
+    slots = body.get("slots")
+    if slots is None:
+        slots = _header(event, "X-Include-Slots")
+    return _flag(mode), _flag(slots)
+
+def _slot_summary(lex_resp: dict) -> dict:
+    """Intent name/state and the slots filled so far, as plain values."""
+    intent = lex_resp.get("sessionState", {}).get("intent") or {}
+    filled = {}
+    for name, slot in (intent.get("slots") or {}).items():
+        value = (slot or {}).get("value") or {}
+        v = value.get("interpretedValue") or value.get("originalValue")
+        if v:
+            filled[name] = v
+    return {"intent": intent.get("name"), "state": intent.get("state"), "slots": filled}
+
+def _accepts_gzip(event) -> bool:
+    for enc in (_header(event, "Accept-Encoding") or "").split(","):
+        name, _, q = enc.strip().partition(";")
+        if name.strip().lower() in ("gzip", "*"):
+            return q.replace(" ", "") not in ("q=0", "q=0.0", "q=0.00", "q=0.000")
+    return False
+
+def _respond(event, status: int, payload: dict, trace_id: str | None = None) -> dict:
+    body = json.dumps(payload, separators=(",", ":"))
+    headers = _cors()
+    if trace_id:
+        headers[tracing.TRACE_HEADER] = trace_id
+    if RESPONSE_GZIP:
+        headers["Vary"] = "Accept-Encoding"
+        if len(body) >= RESPONSE_GZIP_MIN_BYTES and _accepts_gzip(event):
+            headers["Content-Encoding"] = "gzip"
+            return {"statusCode": status, "headers": headers, "isBase64Encoded": True,
+                    "body": base64.b64encode(gzip.compress(body.encode("utf-8"), compresslevel=5)).decode("ascii")}
+    return {"statusCode": status, "headers": headers, "body": body}
+
+# ---------- Small-talk fast path ----------
+# Dialog state of recent sessions as Lex last reported it (True = a slot dialog is
+# open). Process-local: a session this container hasn't seen always goes to Lex.
+_sessions: "OrderedDict[str, bool]" = OrderedDict()
+small_talk_stats = {"turns": 0, "fast_path": 0}
+
+def _dialog_open(lex_resp: dict) -> bool:
+    state = lex_resp.get("sessionState") or {}
+    action = (state.get("dialogAction") or {}).get("type")
+    if action:
+        return action in ("ElicitSlot", "ConfirmIntent", "Delegate")
+    return (state.get("intent") or {}).get("state") in ("InProgress", "ReadyForFulfillment")
+
+def _remember(session_id: str, dialog_open: bool):
+    _sessions[session_id] = dialog_open
+    _sessions.move_to_end(session_id)
+    while len(_sessions) > SESSION_CACHE_SIZE:
+        _sessions.popitem(last=False)
+
+def _small_talk(msg: str, session_id: str, new_session: bool) -> str | None:
+    """Intent to answer locally, or None to go through Lex."""
+    if not SMALL_TALK:
+        return None
+    if not new_session and _sessions.get(session_id, True):
+        return None  # dialog in progress, or unknown to this container
+    return small_talk.match(msg)
+
+def _count_turn(fast_path: bool):
+    small_talk_stats["turns"] += 1
+    small_talk_stats["fast_path"] += fast_path
+    if small_talk_stats["turns"] % SMALL_TALK_REPORT_EVERY == 0:
+        log_json("INFO", event="small_talk", **small_talk_stats,
+                 hit_rate=round(small_talk_stats["fast_path"] / small_talk_stats["turns"], 4),
+                 sessions=len(_sessions))
+
+def _local_lex_response(intent: str) -> dict:
+    """The parts of a RecognizeText response the handler reads, for a locally closed intent."""
+    return {
+        "messages": [{"contentType": "PlainText", "content": small_talk.reply(intent)}],
+        "sessionState": {"dialogAction": {"type": "Close"},
+                         "intent": {"name": intent, "state": "Fulfilled", "slots": {}}},
+        "interpretations": [{"intent": {"name": intent, "state": "Fulfilled"}}],
+    }
+
 def _cors():
     return {
         "Content-Type": "application/json",
         "Access-Control-Allow-Origin": "*",
-        "Access-Control-Allow-Headers": "Content-Type,X-Requested-With,Authorization,X-Api-Key",
-        "Access-Control-Allow-Methods": "OPTIONS,POST,GET"
+        "Access-Control-Allow-Headers": "Content-Type,X-Requested-With,Authorization,X-Api-Key,X-Response-Mode,X-Include-Slots,X-Trace-Id",
+        "Access-Control-Allow-Methods": "OPTIONS,POST,GET",
+        "Access-Control-Expose-Headers": "X-Trace-Id"
     }
 
+aws_clients.record_init("lf0")
+
 def lambda_handler(event, context):
-    logger.info("EVENT %s", json.dumps(event))
-    msg = _get_message(event)
+    if random.random() < EVENT_LOG_SAMPLE_RATE:
+        logger.info("EVENT %s", json.dumps(event))
+    body = _parse_body(event)
+    msg = _get_message(event, body)
     if not msg:
-        return {"statusCode": 400, "headers": _cors(), "body": json.dumps({"error": "No message provided"})}
+        return _respond(event, 400, {"error": "No message provided"})
 
-    session_id = _get_session_id(event)
+    new_session = not _client_session_id(event, body)
+    session_id = _get_session_id(event, body)
+    compact, include_slots = _response_options(event, body)
+    trace_id = _header(event, tracing.TRACE_HEADER) or tracing.new_trace_id()
 
-    lex_resp = LEX.recognize_text(
-        botId=BOT_ID,
-        botAliasId=BOT_ALIAS_ID,
-        localeId=BOT_LOCALE,
-        sessionId=session_id,
-        text=msg
-    )
+    local_intent = _small_talk(msg, session_id, new_session)
+    if local_intent:
+        lex_resp = _local_lex_response(local_intent)
+    else:
+        with tracer.timer("lex_call", trace_id):
+            lex_resp = aws_clients.get_client("lexv2-runtime").recognize_text(
+                botId=BOT_ID,
+                botAliasId=BOT_ALIAS_ID,
+                localeId=BOT_LOCALE,
+                sessionId=session_id,
+                text=msg,
+                # LF1 reads it from the code hook event and forwards it with the SQS message
+                sessionState={"sessionAttributes": {tracing.TRACE_ATTR: trace_id}}
+            )
+    _remember(session_id, _dialog_open(lex_resp))
+    _count_turn(local_intent is not None)
 
     # Collect reply text(s) if any
     texts = [m.get("content") for m in lex_resp.get("messages", []) if m.get("content")]
     reply = " ".join(texts) if texts else "OK."
 
-    return {
-        "statusCode": 200,
-        "headers": _cors(),
-        "body": json.dumps({
-            "message": reply,
-            "sessionId": session_id,               # send back so the client can reuse it
-            "lex": {
-                "sessionState": lex_resp.get("sessionState", {}),
-                "interpretations": lex_resp.get("interpretations", [])
-            }
-        })
+    payload = {
+        "message": reply,
+        "sessionId": session_id,               # send back so the client can reuse it
     }
+    if not compact:
+        payload["lex"] = {
+            "sessionState": lex_resp.get("sessionState", {}),
+            "interpretations": lex_resp.get("interpretations", [])
+        }
+    elif include_slots:
+        payload["dialog"] = _slot_summary(lex_resp)
+    return _respond(event, 200, payload, trace_id)
@@ -1,28 +1,36 @@
+import aws_clients  # first: times the init phase
 import json
 import logging
 import os                      # NEW
-import boto3                   # NEW
+import small_talk
+import tracing
 from datetime import datetime  # NEW
 
 logger = logging.getLogger()
 logger.setLevel(logging.INFO)
 
-# ------- SQS client (module scope) -------
-SQS = boto3.client("sqs")
+# ------- SQS client (created lazily, only fulfillment needs it) -------
 QUEUE_URL = os.environ.get("QUEUE_URL", "")
 
-def send_to_sqs(payload: dict):
+def log_json(level: str, **fields):
+    print(json.dumps({"level": level, **fields}, ensure_ascii=False))
+
+tracer = tracing.Tracer("lf1", log_json)
+
+def send_to_sqs(payload: dict, trace_id: str | None = None):
     if not QUEUE_URL:
         logger.error("QUEUE_URL env var is not set")
         return False
     try:
-        resp = SQS.send_message(
-            QueueUrl=QUEUE_URL,
-            MessageBody=json.dumps(payload)
-            # For FIFO queues, also pass:
-            # MessageGroupId="dining-requests",
-            # MessageDeduplicationId=payload.get("dedupe_id", str(time.time()))
-        )
+        with tracer.timer("sqs_enqueue", trace_id):
+            resp = aws_clients.get_client("sqs").send_message(
+                QueueUrl=QUEUE_URL,
+                MessageBody=json.dumps(payload),
+                MessageAttributes=tracing.message_attributes(trace_id)
+                # For FIFO queues, also pass:
+                # MessageGroupId="dining-requests",
+                # MessageDeduplicationId=payload.get("dedupe_id", str(time.time()))
+            )
         logger.info("SQS send OK: %s", resp.get("MessageId"))
         return True
     except Exception as e:
@@ -122,10 +130,10 @@ def validate(slots):
 
 # ---------- intent handlers ----------
 def handle_greeting(event, src):
-    return close(event, "Hi there, how can I help?")
+    return close(event, small_talk.reply("GreetingIntent"))
 
 def handle_thankyou(event, src):
-    return close(event, "You're welcome.")
+    return close(event, small_talk.reply("ThankYouIntent"))
 
 def handle_dining(event, src):
     slots = get_slots(event)
@@ -158,7 +166,8 @@ def handle_dining(event, src):
         "email": email
     }
 
-    queued = send_to_sqs(sqs_payload)
+    attrs = event.get("sessionState", {}).get("sessionAttributes") or {}
+    queued = send_to_sqs(sqs_payload, attrs.get(tracing.TRACE_ATTR))
 
     if queued:
         msg = (f"Great — {guests} for {cuisine} in {city} on {date} at {time}. "
@@ -169,6 +178,8 @@ def handle_dining(event, src):
 
     return close(event, msg)
 
+aws_clients.record_init("lf1")
+
 # ---------- router ----------
 def lambda_handler(event, context):
     logger.info("EVENT: %s", json.dumps(event))
@@ -1,13 +1,18 @@
-import os, json, logging, random, traceback
-from urllib.parse import urlparse
-import urllib3
-
-import boto3
-from botocore.auth import SigV4Auth
-from botocore.awsrequest import AWSRequest
-from botocore.session import get_session
+import aws_clients  # first: times the init phase
+import os, json, logging, queue, random, resource, threading, time, traceback
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
 from botocore.exceptions import ClientError
 
+from opensearch_client import OpenSearchClient, OpenSearchError
+import catalog_snapshot
+import ddb_codec
+import geo
+import idempotency
+import throttle
+import tracing
+
 logger = logging.getLogger()
 logger.setLevel(logging.INFO)
 
@@ -18,79 +23,306 @@ DDB_PK_NAME = os.environ.get("DDB_PK_NAME", "business_id")
 ES_ENDPOINT = os.environ["OPENSEARCH_ENDPOINT"].rstrip("/")
 ES_INDEX = os.environ.get("ES_INDEX", "restaurants")
 SUGGESTION_COUNT = int(os.environ.get("SUGGESTION_COUNT", "3"))
-MAX_PER_RUN = int(os.environ.get("MAX_PER_RUN", "1"))
+# "single"   = one receive/delete per message (original behaviour),
+# "batch"    = receive up to RECEIVE_BATCH_SIZE per call and ack with delete_message_batch
+# "adaptive" = batch, but keep draining while the invocation has time left for another
+#              batch (MAX_PER_RUN is ignored), with visibility heartbeats for in-flight messages
+CONSUMER_MODE = os.environ.get("CONSUMER_MODE", "single").lower()
+RECEIVE_BATCH_SIZE = max(1, min(10, int(os.environ.get("RECEIVE_BATCH_SIZE", "10"))))  # SQS max is 10
+# Messages per invocation: 1 in single mode (original), a few receives' worth in batch mode
+MAX_PER_RUN = int(os.environ.get("MAX_PER_RUN") or (1 if CONSUMER_MODE == "single" else 5 * RECEIVE_BATCH_SIZE))
+RECEIVE_WAIT_SECONDS = max(0, min(20, int(os.environ.get("RECEIVE_WAIT_SECONDS", "0"))))  # long polling, SQS max is 20
+VISIBILITY_TIMEOUT = 45  # retry cadence for failed messages
+# adaptive mode: messages are received with HEARTBEAT_VISIBILITY and extended by that much
+# every HEARTBEAT_INTERVAL while they are being worked on; DRAIN_RESERVE_MS is kept back
+# for acks/releases before the Lambda timeout
+HEARTBEAT_VISIBILITY = int(os.environ.get("HEARTBEAT_VISIBILITY", "30"))
+HEARTBEAT_INTERVAL = float(os.environ.get("HEARTBEAT_INTERVAL", "10"))
+DRAIN_RESERVE_MS = int(os.environ.get("DRAIN_RESERVE_MS", "3000"))
+DRAIN_INITIAL_COST_MS = float(os.environ.get("DRAIN_INITIAL_COST_MS", "1000"))  # before the first measurement
+DRAIN_COST_MARGIN = float(os.environ.get("DRAIN_COST_MARGIN", "1.5"))
 SES_SENDER = os.environ["SES_SENDER"]
+# "single" = one ses.send_email per request, "bulk" = batches go through an SES template
+# with send_bulk_templated_email (up to 50 destinations per call)
+EMAIL_MODE = os.environ.get("EMAIL_MODE", "single").lower()
+SES_TEMPLATE_NAME = os.environ.get("SES_TEMPLATE_NAME", "DiningSuggestions")
+SES_BULK_LIMIT = 50  # SendBulkTemplatedEmail max destinations per call
+# Local catalog snapshot (other-scripts/build_catalog_snapshot.py); OpenSearch + DDB are
+# only used when it is missing, older than CATALOG_SNAPSHOT_MAX_AGE or lacks the cuisine
+CATALOG_SNAPSHOT_PATH = os.environ.get(
+    "CATALOG_SNAPSHOT_PATH", os.path.join(os.path.dirname(os.path.abspath(__file__)), "catalog.snap"))
+CATALOG_SNAPSHOT_MAX_AGE = float(os.environ.get("CATALOG_SNAPSHOT_MAX_AGE", str(7 * 24 * 3600)))
+
+# Duplicate-delivery protection; disabled when IDEMPOTENCY_TABLE is unset
+IDEMPOTENCY_TABLE = os.environ.get("IDEMPOTENCY_TABLE", "")
+IDEMPOTENCY_TTL = int(os.environ.get("IDEMPOTENCY_TTL", str(24 * 3600)))
+
+# "ids" = index only business_id + CuisineSet and enrich hits from DynamoDB (original),
+# "denormalized" = the index also carries DENORMALIZED_FIELDS so searches skip DynamoDB
+# (reseed, or let the stream sync catch up, after switching this on)
+INDEX_MODE = os.environ.get("INDEX_MODE", "ids").lower()
+DENORMALIZED_FIELDS = ("Name", "Address", "Rating", "NumberOfReviews", "ZipCode")
+SEARCH_SOURCE = ["business_id", "CuisineSet"] + (list(DENORMALIZED_FIELDS) if INDEX_MODE == "denormalized" else [])
+
+# "off" = sample from the whole cuisine (original), "city" = only restaurants inside the
+# requested city's bounding box, in the snapshot and in OpenSearch (needs a reseed so
+# documents carry `location`). Cities without a known box are not filtered.
+# GEO_CITY_BOXES adds/overrides boxes: {"hoboken": [south, west, north, east]}
+GEO_FILTER = os.environ.get("GEO_FILTER", "off").lower()
+CITY_BOXES = {**geo.CITY_BOXES, **{geo.normalize_city(k): tuple(v) for k, v in
+                                   json.loads(os.environ.get("GEO_CITY_BOXES") or "{}").items()}}
+
+# Client-side throttling per backend (throttle.py): AIMD concurrency limits up to
+# THROTTLE_MAX_CONCURRENCY, short in-invocation retries of throttling errors, and for SES
+# a token bucket at MaxSendRate * SES_RATE_SHARE (the share of the account quota this
+# consumer may use when several run at once)
+THROTTLE_MAX_CONCURRENCY = int(os.environ.get("THROTTLE_MAX_CONCURRENCY", "16"))
+THROTTLE_MAX_RETRIES = int(os.environ.get("THROTTLE_MAX_RETRIES", "2"))
+SES_RATE_SHARE = float(os.environ.get("SES_RATE_SHARE", "1.0"))
+
+# boto3 clients are created on first use (a seed event never builds SQS/SES).
+# Calls made through a Throttle (below) use clients without botocore retries, so the
+# throttle is the one retry layer and its AIMD limit sees every throttling error.
+def sqs():
+    return aws_clients.get_client("sqs", REGION)
 
-sqs = boto3.client("sqs", region_name=REGION)
-ddb = boto3.client("dynamodb", region_name=REGION)
-ses = boto3.client("ses", region_name=REGION)
-http = urllib3.PoolManager()
+def ddb(throttled: bool = False):
+    return aws_clients.get_client("dynamodb", REGION, max_attempts=1 if throttled else None)
+
+def ses():
+    return aws_clients.get_client("ses", REGION, max_attempts=1)
+
+# Shared across warm invocations: cached credentials + keep-alive pool
+os_client = OpenSearchClient(
+    ES_ENDPOINT, REGION,
+    max_retries=int(os.environ.get("OS_MAX_RETRIES", "3")),
+    gzip_min_bytes=int(os.environ.get("OS_GZIP_MIN_BYTES", "1024")),
+)
 
 # ---------- Structured logging helper ----------
 def log_json(level: str, **fields):
     # one-line JSON for easy screenshots & filtering in CWL
     print(json.dumps({"level": level, **fields}, ensure_ascii=False))
 
+# Stage timings (EMF) tagged with the trace IDs of the messages being handled
+tracer = tracing.Tracer("lf2", log_json)
+
+# ---------- Backend throttles (survive warm invocations) ----------
+def _ses_send_rate() -> float | None:
+    """This consumer's share of the account's SES MaxSendRate; raises if the quota can't be read."""
+    try:
+        rate = float(ses().get_send_quota().get("MaxSendRate", 0)) * SES_RATE_SHARE
+    except Exception as e:
+        # the throttle sends unpaced for now and asks again after a backoff
+        log_json("WARN", event="ses_quota_unavailable", error={"type": type(e).__name__, "message": str(e)[:300]})
+        raise
+    log_json("INFO", event="ses_send_rate", rate=rate)
+    return rate
+
+throttles = {
+    # the OpenSearch client already retries 429s with backoff; it only reports them here
+    "opensearch": throttle.Throttle("opensearch", max_limit=THROTTLE_MAX_CONCURRENCY, max_retries=0),
+    "dynamodb": throttle.Throttle("dynamodb", max_limit=THROTTLE_MAX_CONCURRENCY,
+                                  max_retries=THROTTLE_MAX_RETRIES),
+    "ses": throttle.Throttle("ses", max_limit=THROTTLE_MAX_CONCURRENCY, max_retries=THROTTLE_MAX_RETRIES,
+                             rate_source=_ses_send_rate),
+}
+os_client.on_throttle = throttles["opensearch"].throttled
+
+def throttle_metrics() -> dict:
+    return {name: t.metrics() for name, t in throttles.items()}
+
+idem_store = idempotency.IdempotencyStore(
+    IDEMPOTENCY_TABLE, REGION, ttl_seconds=IDEMPOTENCY_TTL) if IDEMPOTENCY_TABLE else None
+
+# Memory-mapped at cold start; pages are shared and loaded lazily by the OS
+catalog = catalog_snapshot.load(CATALOG_SNAPSHOT_PATH, CATALOG_SNAPSHOT_MAX_AGE)
+log_json(
+    "INFO",
+    event="catalog_snapshot",
+    loaded=catalog is not None,
+    path=CATALOG_SNAPSHOT_PATH,
+    records=catalog.n_records if catalog else 0,
+    age_s=round(catalog.age_seconds()) if catalog else None
+)
+
+def sample_from_catalog(cuisine: str, n: int, bbox: tuple | None = None) -> list[dict] | None:
+    """Pick n restaurants locally; None means fall back to OpenSearch + DynamoDB."""
+    if catalog is None or catalog.age_seconds() > CATALOG_SNAPSHOT_MAX_AGE:
+        return None
+    picks = catalog.sample(cuisine, n, bbox=bbox)
+    return picks or None
+
 def os_signed_request(method: str, path: str, body: dict | None):
-    url = f"{ES_ENDPOINT}{path}"
-    data = json.dumps(body).encode("utf-8") if body is not None else None
-    host = urlparse(ES_ENDPOINT).netloc
-    headers = {"host": host, "content-type": "application/json"} if data else {"host": host}
-
-    session = get_session()
-    creds = session.get_credentials()
-    req = AWSRequest(method=method, url=url, data=data, headers=headers)
-    SigV4Auth(creds, "es", REGION).add_auth(req)
-    signed_headers = dict(req.headers.items())
-
-    resp = http.request(method, url, body=data, headers=signed_headers, timeout=urllib3.Timeout(connect=3.0, read=8.0))
-    if resp.status >= 400:
-        raise RuntimeError(f"OpenSearch {resp.status}: {resp.data[:200]}")
-    return json.loads(resp.data.decode("utf-8")) if resp.data else {}
-
-def get_random_restaurant_ids_by_cuisine(cuisine: str, n: int) -> list[str]:
+    # Raises OpenSearchError (a RuntimeError) on >= 400 after retries
+    return throttles["opensearch"].call(os_client.request, method, path, body)
+
+def _city_bbox(city: str | None) -> tuple | None:
+    return geo.bbox_for_city(city, CITY_BOXES) if GEO_FILTER == "city" else None
+
+def _sample_query(cuisine: str, n: int, bbox: tuple | None = None) -> dict:
+    match = {"term": {"CuisineSet": cuisine}}
+    if bbox is not None:
+        south, west, north, east = bbox
+        # filter context: cached by OpenSearch and applied before scoring
+        match = {"bool": {"filter": [match, {"geo_bounding_box": {"location": {
+            "top_left": {"lat": north, "lon": west},
+            "bottom_right": {"lat": south, "lon": east}}}}]}}
     # function_score + random_score to sample randomly by cuisine
-    query = {
+    return {
         "size": n,
         "query": {
             "function_score": {
-                "query": { "term": { "CuisineSet": cuisine } },
+                "query": match,
                 "random_score": {}  # per-request randomization
             }
         },
-        "_source": ["business_id", "CuisineSet"]
+        "_source": SEARCH_SOURCE
     }
-    res = os_signed_request("POST", f"/{ES_INDEX}/_search", query)
+
+def get_random_restaurants_by_cuisine(cuisine: str, n: int, bbox: tuple | None = None) -> list[dict]:
+    """Random hits for a cuisine (inside bbox, if given) as their _source dicts (each with a business_id)."""
+    with tracer.timer("opensearch_search", searches=1):
+        res = os_signed_request("POST", f"/{ES_INDEX}/_search", _sample_query(cuisine, n, bbox))
     total = res.get("hits", {}).get("total")
     hits = res.get("hits", {}).get("hits", [])
-    logger.info("OS search: cuisine=%s size=%s total=%s hits=%s", cuisine, n, total, len(hits))
-    ids = []
+    logger.info("OS search: cuisine=%s bbox=%s size=%s total=%s hits=%s latency_ms=%.1f",
+                cuisine, bbox, n, total, len(hits), os_client.last_latency_ms)
+    docs = []
     for h in hits:
         src = h.get("_source", {})
         logger.info("hit _source: %s", src)  # debug; safe to remove later
-        rid = src.get("business_id")
-        if rid:
-            ids.append(rid)
-    logger.info("collected ids: %s", ids)
-    return ids
+        if src.get("business_id"):
+            docs.append(src)
+    logger.info("collected ids: %s", [d["business_id"] for d in docs])
+    return docs
+
+def get_random_restaurants_by_cuisines(wants: dict[tuple[str, tuple | None], int]
+                                       ) -> dict[tuple[str, tuple | None], list[dict] | Exception]:
+    """
+    One round trip for several searches: {(cuisine, bbox): n} -> {(cuisine, bbox): hit _source dicts}.
+    A single search uses a plain _search, more use one _msearch; a failed
+    sub-search is returned as its exception so only those requests fail.
+    """
+    if len(wants) == 1:
+        ((cuisine, bbox), n), = wants.items()
+        return {(cuisine, bbox): get_random_restaurants_by_cuisine(cuisine, n, bbox)}
+
+    cuisines = list(wants)
+    lines = []
+    for c in cuisines:
+        lines.append(json.dumps({"index": ES_INDEX}))
+        lines.append(json.dumps(_sample_query(c[0], wants[c], c[1])))
+    def msearch(payload: bytes):
+        resp = os_client.request_raw("POST", "/_msearch", payload, "application/x-ndjson")
+        if resp.status >= 400:
+            raise OpenSearchError(resp.status, resp.data)
+        return resp
+    with tracer.timer("opensearch_search", searches=len(wants)):
+        resp = throttles["opensearch"].call(msearch, ("\n".join(lines) + "\n").encode("utf-8"))
+    responses = json.loads(resp.data.decode("utf-8")).get("responses", [])
+
+    out = {}
+    for c, r in zip(cuisines, responses):
+        if r.get("error"):
+            out[c] = RuntimeError(f"OpenSearch msearch failed for cuisine={c[0]}: {str(r['error'])[:200]}")
+            continue
+        out[c] = [h["_source"] for h in r.get("hits", {}).get("hits", [])
+                  if h.get("_source", {}).get("business_id")]
+    logger.info("OS msearch: cuisines=%s latency_ms=%.1f", [(c[0], len(v) if isinstance(v, list) else "error")
+                for c, v in out.items()], os_client.last_latency_ms)
+    return out
+
+def _has_details(docs: list[dict]) -> bool:
+    """True when search hits already carry everything format_email needs (denormalized index)."""
+    return INDEX_MODE == "denormalized" and all(d.get("Name") and d.get("Address") for d in docs)
+
+# ---------- Restaurant details cache (survives warm invocations) ----------
+DETAIL_CACHE_TTL = float(os.environ.get("DETAIL_CACHE_TTL", "3600"))
+DETAIL_CACHE_SIZE = int(os.environ.get("DETAIL_CACHE_SIZE", "5000"))
+DDB_MAX_RETRIES = int(os.environ.get("DDB_MAX_RETRIES", "5"))
+DDB_BATCH_GET_LIMIT = 100  # BatchGetItem max keys per request
+# Only what format_email reads (+ the key to re-order results)
+DETAIL_PROJECTION = {"#pk": DDB_PK_NAME, "#n": "Name", "#a": "Address"}
+
+_detail_cache: "OrderedDict[str, tuple[float, dict]]" = OrderedDict()
+detail_cache_stats = {"hits": 0, "misses": 0, "evictions": 0}
+_detail_lock = threading.Lock()  # worker.py calls in from many threads
+
+def _cache_get(rid: str) -> dict | None:
+    with _detail_lock:
+        entry = _detail_cache.get(rid)
+        if entry is None:
+            return None
+        expires, item = entry
+        if expires < time.monotonic():
+            del _detail_cache[rid]
+            return None
+        _detail_cache.move_to_end(rid)
+        return item
+
+def _cache_put(rid: str, item: dict):
+    with _detail_lock:
+        _detail_cache[rid] = (time.monotonic() + DETAIL_CACHE_TTL, item)
+        _detail_cache.move_to_end(rid)
+        while len(_detail_cache) > DETAIL_CACHE_SIZE:
+            _detail_cache.popitem(last=False)
+            detail_cache_stats["evictions"] += 1
+
+def _batch_get_with_retry(keys: list[dict]) -> list[dict]:
+    """BatchGetItem one chunk (<= 100 keys), retrying UnprocessedKeys with backoff."""
+    request = {DDB_TABLE: {
+        "Keys": keys,
+        "ConsistentRead": False,
+        "ProjectionExpression": ", ".join(DETAIL_PROJECTION),
+        "ExpressionAttributeNames": DETAIL_PROJECTION,
+    }}
+    items, attempt = [], 0
+    while request:
+        resp = throttles["dynamodb"].call(ddb(throttled=True).batch_get_item, RequestItems=request)
+        items.extend(resp.get("Responses", {}).get(DDB_TABLE, []))
+        request = resp.get("UnprocessedKeys") or {}
+        if not request:
+            break
+        throttles["dynamodb"].throttled()  # unprocessed keys = partial throttling
+        attempt += 1
+        if attempt > DDB_MAX_RETRIES:
+            left = len(request.get(DDB_TABLE, {}).get("Keys", []))
+            log_json("WARN", event="ddb_unprocessed_keys", remaining=left, attempts=attempt)
+            break
+        time.sleep(random.uniform(0, min(1.0, 0.05 * (2 ** attempt))))
+    return items
 
 def batch_get_ddb_items_by_business_ids(ids: list[str]) -> list[dict]:
     if not ids:
         return []
-    keys = [{DDB_PK_NAME: {"S": rid}} for rid in ids]
-    resp = ddb.batch_get_item(RequestItems={DDB_TABLE: {"Keys": keys, "ConsistentRead": False}})
-    items = resp.get("Responses", {}).get(DDB_TABLE, [])
-    # Normalize into simple dicts
-    def _unwrap(av):
-        if "S" in av: return av["S"]
-        if "N" in av: return float(av["N"])
-        if "M" in av: return {k: _unwrap(v) for k, v in av["M"].items()}
-        if "L" in av: return [_unwrap(v) for v in av["L"]]
-        if "BOOL" in av: return av["BOOL"]
-        if "SS" in av: return list(av["SS"])
-        if "NS" in av: return [float(x) for x in av["NS"]]
-        return None
-    return [{k: _unwrap(v) for k, v in it.items()} for it in items]
+    found, missing = [], []
+    for rid in dict.fromkeys(ids):  # de-duplicate, keep order
+        item = _cache_get(rid)
+        if item is None:
+            missing.append(rid)
+        else:
+            found.append(item)
+    with _detail_lock:
+        detail_cache_stats["hits"] += len(found)
+        detail_cache_stats["misses"] += len(missing)
+
+    for i in range(0, len(missing), DDB_BATCH_GET_LIMIT):
+        keys = [{DDB_PK_NAME: {"S": rid}} for rid in missing[i:i + DDB_BATCH_GET_LIMIT]]
+        with tracer.timer("ddb_enrich", keys=len(keys)):
+            fetched = _batch_get_with_retry(keys)
+        # Normalize into simple dicts
+        for item in ddb_codec.iter_items(fetched):
+            _cache_put(item.get(DDB_PK_NAME), item)
+            found.append(item)
+
+    logger.info("DDB details: requested=%s cache=%s", len(ids), detail_cache_stats)
+    return found
+
+def _display(r: dict) -> tuple[str, str]:
+    name = r.get("name") or r.get("Name") or r.get("business_name") or "Unknown"
+    addr = r.get("address") or r.get("Address") or "Address unavailable"
+    return name, addr
 
 def format_email(cuisine: str, party_size, dining_time, suggestions: list[dict]) -> tuple[str, str]:
     subject = f"{cuisine} restaurant suggestions"
@@ -98,219 +330,926 @@ def format_email(cuisine: str, party_size, dining_time, suggestions: list[dict])
              + (f" for {party_size} people" if party_size else "")
              + (f", for {dining_time}" if dining_time else "")
              + ":"]
-    for i, r in enumerate(suggestions, 1):
-        name = r.get("name") or r.get("Name") or r.get("business_name") or "Unknown"
-        addr = r.get("address") or r.get("Address") or "Address unavailable"
+    for i, (name, addr) in enumerate(map(_display, suggestions), 1):
         lines.append(f"{i}. {name}, located at {addr}")
     body = "\n".join(lines)
     return subject, body
 
 def send_email(to_addr: str, subject: str, body: str):
     # Let ClientError bubble up so we can log structured info in handler
-    ses.send_email(
-        Source=SES_SENDER,
-        Destination={"ToAddresses": [to_addr]},
-        Message={
-            "Subject": {"Data": subject},
-            "Body": {"Text": {"Data": body}}
-        }
-    )
+    with tracer.timer("ses_send", recipients=1):
+        throttles["ses"].call(
+            ses().send_email,
+            Source=SES_SENDER,
+            Destination={"ToAddresses": [to_addr]},
+            Message={
+                "Subject": {"Data": subject},
+                "Body": {"Text": {"Data": body}}
+            }
+        )
 
-def receive_one_message():
-    resp = sqs.receive_message(
+# ---------- SES templated bulk sending ----------
+# Renders the same text as format_email from email_template_data()
+EMAIL_TEMPLATE = {
+    "TemplateName": SES_TEMPLATE_NAME,
+    "SubjectPart": "{{cuisine}} restaurant suggestions",
+    "TextPart": (
+        "Hello! Here are my {{cuisine}} restaurant suggestions"
+        "{{#if party_size}} for {{party_size}} people{{/if}}"
+        "{{#if dining_time}}, for {{dining_time}}{{/if}}:\n"
+        "{{#each suggestions}}{{rank}}. {{name}}, located at {{address}}\n{{/each}}"
+    ),
+}
+_template_ready = False
+_template_lock = threading.Lock()  # worker threads share the flag
+
+def ensure_email_template():
+    """Create/refresh the SES template once per container, through the SES throttle."""
+    global _template_ready
+    if _template_ready:
+        return
+    with _template_lock:
+        if _template_ready:
+            return
+        call = throttles["ses"].call  # cost=0: API calls, not sends
+        try:
+            current = call(ses().get_template, cost=0, TemplateName=SES_TEMPLATE_NAME)["Template"]
+            if current.get("SubjectPart") != EMAIL_TEMPLATE["SubjectPart"] or \
+                    current.get("TextPart") != EMAIL_TEMPLATE["TextPart"]:
+                call(ses().update_template, cost=0, Template=EMAIL_TEMPLATE)
+        except ClientError as e:
+            if e.response.get("Error", {}).get("Code") != "TemplateDoesNotExist":
+                raise
+            try:
+                call(ses().create_template, cost=0, Template=EMAIL_TEMPLATE)
+            except ClientError as e:
+                # another container created it in the meantime
+                if e.response.get("Error", {}).get("Code") != "AlreadyExists":
+                    raise
+        _template_ready = True
+
+def email_template_data(cuisine: str, party_size, dining_time, suggestions: list[dict]) -> dict:
+    return {
+        "cuisine": cuisine,
+        "party_size": party_size or "",
+        "dining_time": dining_time or "",
+        "suggestions": [{"rank": i, "name": name, "address": addr}
+                        for i, (name, addr) in enumerate(map(_display, suggestions), 1)],
+    }
+
+def send_bulk_templated(jobs: list[tuple[str, dict]]) -> list[Exception | None]:
+    """
+    jobs: (to_addr, template_data) pairs. Returns one entry per job: None when SES
+    accepted it, else a ClientError carrying that destination's status, so the
+    caller's SES error classification (and retry of just that message) applies.
+    """
+    try:
+        ensure_email_template()
+    except Exception as e:
+        # e.g. AccessDenied/throttling on GetTemplate: every job fails with it, like a failed chunk
+        return [e] * len(jobs)
+    results: list[Exception | None] = [None] * len(jobs)
+    for start in range(0, len(jobs), SES_BULK_LIMIT):
+        chunk = jobs[start:start + SES_BULK_LIMIT]
+        try:
+            with tracer.timer("ses_send", recipients=len(chunk)):
+                resp = throttles["ses"].call(
+                    ses().send_bulk_templated_email,
+                    cost=len(chunk),
+                    Source=SES_SENDER,
+                    Template=SES_TEMPLATE_NAME,
+                    DefaultTemplateData="{}",
+                    Destinations=[{
+                        "Destination": {"ToAddresses": [to_addr]},
+                        "ReplacementTemplateData": json.dumps(data, ensure_ascii=False),
+                    } for to_addr, data in chunk]
+                )
+        except Exception as e:
+            for k in range(len(chunk)):
+                results[start + k] = e
+            continue
+        # Status entries come back in the same order as Destinations
+        for k, st in enumerate(resp.get("Status", [])):
+            if st.get("Status") != "Success":
+                results[start + k] = ClientError(
+                    {"Error": {"Code": st.get("Status"), "Message": st.get("Error", "")}},
+                    "SendBulkTemplatedEmail")
+    return results
+
+def receive_messages(max_messages: int = 1, wait_seconds: int = 0,
+                     visibility: int = VISIBILITY_TIMEOUT) -> list[dict]:
+    resp = sqs().receive_message(
         QueueUrl=QUEUE_URL,
-        MaxNumberOfMessages=1,
-        WaitTimeSeconds=0,
-        VisibilityTimeout=45,  # retry cadence
-        AttributeNames=["ApproximateReceiveCount", "SentTimestamp"]
+        MaxNumberOfMessages=max_messages,
+        WaitTimeSeconds=wait_seconds,
+        VisibilityTimeout=visibility,
+        AttributeNames=["ApproximateReceiveCount", "SentTimestamp"],
+        MessageAttributeNames=[tracing.TRACE_ATTR]
     )
-    msgs = resp.get("Messages", [])
+    return resp.get("Messages", [])
+
+def receive_one_message():
+    msgs = receive_messages(1, 0)
     return msgs[0] if msgs else None
 
 def delete_message(receipt_handle: str):
-    sqs.delete_message(QueueUrl=QUEUE_URL, ReceiptHandle=receipt_handle)
+    sqs().delete_message(QueueUrl=QUEUE_URL, ReceiptHandle=receipt_handle)
 
-def process_request(msg_body: dict):
-    cuisine = (msg_body.get("cuisine") or "").lower()
-    email = msg_body.get("email")
-    party_size = msg_body.get("party_size")
-    dining_time = msg_body.get("dining_time")
+def delete_message_batch(msgs: list[dict]) -> list[str]:
+    """Ack up to 10 messages in one call. Returns the MessageIds that failed to delete."""
+    if not msgs:
+        return []
+    entries = [{"Id": str(i), "ReceiptHandle": m["ReceiptHandle"]} for i, m in enumerate(msgs)]
+    resp = sqs().delete_message_batch(QueueUrl=QUEUE_URL, Entries=entries)
+    failed = []
+    for f in resp.get("Failed", []):
+        m = msgs[int(f["Id"])]
+        failed.append(m.get("MessageId"))
+        # Not fatal: the message becomes visible again and is retried (at-least-once)
+        log_json(
+            "WARN",
+            event="delete_fail",
+            sqsMessageId=m.get("MessageId"),
+            error={"code": f.get("Code"), "message": f.get("Message")}
+        )
+    return failed
 
-    if not cuisine or not email:
-        raise ValueError("Missing required fields: cuisine/email")
+def change_visibility_batch(msgs: list[dict], timeout: int) -> int:
+    """Set the visibility of up to 10 messages in one call (0 = visible now). Returns how many failed."""
+    if not msgs:
+        return 0
+    entries = [{"Id": str(i), "ReceiptHandle": m["ReceiptHandle"], "VisibilityTimeout": timeout}
+               for i, m in enumerate(msgs)]
+    resp = sqs().change_message_visibility_batch(QueueUrl=QUEUE_URL, Entries=entries)
+    return len(resp.get("Failed", []))
 
-    # 1) sample N restaurant IDs by cuisine from OpenSearch
-    ids = get_random_restaurant_ids_by_cuisine(cuisine, SUGGESTION_COUNT)
-    if not ids:
-        raise RuntimeError(f"No restaurants found in OpenSearch for cuisine={cuisine}")
+def _parse_request(msg_body: dict) -> dict:
+    req = {
+        "cuisine": (msg_body.get("cuisine") or "").lower(),
+        "email": msg_body.get("email"),
+        "party_size": msg_body.get("party_size"),
+        "dining_time": msg_body.get("dining_time"),
+        "bbox": _city_bbox(msg_body.get("city")),
+    }
+    if not req["cuisine"] or not req["email"]:
+        raise ValueError("Missing required fields: cuisine/email")
+    return req
 
-    # 2) enrich from DynamoDB
-    items = batch_get_ddb_items_by_business_ids(ids)
+def _order_by_ids(ids: list[str], items: list[dict]) -> list[dict]:
     # keep the same order as ids
     by_id = {it.get(DDB_PK_NAME) or it.get("business_id"): it for it in items}
-    ordered = [by_id.get(rid, {}) for rid in ids]
+    return [by_id.get(rid, {}) for rid in ids]
+
+def process_request(msg_body: dict):
+    req = _parse_request(msg_body)
+    cuisine, bbox = req["cuisine"], req["bbox"]
+
+    # 0) snapshot fast path: no network until SES
+    ordered = sample_from_catalog(cuisine, SUGGESTION_COUNT, bbox)
+    if ordered is None:
+        # 1) sample N restaurants by cuisine (and city) from OpenSearch
+        docs = get_random_restaurants_by_cuisine(cuisine, SUGGESTION_COUNT, bbox)
+        if not docs:
+            raise RuntimeError(f"No restaurants found in OpenSearch for cuisine={cuisine}")
+
+        # 2) enrich from DynamoDB, unless the index already carries the details
+        if _has_details(docs):
+            ordered = docs
+        else:
+            ids = [d["business_id"] for d in docs]
+            ordered = _order_by_ids(ids, batch_get_ddb_items_by_business_ids(ids))
 
     # 3) format + 4) email via SES
-    subject, body = format_email(cuisine, party_size, dining_time, ordered)
-    send_email(email, subject, body)
+    subject, body = format_email(cuisine, req["party_size"], req["dining_time"], ordered)
+    send_email(req["email"], subject, body)
 
-def seed_from_ddb_to_os():
-    import json
-    from urllib.parse import urlparse
-    import urllib3
-    from botocore.session import get_session
-    from botocore.awsrequest import AWSRequest
-    from botocore.auth import SigV4Auth
-
-    http = urllib3.PoolManager()
-
-    def _send(method, path, body_bytes=None):
-        url = ES_ENDPOINT + path
-        headers = {"host": urlparse(ES_ENDPOINT).netloc, "content-type": "application/json"}
-        req = AWSRequest(method=method, url=url, data=body_bytes, headers=headers)
-        SigV4Auth(get_session().get_credentials(), "es", REGION).add_auth(req)
-        return http.request(method, url, body=body_bytes, headers=dict(req.headers.items()))
-
-    def _unwrap(av):
-        if "S" in av:   return av["S"]
-        if "N" in av:   return float(av["N"])
-        if "SS" in av:  return list(av["SS"])
-        if "NS" in av:  return [float(x) for x in av["NS"]]
-        if "M" in av:   return {k: _unwrap(v) for k, v in av["M"].items()}
-        if "L" in av:   return [_unwrap(v) for v in av["L"]]
-        if "BOOL" in av:return av["BOOL"]
+def process_requests(msg_bodies: list[dict]) -> list[Exception | None]:
+    """
+    Coalesced version of process_request for a batch of messages:
+    one search for all distinct cuisine/city pairs, one DynamoDB batch get for the
+    union of ids (skipped for hits from a denormalized index), then
+    format + send per request.
+    Returns one entry per body: None on success, else the exception.
+    """
+    results: list[Exception | None] = [None] * len(msg_bodies)
+    pending: dict[int, dict] = {}
+    for i, b in enumerate(msg_bodies):
+        try:
+            pending[i] = _parse_request(b)
+        except Exception as e:
+            results[i] = e
+
+    # 0) snapshot fast path
+    by_cuisine: dict[tuple[str, tuple | None], list[int]] = {}
+    for i, req in pending.items():
+        picks = sample_from_catalog(req["cuisine"], SUGGESTION_COUNT, req["bbox"])
+        if picks is not None:
+            req["suggestions"] = picks
+        else:
+            by_cuisine.setdefault((req["cuisine"], req["bbox"]), []).append(i)
+
+    if by_cuisine:
+        # 1) enough random hits per cuisine to give each request its own picks
+        try:
+            found = get_random_restaurants_by_cuisines(
+                {c: SUGGESTION_COUNT * len(idx) for c, idx in by_cuisine.items()})
+        except Exception as e:
+            found = {c: e for c in by_cuisine}
+
+        ids_for: dict[int, list[str]] = {}
+        for c, idx in by_cuisine.items():
+            docs = found.get(c)
+            if isinstance(docs, Exception) or not docs:
+                err = docs if isinstance(docs, Exception) else \
+                    RuntimeError(f"No restaurants found in OpenSearch for cuisine={c[0]}")
+                for i in idx:
+                    results[i] = err
+                continue
+            for k, i in enumerate(idx):
+                chunk = docs[k * SUGGESTION_COUNT:(k + 1) * SUGGESTION_COUNT]
+                # fewer hits than requests * N: fall back to overlapping random picks
+                if len(chunk) != SUGGESTION_COUNT:
+                    chunk = random.sample(docs, min(SUGGESTION_COUNT, len(docs)))
+                if _has_details(chunk):
+                    pending[i]["suggestions"] = chunk
+                else:
+                    ids_for[i] = [d["business_id"] for d in chunk]
+
+        # 2) one enrichment call for the union of ids still missing details
+        if ids_for:
+            union = list(dict.fromkeys(rid for ids in ids_for.values() for rid in ids))
+            try:
+                items = batch_get_ddb_items_by_business_ids(union)
+            except Exception as e:
+                for i in ids_for:
+                    results[i] = e
+            else:
+                for i, ids in ids_for.items():
+                    pending[i]["suggestions"] = _order_by_ids(ids, items)
+
+    # 3) format + 4) email via SES
+    if EMAIL_MODE == "bulk":
+        ready = [i for i in pending if results[i] is None]
+        sent = send_bulk_templated([(pending[i]["email"], email_template_data(
+            pending[i]["cuisine"], pending[i]["party_size"], pending[i]["dining_time"],
+            pending[i]["suggestions"])) for i in ready])
+        for i, err in zip(ready, sent):
+            results[i] = err
+        return results
+
+    for i, req in pending.items():
+        if results[i] is not None:
+            continue
+        try:
+            subject, body = format_email(req["cuisine"], req["party_size"], req["dining_time"],
+                                         req["suggestions"])
+            send_email(req["email"], subject, body)
+        except Exception as e:
+            results[i] = e
+
+    return results
+
+# ---------- Seeding OpenSearch from DynamoDB ----------
+SEED_SEGMENTS = int(os.environ.get("SEED_SEGMENTS", "4"))            # parallel scan segments
+SEED_WRITERS = int(os.environ.get("SEED_WRITERS", "4"))              # concurrent _bulk writers
+SEED_BULK_BYTES = int(os.environ.get("SEED_BULK_BYTES", str(5 * 1024 * 1024)))
+SEED_QUEUE_PAGES = int(os.environ.get("SEED_QUEUE_PAGES", "8"))      # bounds memory: scan pages in flight
+SEED_BULK_RETRIES = int(os.environ.get("SEED_BULK_RETRIES", "3"))
+
+# all the restaurants index needs
+SEED_ATTRS = ("business_id", "CuisineSet", "Coordinates") + (DENORMALIZED_FIELDS if INDEX_MODE == "denormalized" else ())
+
+# Explicit types for the fields we query; anything else stays dynamically mapped
+INDEX_MAPPING = {"properties": {
+    "business_id": {"type": "keyword"},
+    "CuisineSet": {"type": "keyword"},
+    "location": {"type": "geo_point"},
+}}
+_index_mapping_ready = False
+_index_mapping_lock = threading.Lock()  # seed writers / worker threads share the flag
+
+def ensure_index_mapping():
+    """
+    Create ES_INDEX with INDEX_MAPPING, or add the geo_point field to an index that
+    predates it (existing field types can't change, so only `location` is put).
+    Must run before the first document with `location`, else it is mapped as an object.
+    """
+    global _index_mapping_ready
+    if _index_mapping_ready:
+        return
+    with _index_mapping_lock:
+        if _index_mapping_ready:
+            return
+        try:
+            os_client.request("PUT", f"/{ES_INDEX}", {"mappings": INDEX_MAPPING})
+        except OpenSearchError as e:
+            # already there, e.g. created by another container in the meantime
+            if e.status != 400 or b"already_exists" not in (e.data or b""):
+                raise
+            os_client.request("PUT", f"/{ES_INDEX}/_mapping",
+                              {"properties": {"location": INDEX_MAPPING["properties"]["location"]}})
+        _index_mapping_ready = True
+
+def os_doc(item: dict) -> dict | None:
+    """Decoded DynamoDB item -> restaurants index document, None if unusable."""
+    bid = item.get("business_id")
+    c   = item.get("CuisineSet")
+    if isinstance(c, list) and c:
+        c = c[0]
+    if not bid or not c:
         return None
+    # lowercase cuisine to be case-insensitive
+    doc = {"business_id": str(bid), "CuisineSet": str(c).lower()}
+    coords = item.get("Coordinates")
+    if isinstance(coords, dict) and coords.get("latitude") is not None and coords.get("longitude") is not None:
+        doc["location"] = {"lat": float(coords["latitude"]), "lon": float(coords["longitude"])}
+    if INDEX_MODE == "denormalized":
+        doc.update((k, item[k]) for k in DENORMALIZED_FIELDS if item.get(k) is not None)
+    return doc
 
-    # Scan the whole table
-    items, start = [], None
-    while True:
-        kwargs = {"TableName": DDB_TABLE, "ProjectionExpression": "#b,#c",
-                  "ExpressionAttributeNames": {"#b":"business_id","#c":"CuisineSet"}}
-        if start: kwargs["ExclusiveStartKey"] = start
-        resp = ddb.scan(**kwargs)
-        items.extend(resp.get("Items", []))
-        start = resp.get("LastEvaluatedKey")
-        if not start: break
-
-    # Bulk in batches (lowercase cuisine to be case-insensitive)
-    batch, total = [], 0
-    def flush():
-        nonlocal batch, total
-        if not batch: return
-        body = ("\n".join(batch) + "\n").encode("utf-8")
-        r = _send("POST", "/_bulk?refresh=wait_for", body)
+def os_doc_from_item(item: dict) -> dict | None:
+    """Same as os_doc for an attribute-value item (scan page / stream image)."""
+    return os_doc(ddb_codec.unwrap_item(item, SEED_ATTRS))
+
+def _bulk_with_retry(ops: list[str]) -> tuple[int, list[int]]:
+    """
+    POST _bulk operations (each op is its action line, plus the doc line for index),
+    re-sending only the ops that failed with a retryable status (429 / 5xx).
+    Returns (succeeded, positions of ops that failed for good).
+    """
+    succeeded, failed, attempt = 0, [], 0
+    positions = list(range(len(ops)))
+    while ops:
+        body = ("\n".join(ops) + "\n").encode("utf-8")
+        r = os_client.request_raw("POST", "/_bulk", body, "application/x-ndjson")
         if r.status >= 300:
             raise RuntimeError(f"Bulk failed {r.status}: {r.data[:200]}")
-        total += len(batch)//2
-        batch = []
-
-    for it in items:
-        bid = _unwrap(it.get("business_id", {}))
-        c   = _unwrap(it.get("CuisineSet", {}))
-        if isinstance(c, list) and c:
-            c = c[0]
-        if not bid or not c: 
-            continue
-        doc = {"business_id": str(bid), "CuisineSet": str(c).lower()}
-        batch.append(json.dumps({"index": {"_index": ES_INDEX, "_id": bid}}))
-        batch.append(json.dumps(doc))
-        if len(batch) >= 1000:  # 500 docs per bulk (2 lines/doc)
-            flush()
-    flush()
-    logger.info("Seeding complete. Docs indexed: %s", total)
-    return {"indexed": total}
+        res = json.loads(r.data.decode("utf-8"))
+        if not res.get("errors"):
+            return succeeded + len(ops), failed
 
-def lambda_handler(event, context):
-    # Support one-time seeding
-    if isinstance(event, dict) and event.get("seed"):
-        return seed_from_ddb_to_os()
+        retry, retry_pos = [], []
+        for k, item in enumerate(res.get("items", [])):
+            op, st = next(iter(item.items()))
+            status = st.get("status", 500)
+            if status < 300 or (op == "delete" and status == 404):
+                succeeded += 1
+            elif (status == 429 or status >= 500) and attempt < SEED_BULK_RETRIES:
+                retry.append(ops[k])
+                retry_pos.append(positions[k])
+            else:
+                failed.append(positions[k])
+                log_json("WARN", event="bulk_item_fail", op=op, id=st.get("_id"), status=status,
+                         error=str(st.get("error"))[:200])
+        ops, positions = retry, retry_pos
+        if ops:
+            attempt += 1
+            time.sleep(random.uniform(0, min(2.0, 0.1 * (2 ** attempt))))
+    return succeeded, failed
 
-    processed, errors = 0, 0
-    for _ in range(MAX_PER_RUN):
-        msg = receive_one_message()
-        if not msg:
-            break
+def _index_op(doc: dict) -> str:
+    action = json.dumps({"index": {"_index": ES_INDEX, "_id": doc["business_id"]}})
+    return action + "\n" + json.dumps(doc)
+
+def seed_from_ddb_to_os():
+    """
+    Streaming reindex: SEED_SEGMENTS parallel scan segments feed a bounded queue of
+    pages, SEED_WRITERS threads turn them into _bulk requests flushed by size
+    (SEED_BULK_BYTES), and the index is refreshed once at the end.
+    """
+    ensure_index_mapping()
+    pages: "queue.Queue[list | None]" = queue.Queue(maxsize=SEED_QUEUE_PAGES)
+    stop = threading.Event()
+    lock = threading.Lock()
+    stats = {"scanned": 0, "indexed": 0, "failed": 0, "skipped": 0, "bulk_requests": 0}
+    started = time.perf_counter()
+
+    def _put(page):
+        # Never block forever if the writers died
+        while not stop.is_set():
+            try:
+                pages.put(page, timeout=0.5)
+                return
+            except queue.Full:
+                continue
 
-        rh = msg["ReceiptHandle"]
-        message_id = msg.get("MessageId")
-        attrs = msg.get("Attributes", {})
-        approx_receives = int(attrs.get("ApproximateReceiveCount", "1"))
-        raw = msg.get("Body", "")
+    projection = {f"#a{i}": name for i, name in enumerate(SEED_ATTRS)}
 
+    def scan_segment(segment: int):
+        start = None
+        while not stop.is_set():
+            kwargs = {"TableName": DDB_TABLE, "ProjectionExpression": ",".join(projection),
+                      "ExpressionAttributeNames": projection,
+                      "Segment": segment, "TotalSegments": SEED_SEGMENTS}
+            if start: kwargs["ExclusiveStartKey"] = start
+            resp = ddb().scan(**kwargs)
+            _put(resp.get("Items", []))
+            start = resp.get("LastEvaluatedKey")
+            if not start: break
+
+    def write_bulk():
+        batch, size = [], 0
+
+        def flush():
+            nonlocal batch, size
+            if not batch: return
+            ok, bad = _bulk_with_retry(batch)
+            with lock:
+                stats["indexed"] += ok
+                stats["failed"] += len(bad)
+                stats["bulk_requests"] += 1
+            batch, size = [], 0
+
+        while True:
+            page = pages.get()
+            if page is None:
+                break
+            if stop.is_set():
+                continue  # keep draining so scanners can exit
+            try:
+                skipped = 0
+                for it in ddb_codec.iter_items(page, SEED_ATTRS):
+                    doc = os_doc(it)
+                    if doc is None:
+                        skipped += 1
+                        continue
+                    op = _index_op(doc)
+                    batch.append(op)
+                    size += len(op) + 1
+                    if size >= SEED_BULK_BYTES:
+                        flush()
+                with lock:
+                    stats["scanned"] += len(page)
+                    stats["skipped"] += skipped
+            except Exception:
+                stop.set()
+                raise
+        if not stop.is_set():
+            flush()
+
+    with ThreadPoolExecutor(max_workers=SEED_SEGMENTS + SEED_WRITERS) as pool:
+        writers = [pool.submit(write_bulk) for _ in range(SEED_WRITERS)]
+        scanners = [pool.submit(scan_segment, seg) for seg in range(SEED_SEGMENTS)]
         try:
-            body = json.loads(raw)
-        except json.JSONDecodeError:
-            body = {"raw": raw}
+            for f in scanners:
+                f.result()
+        except Exception:
+            stop.set()
+            raise
+        finally:
+            sentinels = 0
+            while sentinels < len(writers) and not all(f.done() for f in writers):
+                try:
+                    pages.put(None, timeout=0.5)
+                    sentinels += 1
+                except queue.Full:
+                    continue
+            for f in writers:
+                f.result()
+
+    # One refresh at the end instead of refresh=wait_for on every bulk
+    os_client.request("POST", f"/{ES_INDEX}/_refresh")
+
+    elapsed = time.perf_counter() - started
+    stats["seconds"] = round(elapsed, 2)
+    stats["docs_per_sec"] = round(stats["indexed"] / elapsed, 1) if elapsed else None
+    stats["peak_rss_mb"] = round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)  # KB on Linux
+    log_json("INFO", event="seed_complete", **stats, os=os_client.stats())
+    return stats
+
+def _parse_message(msg: dict, context) -> dict:
+    raw = msg.get("Body", "")
+    try:
+        body = json.loads(raw)
+    except json.JSONDecodeError:
+        body = {"raw": raw}
+
+    # Pre-log for traceability
+    trace_id = tracing.from_message(msg)
+    receives = int(msg.get("Attributes", {}).get("ApproximateReceiveCount", "1"))
+    log_json(
+        "INFO",
+        event="lf2_receive",
+        requestId=context.aws_request_id,
+        sqsMessageId=msg.get("MessageId"),
+        traceId=trace_id,
+        receives=receives,
+        body_summary={"has_email": bool(body.get("email")), "has_cuisine": bool(body.get("cuisine"))}
+    )
+    # Time on the queue since LF1's send (includes earlier attempts when receives > 1)
+    dwell = tracing.dwell_ms(msg)
+    if dwell is not None:
+        tracer.emit("queue_dwell", dwell, trace_id, receives=receives)
+    return body
+
+def _report_result(msg: dict, body: dict, error: Exception | None, context) -> bool:
+    """
+    Log the outcome of one message with the success / ClientError / unknown classification.
+    Returns True on success; the caller is responsible for deleting it.
+    On failure the message is left on the queue so SQS retries & redrives to the DLQ.
+    """
+    rh = msg["ReceiptHandle"]
+    message_id = msg.get("MessageId")
+    approx_receives = int(msg.get("Attributes", {}).get("ApproximateReceiveCount", "1"))
+    trace_id = tracing.from_message(msg)
+
+    try:
+        if error is not None:
+            raise error
 
-        # Pre-log for traceability
         log_json(
             "INFO",
-            event="lf2_receive",
+            event="send_success",
             requestId=context.aws_request_id,
             sqsMessageId=message_id,
+            traceId=trace_id,
             receives=approx_receives,
-            body_summary={"has_email": bool(body.get("email")), "has_cuisine": bool(body.get("cuisine"))}
+            to=body.get("email")
         )
+        return True
+
+    except ClientError as e:
+        # SES / AWS client-side failures
+        err_info = {
+            "type": "ClientError",
+            "code": e.response.get("Error", {}).get("Code"),
+            "message": e.response.get("Error", {}).get("Message"),
+        }
 
+        # Optional: nudge retry cadence (best-effort)
         try:
+            sqs().change_message_visibility(
+                QueueUrl=QUEUE_URL,
+                ReceiptHandle=rh,
+                VisibilityTimeout=VISIBILITY_TIMEOUT
+            )
+        except Exception:
+            pass
+
+        # DO NOT delete on failure → allow SQS to retry & DLQ
+        log_json(
+            "ERROR",
+            event="send_fail_ses",
+            requestId=context.aws_request_id,
+            sqsMessageId=message_id,
+            traceId=trace_id,
+            receives=approx_receives,
+            to=body.get("email"),
+            error=err_info
+        )
+        return False
+
+    except Exception as e:
+        # Unknown failures — also keep message for retry/DLQ
+        log_json(
+            "ERROR",
+            event="send_fail_unknown",
+            requestId=context.aws_request_id,
+            sqsMessageId=message_id,
+            traceId=trace_id,
+            receives=approx_receives,
+            error={"type": type(e).__name__, "message": str(e), "trace": traceback.format_exc()[:800]}
+        )
+        return False
+
+def _claim(msg: dict, body: dict, context) -> tuple[str | None, bool | None]:
+    """
+    Check the idempotency store before doing any work.
+    Returns (key to complete/release later, None) when the message should be processed,
+    or (None, outcome) when it must not be: True = already done (delete it),
+    False = another consumer holds it (leave it on the queue).
+    """
+    key = idempotency.key_for(body) if idem_store else None
+    if key is None:
+        return None, None
+    try:
+        state = idem_store.claim(key)
+    except Exception as e:
+        # Fail open: a store outage must not stop emails from going out
+        log_json("WARN", event="idempotency_unavailable", sqsMessageId=msg.get("MessageId"),
+                 error={"type": type(e).__name__, "message": str(e)[:300]})
+        return None, None
+    if state == idempotency.NEW:
+        return key, None
+
+    log_json(
+        "INFO",
+        event="duplicate_skip" if state == idempotency.COMPLETED else "duplicate_in_progress",
+        requestId=context.aws_request_id,
+        sqsMessageId=msg.get("MessageId"),
+        idempotencyKey=key
+    )
+    return None, state == idempotency.COMPLETED
+
+def _settle(key: str | None, error: Exception | None):
+    """Mark the claimed key done after the email went out, or free it for the retry."""
+    if key is None:
+        return
+    try:
+        if error is None:
+            idem_store.complete(key)
+        else:
+            idem_store.release(key)
+    except Exception as e:
+        log_json("WARN", event="idempotency_settle_fail", idempotencyKey=key,
+                 error={"type": type(e).__name__, "message": str(e)[:300]})
+
+def handle_message(msg: dict, context) -> bool:
+    """Process one SQS message; True on success (caller deletes it)."""
+    body = _parse_message(msg, context)
+    key, outcome = _claim(msg, body, context)
+    if outcome is not None:
+        return outcome
+    try:
+        with tracer.traced([tracing.from_message(msg)]):
             process_request(body)
+    except Exception as e:
+        _settle(key, e)
+        return _report_result(msg, body, e, context)
+    _settle(key, None)
+    return _report_result(msg, body, None, context)
+
+def handle_messages(msgs: list[dict], context) -> list[bool]:
+    """Process a batch with coalesced backend calls; one success flag per message."""
+    bodies = [_parse_message(m, context) for m in msgs]
+    claims = [_claim(m, b, context) for m, b in zip(msgs, bodies)]
+    todo = [i for i, (_, outcome) in enumerate(claims) if outcome is None]
+    with tracer.traced([tracing.from_message(msgs[i]) for i in todo]):
+        errors = dict(zip(todo, process_requests([bodies[i] for i in todo])))
+
+    results = []
+    for i, (m, b) in enumerate(zip(msgs, bodies)):
+        key, outcome = claims[i]
+        if outcome is not None:
+            results.append(outcome)
+            continue
+        _settle(key, errors[i])
+        results.append(_report_result(m, b, errors[i], context))
+    return results
+
+def drain_single(context):
+    processed, errors = 0, 0
+    for _ in range(MAX_PER_RUN):
+        msg = receive_one_message()
+        if not msg:
+            break
 
+        if handle_message(msg, context):
             # SUCCESS → delete message so it doesn't retry
-            delete_message(rh)
+            delete_message(msg["ReceiptHandle"])
             processed += 1
+        else:
+            errors += 1
 
-            log_json(
-                "INFO",
-                event="send_success",
-                requestId=context.aws_request_id,
-                sqsMessageId=message_id,
-                receives=approx_receives,
-                to=body.get("email")
-            )
+    return {"processed": processed, "errors": errors}
 
-        except ClientError as e:
-            # SES / AWS client-side failures
-            err_info = {
-                "type": "ClientError",
-                "code": e.response.get("Error", {}).get("Code"),
-                "message": e.response.get("Error", {}).get("Message"),
-            }
-            errors += 1
+def drain_batch(context):
+    """
+    Batched consumer: up to RECEIVE_BATCH_SIZE messages per receive (long polling
+    with RECEIVE_WAIT_SECONDS), one delete_message_batch per receive for the successes.
+    MAX_PER_RUN still caps the number of messages handled per invocation.
+    """
+    processed, errors = 0, 0
+    while processed + errors < MAX_PER_RUN:
+        want = min(RECEIVE_BATCH_SIZE, MAX_PER_RUN - processed - errors)
+        msgs = receive_messages(want, RECEIVE_WAIT_SECONDS)
+        if not msgs:
+            break
 
-            # Optional: nudge retry cadence (best-effort)
-            try:
-                sqs.change_message_visibility(
-                    QueueUrl=QUEUE_URL,
-                    ReceiptHandle=rh,
-                    VisibilityTimeout=45
-                )
-            except Exception:
-                pass
-
-            # DO NOT delete on failure → allow SQS to retry & DLQ
-            log_json(
-                "ERROR",
-                event="send_fail_ses",
-                requestId=context.aws_request_id,
-                sqsMessageId=message_id,
-                receives=approx_receives,
-                to=body.get("email"),
-                error=err_info
-            )
+        ok = handle_messages(msgs, context)
+        done = [m for m, good in zip(msgs, ok) if good]
+        errors += len(msgs) - len(done)
 
-        except Exception as e:
-            # Unknown failures — also keep message for retry/DLQ
-            errors += 1
-            log_json(
-                "ERROR",
-                event="send_fail_unknown",
-                requestId=context.aws_request_id,
-                sqsMessageId=message_id,
-                receives=approx_receives,
-                error={"type": type(e).__name__, "message": str(e), "trace": traceback.format_exc()[:800]}
-            )
+        # Failed deletes are only re-deliveries, not failures: the work was done
+        delete_message_batch(done)
+        processed += len(done)
 
     return {"processed": processed, "errors": errors}
 
+# ---------- Adaptive drain (CONSUMER_MODE=adaptive) ----------
+class Ewma:
+    """Exponentially weighted moving average; a warm container keeps its estimate."""
+
+    def __init__(self, initial: float, alpha: float = 0.3):
+        self.value = initial
+        self.alpha = alpha
+        self.samples = 0
+
+    def update(self, sample: float) -> float:
+        # the first measurement replaces the configured guess outright
+        self.value = sample if self.samples == 0 else self.value + self.alpha * (sample - self.value)
+        self.samples += 1
+        return self.value
+
+msg_cost_ms = Ewma(DRAIN_INITIAL_COST_MS)
+
+class VisibilityHeartbeat:
+    """
+    Background thread that keeps in-flight messages invisible while they are worked on:
+    every `interval` seconds their visibility is reset to `visibility` seconds from now.
+    A message that is removed (acked, failed or released) is no longer extended, and
+    nothing is extended once the invocation is inside its reserve, so a killed
+    invocation's messages come back within one visibility period.
+    """
+
+    def __init__(self, context, visibility: int = HEARTBEAT_VISIBILITY, interval: float = HEARTBEAT_INTERVAL):
+        self.context = context
+        self.visibility = visibility
+        self.interval = min(interval, visibility / 3)  # a missed beat must not expose a message
+        self._inflight: dict[str, dict] = {}
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="visibility-heartbeat", daemon=True)
+        self.stats = {"beats": 0, "extended": 0, "failed": 0}
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+
+    def add(self, msgs: list[dict]):
+        with self._lock:
+            for m in msgs:
+                self._inflight[m["ReceiptHandle"]] = m
+
+    def remove(self, msgs: list[dict]):
+        with self._lock:
+            for m in msgs:
+                self._inflight.pop(m["ReceiptHandle"], None)
 
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            if self.context.get_remaining_time_in_millis() < DRAIN_RESERVE_MS:
+                return
+            with self._lock:
+                msgs = list(self._inflight.values())
+            for i in range(0, len(msgs), 10):
+                chunk = msgs[i:i + 10]
+                try:
+                    failed = change_visibility_batch(chunk, self.visibility)
+                except Exception as e:
+                    failed = len(chunk)
+                    log_json("WARN", event="heartbeat_fail", error={"type": type(e).__name__, "message": str(e)[:300]})
+                self.stats["extended"] += len(chunk) - failed
+                self.stats["failed"] += failed
+            self.stats["beats"] += 1
+
+def _fits(context, per_msg_ms: float) -> int:
+    """How many more messages this invocation can take on before its reserve."""
+    budget = context.get_remaining_time_in_millis() - DRAIN_RESERVE_MS
+    return max(0, int(budget // max(per_msg_ms, 1.0)))
+
+def release_messages(msgs: list[dict]) -> int:
+    """Hand messages we won't start back to the queue right away (visibility 0)."""
+    failed = 0
+    for i in range(0, len(msgs), 10):
+        try:
+            failed += change_visibility_batch(msgs[i:i + 10], 0)
+        except Exception as e:
+            failed += len(msgs[i:i + 10])
+            log_json("WARN", event="release_fail", error={"type": type(e).__name__, "message": str(e)[:300]})
+    return len(msgs) - failed
+
+def drain_adaptive(context):
+    """
+    Time-budgeted consumer: receive and process batches while the remaining time covers
+    another batch at the rolling per-message cost (msg_cost_ms * DRAIN_COST_MARGIN).
+    Received messages that no longer fit are released instead of waiting out their
+    visibility timeout; in-flight ones are kept invisible by a VisibilityHeartbeat.
+    """
+    processed, errors, released = 0, 0, 0
+    with VisibilityHeartbeat(context) as heartbeat:
+        while True:
+            per_msg = msg_cost_ms.value * DRAIN_COST_MARGIN
+            want = min(RECEIVE_BATCH_SIZE, _fits(context, per_msg))
+            if want < 1:
+                break
+            # never long-poll into the time reserved for the batch itself
+            spare_s = (context.get_remaining_time_in_millis() - DRAIN_RESERVE_MS - want * per_msg) / 1000
+            msgs = receive_messages(want, max(0, min(RECEIVE_WAIT_SECONDS, int(spare_s))), HEARTBEAT_VISIBILITY)
+            if not msgs:
+                break
+            heartbeat.add(msgs)
+
+            while msgs:
+                # the estimate can grow mid-batch; only start what still fits
+                # (and probe with one message while it is still the configured guess)
+                n = min(len(msgs), _fits(context, msg_cost_ms.value * DRAIN_COST_MARGIN))
+                if msg_cost_ms.samples == 0:
+                    n = min(n, 1)
+                if n < 1:
+                    heartbeat.remove(msgs)
+                    released += release_messages(msgs)
+                    log_json("INFO", event="drain_release", count=len(msgs),
+                             remaining_ms=context.get_remaining_time_in_millis(), cost_ms=round(msg_cost_ms.value, 1))
+                    break
+                chunk, msgs = msgs[:n], msgs[n:]
+                started = time.perf_counter()
+                ok = handle_messages(chunk, context)
+                msg_cost_ms.update((time.perf_counter() - started) * 1000 / len(chunk))
+
+                done = [m for m, good in zip(chunk, ok) if good]
+                heartbeat.remove(chunk)
+                errors += len(chunk) - len(done)
+                delete_message_batch(done)
+                processed += len(done)
+
+    log_json("INFO", event="drain_adaptive", processed=processed, errors=errors, released=released,
+             cost_ms=round(msg_cost_ms.value, 1), remaining_ms=context.get_remaining_time_in_millis(),
+             heartbeat=heartbeat.stats)
+    return {"processed": processed, "errors": errors, "released": released}
+
+def sqs_event_handler(event, context):
+    """
+    Entry point for the native SQS trigger (event source mapping).
+    Enable ReportBatchItemFailures on the mapping so only the failed
+    messages are made visible again; the rest are deleted by Lambda.
+    """
+    # Same shape as sqs.receive_message so the batch path can be reused as-is
+    msgs = [{
+        "MessageId": record.get("messageId"),
+        "ReceiptHandle": record.get("receiptHandle"),
+        "Body": record.get("body", ""),
+        "Attributes": record.get("attributes", {}),
+        "MessageAttributes": {k: {"DataType": a.get("dataType"), "StringValue": a.get("stringValue")}
+                              for k, a in (record.get("messageAttributes") or {}).items()},
+    } for record in event.get("Records", [])]
+
+    ok = handle_messages(msgs, context)
+    return {"batchItemFailures": [{"itemIdentifier": m["MessageId"]} for m, good in zip(msgs, ok) if not good]}
+
+def ddb_stream_handler(event, context):
+    """
+    Entry point for the yelp-restaurants DynamoDB Stream (NEW_IMAGE or
+    NEW_AND_OLD_IMAGES): INSERT/MODIFY -> index, REMOVE -> delete, in one _bulk.
+    With ReportBatchItemFailures on the mapping, the first failed record is
+    reported so Lambda checkpoints everything before it and retries from there.
+    """
+    records = event.get("Records", [])
+    ops, op_records = [], []
+    skipped = 0
+    for rec in records:
+        change = rec.get("dynamodb", {})
+        if rec.get("eventName") == "REMOVE":
+            bid = ddb_codec.unwrap(change.get("Keys", {}).get(DDB_PK_NAME, {}))
+            if bid:
+                ops.append(json.dumps({"delete": {"_index": ES_INDEX, "_id": str(bid)}}))
+                op_records.append(rec)
+                continue
+        else:
+            doc = os_doc_from_item(change.get("NewImage", {}))
+            if doc is not None:
+                ops.append(_index_op(doc))
+                op_records.append(rec)
+                continue
+        skipped += 1
+
+    failed = []
+    if ops:
+        try:
+            ensure_index_mapping()
+            _, failed = _bulk_with_retry(ops)
+        except Exception as e:
+            log_json("ERROR", event="stream_sync_fail",
+                     error={"type": type(e).__name__, "message": str(e)[:300]})
+            failed = [0]
+
+    result = {"batchItemFailures": []}
+    if failed:
+        first = op_records[min(failed)]
+        result["batchItemFailures"].append({"itemIdentifier": first["dynamodb"]["SequenceNumber"]})
+
+    log_json("INFO", event="stream_sync", records=len(records), ops=len(ops), skipped=skipped,
+             failed=len(failed), latency_ms=round(os_client.last_latency_ms, 1))
+    return result
+
+def _is_sqs_event(event) -> bool:
+    records = event.get("Records") if isinstance(event, dict) else None
+    return bool(records) and records[0].get("eventSource") == "aws:sqs"
+
+aws_clients.record_init("lf2")
+
+def lambda_handler(event, context):
+    # Incremental index sync from the table's stream
+    if isinstance(event, dict) and (event.get("Records") or [{}])[0].get("eventSource") == "aws:dynamodb":
+        return ddb_stream_handler(event, context)
+
+    # Support one-time seeding
+    if isinstance(event, dict) and event.get("seed"):
+        return seed_from_ddb_to_os()
 
+    try:
+        # Invoked by an SQS trigger rather than a schedule
+        if _is_sqs_event(event):
+            return sqs_event_handler(event, context)
+        if CONSUMER_MODE == "adaptive":
+            return drain_adaptive(context)
+        if CONSUMER_MODE == "batch":
+            return drain_batch(context)
+        return drain_single(context)
+    finally:
+        # Current per-backend limits, throttles and wait time (cumulative per container)
+        log_json("INFO", event="throttle_metrics", backends=throttle_metrics())
@@ -0,0 +1,133 @@
+import gzip, json, random, time
+from urllib.parse import urlparse
+import urllib3
+
+from botocore.auth import SigV4Auth
+from botocore.awsrequest import AWSRequest
+from botocore.session import get_session
+
+RETRYABLE_STATUS = {429, 500, 502, 503, 504}
+
+
+class OpenSearchError(RuntimeError):
+    def __init__(self, status: int, data: bytes):
+        super().__init__(f"OpenSearch {status}: {data[:200]}")
+        self.status = status
+        self.data = data
+
+
+class OpenSearchClient:
+    """
+    SigV4-signed OpenSearch client meant to live at module scope so warm
+    invocations reuse it:
+      - credentials are resolved once and refreshed by botocore when they expire
+      - one urllib3 pool with keep-alive connections (no TLS handshake per call)
+      - request bodies gzip-compressed above gzip_min_bytes
+      - 429/5xx and connection errors retried with full-jitter backoff; every 429
+        is reported to on_throttle (e.g. Throttle.throttled) if set
+      - latency of every call kept in last_latency_ms / total_latency_ms
+
+    For a local fake server pass endpoint="http://127.0.0.1:<port>" and sign=False.
+    """
+
+    def __init__(self, endpoint: str, region: str, service: str = "es", *,
+                 credentials=None, sign: bool = True, gzip_min_bytes: int = 1024,
+                 max_retries: int = 3, backoff_base: float = 0.05, backoff_cap: float = 2.0,
+                 pool_maxsize: int = 10, connect_timeout: float = 3.0, read_timeout: float = 8.0):
+        self.endpoint = endpoint.rstrip("/")
+        self.host = urlparse(self.endpoint).netloc
+        self.region = region
+        self.service = service
+        self.sign = sign
+        self.gzip_min_bytes = gzip_min_bytes
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_cap = backoff_cap
+        self.timeout = urllib3.Timeout(connect=connect_timeout, read=read_timeout)
+        # retries=False: retrying is done here so it can be counted and jittered
+        self.http = urllib3.PoolManager(maxsize=pool_maxsize, block=False, retries=False)
+
+        self._credentials = credentials
+        self._signer = None
+        self._signer_key = None
+
+        self.on_throttle = None
+
+        self.calls = 0
+        self.retries = 0
+        self.last_latency_ms = 0.0
+        self.total_latency_ms = 0.0
+
+    # ---------- credentials ----------
+    def _get_signer(self):
+        if self._credentials is None:
+            # Resolved once per container; RefreshableCredentials refresh themselves
+            self._credentials = get_session().get_credentials()
+        frozen = self._credentials.get_frozen_credentials()
+        if self._signer is None or self._signer_key != frozen:
+            self._signer = SigV4Auth(frozen, self.service, self.region)
+            self._signer_key = frozen
+        return self._signer
+
+    def _headers(self, method: str, url: str, data: bytes | None, content_type: str) -> tuple[dict, bytes | None]:
+        headers = {"host": self.host}
+        if data is not None:
+            headers["content-type"] = content_type
+            if len(data) >= self.gzip_min_bytes:
+                data = gzip.compress(data, compresslevel=1)
+                headers["content-encoding"] = "gzip"
+        headers["accept-encoding"] = "gzip"
+        if self.sign:
+            req = AWSRequest(method=method, url=url, data=data, headers=headers)
+            self._get_signer().add_auth(req)
+            headers = dict(req.headers.items())
+        return headers, data
+
+    def _backoff(self, attempt: int) -> float:
+        return random.uniform(0, min(self.backoff_cap, self.backoff_base * (2 ** attempt)))
+
+    # ---------- requests ----------
+    def request_raw(self, method: str, path: str, data: bytes | None = None,
+                    content_type: str = "application/json"):
+        """Send bytes as-is (e.g. NDJSON for _bulk). Returns the urllib3 response."""
+        url = f"{self.endpoint}{path}"
+        headers, payload = self._headers(method, url, data, content_type)
+
+        started = time.perf_counter()
+        attempt = 0
+        try:
+            while True:
+                try:
+                    resp = self.http.request(method, url, body=payload, headers=headers,
+                                             timeout=self.timeout, retries=False)
+                except (urllib3.exceptions.ProtocolError, urllib3.exceptions.TimeoutError,
+                        urllib3.exceptions.NewConnectionError):
+                    if attempt >= self.max_retries:
+                        raise
+                else:
+                    if resp.status == 429 and self.on_throttle is not None:
+                        self.on_throttle()
+                    if resp.status not in RETRYABLE_STATUS or attempt >= self.max_retries:
+                        return resp
+                attempt += 1
+                self.retries += 1
+                time.sleep(self._backoff(attempt))
+        finally:
+            self.calls += 1
+            self.last_latency_ms = (time.perf_counter() - started) * 1000.0
+            self.total_latency_ms += self.last_latency_ms
+
+    def request(self, method: str, path: str, body: dict | None = None) -> dict:
+        data = json.dumps(body).encode("utf-8") if body is not None else None
+        resp = self.request_raw(method, path, data)
+        if resp.status >= 400:
+            raise OpenSearchError(resp.status, resp.data)
+        return json.loads(resp.data.decode("utf-8")) if resp.data else {}
+
+    def stats(self) -> dict:
+        return {
+            "calls": self.calls,
+            "retries": self.retries,
+            "last_latency_ms": round(self.last_latency_ms, 2),
+            "total_latency_ms": round(self.total_latency_ms, 2),
+        }
@@ -0,0 +1,52 @@
+import re
+
+# ---------- Small-talk intents ----------
+# GreetingIntent / ThankYouIntent as configured on the Lex bot: its sample utterances
+# and the fixed reply LF1 closes them with. LF0 matches the same utterances locally
+# (see match) so "hi" and "thanks" don't need a Lex round trip.
+INTENTS = {
+    "GreetingIntent": {
+        "reply": "Hi there, how can I help?",
+        "utterances": ("hi", "hello", "hey", "hiya", "howdy", "good morning", "good afternoon",
+                       "good evening", "hello bot", "hi bot", "hey bot"),
+    },
+    "ThankYouIntent": {
+        "reply": "You're welcome.",
+        "utterances": ("thanks", "thank you", "thanks a lot", "thank you so much", "thank you very much",
+                       "thanks so much", "many thanks", "thx", "ty", "cheers", "much appreciated"),
+    },
+}
+# Words people tack on without changing the intent: "hi there", "thanks again"
+_SUFFIXES = ("there", "again", "all", "everyone", "folks")
+
+_STRIP = re.compile(r"[^\w\s']+")
+_SPACES = re.compile(r"\s+")
+
+
+def normalize(text: str) -> str:
+    """'  Hello there!! ' -> 'hello there'."""
+    return _SPACES.sub(" ", _STRIP.sub(" ", str(text).lower())).strip()
+
+
+def _compile(utterances) -> re.Pattern:
+    # longest first so "thank you so much" wins over "thank you"
+    alts = "|".join(re.escape(u) for u in sorted(utterances, key=len, reverse=True))
+    suffix = "|".join(_SUFFIXES)
+    return re.compile(rf"(?:{alts})(?: (?:{suffix}))?")
+
+_PATTERNS = tuple((name, _compile(spec["utterances"])) for name, spec in INTENTS.items())
+
+
+def match(text: str) -> str | None:
+    """Intent name when the whole message is a small-talk utterance, else None."""
+    norm = normalize(text)
+    if not norm or len(norm) > 40:
+        return None
+    for name, pattern in _PATTERNS:
+        if pattern.fullmatch(norm):
+            return name
+    return None
+
+
+def reply(intent: str) -> str:
+    return INTENTS[intent]["reply"]
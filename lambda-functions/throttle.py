@@ -0,0 +1,220 @@
+import random, threading, time
+
+from botocore.exceptions import ConnectionError as BotoConnectionError, HTTPClientError
+
+# Error codes AWS services use for "slow down" (SES, DynamoDB, generic API throttling)
+THROTTLE_CODES = {
+    "Throttling", "ThrottlingException", "ThrottledException", "TooManyRequestsException",
+    "ProvisionedThroughputExceededException", "RequestLimitExceeded", "RequestThrottled", "SlowDown",
+}
+
+
+class ThrottleTimeout(RuntimeError):
+    """No concurrency slot freed up within acquire_timeout."""
+
+
+def is_throttle(exc: Exception) -> bool:
+    """botocore ClientError with a throttling code, or an HTTP 429 (OpenSearchError.status)."""
+    code = (getattr(exc, "response", None) or {}).get("Error", {}).get("Code")
+    return code in THROTTLE_CODES or getattr(exc, "status", None) == 429
+
+
+def is_transient(exc: Exception) -> bool:
+    """Connection errors, timeouts and 5xx: worth a retry, but not a reason to slow down."""
+    if isinstance(exc, (BotoConnectionError, HTTPClientError)):
+        return True
+    status = (getattr(exc, "response", None) or {}).get("ResponseMetadata", {}).get("HTTPStatusCode")
+    return (status or getattr(exc, "status", None) or 0) >= 500
+
+
+class TokenBucket:
+    """
+    Thread-safe token bucket: `rate` tokens/sec, up to `burst` saved up. The rate can be
+    changed live. Shared by LF2's Throttle and the other-scripts rate limits.
+    """
+
+    def __init__(self, rate: float, burst: float | None = None):
+        self.rate = rate
+        self.capacity = burst if burst is not None else max(1.0, rate)
+        self.tokens = float(self.capacity)
+        self.updated = time.monotonic()
+        self.resume_at = 0.0  # set by pause (Retry-After): nothing goes out before this
+        self.lock = threading.Lock()
+
+    def acquire(self, n: float = 1) -> float:
+        """Blocks until n tokens are available; returns the seconds waited."""
+        # a bulk send bigger than the burst waits for a full bucket and leaves it in
+        # debt for the rest, so the average rate holds for any cost
+        need = min(n, self.capacity)
+        waited = 0.0
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                if now < self.resume_at:
+                    wait = self.resume_at - now
+                else:
+                    # nothing refills during a pause
+                    start = max(self.updated, self.resume_at)
+                    self.tokens = min(self.capacity, self.tokens + (now - start) * self.rate)
+                    self.updated = now
+                    if self.tokens >= need:
+                        self.tokens -= n
+                        return waited
+                    wait = (need - self.tokens) / self.rate
+            time.sleep(wait)
+            waited += wait
+
+    def pause(self, seconds: float):
+        """
+        Server asked us to back off (Retry-After): nothing goes out for `seconds` from now.
+        Several threads reporting the same 429 extend the pause instead of stacking it.
+        """
+        with self.lock:
+            self.resume_at = max(self.resume_at, time.monotonic() + seconds)
+            self.tokens = min(self.tokens, 0)  # no saved-up burst right at resume
+
+
+class Throttle:
+    """
+    Client-side limiter for one backend:
+      - AIMD concurrency limit: +1 per `limit` successes, x`decrease` on a throttle
+        (at most once per `cooldown` seconds, so one burst of 429s counts once)
+      - optional token bucket (e.g. SES MaxSendRate); its rate gets the same AIMD
+        treatment between 5% of the ceiling and the ceiling
+      - throttling and transient errors are retried max_retries times with short jittered
+        backoff (only throttles lower the limits), anything else is raised untouched.
+        Give wrapped clients no retries of their own (aws_clients max_attempts=1) so
+        this is the one retry layer
+    rate_source() gives the bucket's rate (None/0 = no bucket); if it raises, calls go
+    unpaced and it is asked again after rate_retry_base, doubling up to rate_retry_cap.
+    """
+
+    def __init__(self, name: str, *, initial_limit: float = 4, min_limit: float = 1, max_limit: float = 16,
+                 decrease: float = 0.5, cooldown: float = 1.0, max_retries: int = 2,
+                 backoff_base: float = 0.05, backoff_cap: float = 1.0, acquire_timeout: float = 10.0,
+                 rate_source=None, rate_retry_base: float = 1.0, rate_retry_cap: float = 60.0):
+        self.name = name
+        self.limit = float(initial_limit)
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.decrease = decrease
+        self.cooldown = cooldown
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_cap = backoff_cap
+        self.acquire_timeout = acquire_timeout
+
+        self._rate_source = rate_source   # () -> tokens/sec, resolved on first call
+        self.rate_retry_base = rate_retry_base
+        self.rate_retry_cap = rate_retry_cap
+        self._rate_retry_at = 0.0
+        self._rate_failures = 0
+        self._resolving = False
+        self.bucket: TokenBucket | None = None
+        self.max_rate: float | None = None
+
+        self.inflight = 0
+        self._cv = threading.Condition()
+        self._last_decrease = 0.0
+        self.counts = {"calls": 0, "throttles": 0, "retries": 0, "decreases": 0, "waited_ms": 0.0,
+                       "rate_lookup_failures": 0}
+
+    # ---------- limits ----------
+    def _init_bucket(self):
+        """One thread asks rate_source (a network call) outside _cv; the others go on unpaced."""
+        with self._cv:
+            if self._rate_source is None or self._resolving or time.monotonic() < self._rate_retry_at:
+                return
+            self._resolving = True
+        try:
+            rate = self._rate_source()
+        except Exception:
+            with self._cv:
+                self._resolving = False
+                self._rate_failures += 1
+                self.counts["rate_lookup_failures"] += 1
+                backoff = min(self.rate_retry_cap, self.rate_retry_base * 2 ** (self._rate_failures - 1))
+                self._rate_retry_at = time.monotonic() + backoff
+            return
+        with self._cv:
+            self._resolving = False
+            self._rate_source = None
+            if rate and rate > 0:
+                self.max_rate = float(rate)
+                self.bucket = TokenBucket(self.max_rate)
+
+    def _acquire(self, cost: float):
+        if self._rate_source is not None:
+            self._init_bucket()
+        started = time.monotonic()
+        with self._cv:
+            deadline = started + self.acquire_timeout
+            while self.inflight >= int(self.limit):
+                left = deadline - time.monotonic()
+                if left <= 0:
+                    raise ThrottleTimeout(f"{self.name}: no slot within {self.acquire_timeout}s "
+                                          f"(limit={int(self.limit)})")
+                self._cv.wait(left)
+            self.inflight += 1
+            self.counts["calls"] += 1
+        if self.bucket is not None and cost:
+            self.bucket.acquire(cost)
+        with self._cv:
+            self.counts["waited_ms"] += (time.monotonic() - started) * 1000
+
+    def _release(self, throttled: bool):
+        with self._cv:
+            self.inflight -= 1
+            if throttled:
+                self._on_throttle()
+            else:
+                self.limit = min(self.max_limit, self.limit + 1.0 / self.limit)
+                if self.bucket is not None:
+                    self.bucket.rate = min(self.max_rate, self.bucket.rate + self.max_rate / 20)
+            self._cv.notify()
+
+    def _on_throttle(self):
+        self.counts["throttles"] += 1
+        now = time.monotonic()
+        if now - self._last_decrease < self.cooldown:
+            return
+        self._last_decrease = now
+        self.counts["decreases"] += 1
+        self.limit = max(self.min_limit, self.limit * self.decrease)
+        if self.bucket is not None:
+            self.bucket.rate = max(self.max_rate / 20, self.bucket.rate * self.decrease)
+
+    def throttled(self):
+        """Signal from a client that retried a throttle internally (e.g. OpenSearch 429s)."""
+        with self._cv:
+            self._on_throttle()
+
+    # ---------- calls ----------
+    def call(self, fn, *args, cost: float = 1, **kwargs):
+        """fn(*args, **kwargs) under this backend's limits; cost = tokens (e.g. recipients, 0 = unpaced)."""
+        attempt = 0
+        while True:
+            self._acquire(cost)
+            try:
+                result = fn(*args, **kwargs)
+            except Exception as e:
+                throttled = is_throttle(e)
+                self._release(throttled)
+                if not (throttled or is_transient(e)) or attempt >= self.max_retries:
+                    raise
+                attempt += 1
+                with self._cv:
+                    self.counts["retries"] += 1
+                time.sleep(random.uniform(0, min(self.backoff_cap, self.backoff_base * (2 ** attempt))))
+                continue
+            self._release(False)
+            return result
+
+    def metrics(self) -> dict:
+        return {
+            "limit": round(self.limit, 2),
+            "inflight": self.inflight,
+            "rate": round(self.bucket.rate, 2) if self.bucket is not None else None,
+            "max_rate": self.max_rate,
+            **{k: round(v, 1) if isinstance(v, float) else v for k, v in self.counts.items()},
+        }
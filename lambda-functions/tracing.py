@@ -0,0 +1,100 @@
+import os, threading, time, uuid
+from contextlib import contextmanager
+
+# ---------- Request tracing + per-stage metrics ----------
+# LF0 creates a trace ID per chat turn and hands it to Lex as a session attribute;
+# LF1 copies it into the SQS message attributes and LF2 reads it back, so the
+# log lines of one request can be joined across the three functions.
+# Stage timings are CloudWatch Embedded Metric Format lines: CloudWatch turns them
+# into StageLatency metrics per (Function, Stage) without any PutMetricData calls.
+TRACE_ATTR = "traceId"            # Lex session attribute and SQS message attribute name
+TRACE_HEADER = "X-Trace-Id"       # lets a client (or a load test) pick the trace ID
+
+# "emf" = emit metric lines (default), "off" = timers still run but nothing is logged (tests)
+METRICS_MODE = os.environ.get("METRICS_MODE", "emf").lower()
+METRICS_NAMESPACE = os.environ.get("METRICS_NAMESPACE", "DiningConcierge")
+
+
+def new_trace_id() -> str:
+    return uuid.uuid4().hex
+
+
+def from_message(msg: dict) -> str | None:
+    """Trace ID of an SQS message in receive_message shape."""
+    attr = (msg.get("MessageAttributes") or {}).get(TRACE_ATTR) or {}
+    return attr.get("StringValue")
+
+
+def message_attributes(trace_id: str | None) -> dict:
+    """MessageAttributes for sqs.send_message carrying the trace ID."""
+    return {TRACE_ATTR: {"DataType": "String", "StringValue": trace_id}} if trace_id else {}
+
+
+def dwell_ms(msg: dict, now: float | None = None) -> float | None:
+    """Milliseconds since SQS accepted the message (its SentTimestamp attribute)."""
+    sent = (msg.get("Attributes") or {}).get("SentTimestamp")
+    if sent is None:
+        return None
+    return (time.time() if now is None else now) * 1000 - int(sent)
+
+
+class Tracer:
+    """
+    Per-function emitter. `log` is the function's log_json; `with tracer.traced(ids)`
+    tags every stage timed on this thread with the trace IDs of the work in hand.
+    """
+
+    def __init__(self, function: str, log, enabled: bool | None = None):
+        self.function = function
+        self.log = log
+        self.enabled = METRICS_MODE == "emf" if enabled is None else enabled
+        self._local = threading.local()
+
+    @contextmanager
+    def traced(self, trace_ids):
+        ids = [t for t in trace_ids if t]
+        prev = getattr(self._local, "ids", None)
+        self._local.ids = ids
+        try:
+            yield ids
+        finally:
+            self._local.ids = prev
+
+    def current(self) -> list[str]:
+        return getattr(self._local, "ids", None) or []
+
+    def emit(self, stage: str, ms: float, trace_id: str | None = None, **props):
+        if not self.enabled:
+            return
+        ids = [trace_id] if trace_id else self.current()
+        if len(ids) == 1:
+            props["traceId"] = ids[0]
+        elif ids:
+            props["traceIds"] = ids
+        self.log("INFO", **{
+            "_aws": {
+                "Timestamp": int(time.time() * 1000),
+                "CloudWatchMetrics": [{
+                    "Namespace": METRICS_NAMESPACE,
+                    "Dimensions": [["Function", "Stage"]],
+                    "Metrics": [{"Name": "StageLatency", "Unit": "Milliseconds"}],
+                }],
+            },
+            "event": "stage_timing",
+            "Function": self.function,
+            "Stage": stage,
+            "StageLatency": round(ms, 2),
+            **props,
+        })
+
+    @contextmanager
+    def timer(self, stage: str, trace_id: str | None = None, **props):
+        """Times the block and emits it, also when it raises (tagged error=True)."""
+        started = time.perf_counter()
+        try:
+            yield
+        except BaseException:
+            props["error"] = True
+            raise
+        finally:
+            self.emit(stage, (time.perf_counter() - started) * 1000, trace_id, **props)
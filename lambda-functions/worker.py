@@ -0,0 +1,260 @@
+"""
+Long-running LF2 consumer for containers (ECS/Fargate, EC2), same environment as LF2:
+
+    python lambda-functions/worker.py
+
+An asyncio loop runs WORKER_POLLERS concurrent SQS long-polls and hands each received
+batch to LF2's handle_messages (snapshot/OpenSearch/DynamoDB/SES, idempotency, error
+classification and logging unchanged) on a thread pool. At most WORKER_MAX_INFLIGHT
+messages are held at once; in-flight ones are kept invisible by LF2's VisibilityHeartbeat.
+
+SIGTERM/SIGINT: stop polling, release messages that were received but not started,
+finish the started ones, then exit, all within WORKER_SHUTDOWN_TIMEOUT of the signal.
+Long-polls still open at the deadline are abandoned (they run on daemon threads);
+anything they or unfinished batches hold comes back within HEARTBEAT_VISIBILITY seconds.
+"""
+import asyncio, os, signal, threading, time, uuid
+from concurrent.futures import ThreadPoolExecutor
+
+import lambda_function_2 as lf2
+
+# ---------- CONFIG ----------
+WORKER_POLLERS = int(os.environ.get("WORKER_POLLERS", "4"))                # concurrent long-polls
+WORKER_MAX_INFLIGHT = int(os.environ.get("WORKER_MAX_INFLIGHT", "200"))    # messages received but not yet acked
+WORKER_THREADS = int(os.environ.get("WORKER_THREADS", "32"))               # batches processed at once
+WORKER_WAIT_SECONDS = max(1, min(20, int(os.environ.get("WORKER_WAIT_SECONDS", "20"))))
+WORKER_SHUTDOWN_TIMEOUT = float(os.environ.get("WORKER_SHUTDOWN_TIMEOUT", "25"))  # ECS stopTimeout is 30s
+WORKER_STATS_INTERVAL = float(os.environ.get("WORKER_STATS_INTERVAL", "60"))
+
+
+class _Context:
+    """The parts of a Lambda context LF2 reads; a worker has no deadline."""
+
+    def __init__(self):
+        self.aws_request_id = f"worker-{os.getpid()}-{uuid.uuid4()}"
+
+    def get_remaining_time_in_millis(self) -> int:
+        return 24 * 3600 * 1000
+
+
+class _Window:
+    """Counts messages held by the worker; pollers reserve room before receiving."""
+
+    def __init__(self, size: int):
+        self.size = size
+        self.used = 0
+        self._cv = asyncio.Condition()
+
+    async def reserve(self, most: int, stopping: threading.Event) -> int:
+        async with self._cv:
+            await self._cv.wait_for(lambda: self.used < self.size or stopping.is_set())
+            if stopping.is_set():
+                return 0
+            n = min(most, self.size - self.used)
+            self.used += n
+            return n
+
+    async def release(self, n: int):
+        if n:
+            async with self._cv:
+                self.used -= n
+                self._cv.notify_all()
+
+    async def wake(self):
+        async with self._cv:
+            self._cv.notify_all()
+
+
+class Worker:
+    def __init__(self, pollers: int = WORKER_POLLERS, max_inflight: int = WORKER_MAX_INFLIGHT,
+                 threads: int = WORKER_THREADS, wait_seconds: int = WORKER_WAIT_SECONDS,
+                 shutdown_timeout: float = WORKER_SHUTDOWN_TIMEOUT, stats_interval: float = WORKER_STATS_INTERVAL):
+        self.pollers = pollers
+        self.threads = threads
+        self.max_inflight = max_inflight
+        self.wait_seconds = wait_seconds
+        self.shutdown_timeout = shutdown_timeout
+        self.stats_interval = stats_interval
+        # acks/releases; long-polls run on their own daemon threads (see _receive)
+        self.io_pool = ThreadPoolExecutor(max_workers=pollers, thread_name_prefix="sqs")
+        self.work_pool = ThreadPoolExecutor(max_workers=threads, thread_name_prefix="work")
+        self.context = _Context()
+        self.stats = {"received": 0, "processed": 0, "errors": 0, "released": 0, "batch_failures": 0}
+        self._stopping = threading.Event()  # read from worker threads too
+        self._stopped: asyncio.Event | None = None
+        self._deadline = 0.0                # loop time by which run() returns after stop()
+        self._loop: asyncio.AbstractEventLoop | None = None
+        self._window: _Window | None = None
+        self._tasks: set[asyncio.Task] = set()
+        self._heartbeat: lf2.VisibilityHeartbeat | None = None
+        self._polling = 0                   # window room reserved by open long-polls
+
+    # ---------- shutdown ----------
+    def stop(self):
+        """Begin a graceful shutdown (call on the loop; see request_stop from other threads)."""
+        if self._stopping.is_set():
+            return
+        self._stopping.set()
+        self._deadline = self._loop.time() + self.shutdown_timeout
+        self._stopped.set()
+        lf2.log_json("INFO", event="worker_stopping", inflight=self._window.used - self._polling if self._window else 0)
+        if self._window is not None:
+            self._loop.create_task(self._window.wake())
+
+    def request_stop(self):
+        self._loop.call_soon_threadsafe(self.stop)
+
+    def _install_signal_handlers(self):
+        for sig in (signal.SIGTERM, signal.SIGINT):
+            try:
+                self._loop.add_signal_handler(sig, self.stop)
+            except (NotImplementedError, RuntimeError, ValueError):
+                pass  # not the main thread (e.g. a benchmark) or no signal support
+
+    # ---------- receive ----------
+    async def _io(self, fn, *args):
+        return await self._loop.run_in_executor(self.io_pool, fn, *args)
+
+    def _receive(self, want: int) -> asyncio.Future:
+        """Long-poll on a daemon thread: one still open at shutdown can't hold up the exit."""
+        fut = self._loop.create_future()
+
+        def settle(result, error):
+            if not fut.done():
+                fut.set_exception(error) if error else fut.set_result(result)
+
+        def run():
+            try:
+                result, error = lf2.receive_messages(want, self.wait_seconds, lf2.HEARTBEAT_VISIBILITY), None
+            except Exception as e:
+                result, error = None, e
+            try:
+                self._loop.call_soon_threadsafe(settle, result, error)
+            except RuntimeError:
+                pass  # loop closed: the messages reappear after their visibility timeout
+
+        threading.Thread(target=run, name="sqs-poll", daemon=True).start()
+        return fut
+
+    async def _poll(self, n: int):
+        failures = 0
+        while not self._stopping.is_set():
+            want = await self._window.reserve(lf2.RECEIVE_BATCH_SIZE, self._stopping)
+            if not want:
+                return
+            self._polling += want
+            try:
+                msgs = await self._receive(want)
+                failures = 0
+            except Exception as e:
+                self._polling -= want
+                await self._window.release(want)
+                failures += 1
+                lf2.log_json("WARN", event="worker_receive_fail", poller=n,
+                             error={"type": type(e).__name__, "message": str(e)[:300]})
+                await asyncio.sleep(min(20.0, 0.5 * 2 ** failures))
+                continue
+            self._polling -= want
+            await self._window.release(want - len(msgs))
+            if not msgs:
+                continue
+            self.stats["received"] += len(msgs)
+            if self._stopping.is_set():
+                # arrived after SIGTERM: hand straight back
+                released = await self._io(lf2.release_messages, msgs)
+                self.stats["released"] += released
+                await self._window.release(len(msgs))
+                return
+            self._heartbeat.add(msgs)
+            task = self._loop.create_task(self._process(msgs))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    # ---------- process ----------
+    def _work(self, msgs: list[dict]) -> list[bool] | None:
+        """Runs on a work thread; None = shutdown began before the batch was started."""
+        if self._stopping.is_set():
+            return None
+        return lf2.handle_messages(msgs, self.context)
+
+    async def _process(self, msgs: list[dict]):
+        try:
+            ok = await self._loop.run_in_executor(self.work_pool, self._work, msgs)
+            self._heartbeat.remove(msgs)
+            if ok is None:
+                released = await self._io(lf2.release_messages, msgs)
+                self.stats["released"] += released  # not `+= await`: that reads the count before awaiting
+                return
+            done = [m for m, good in zip(msgs, ok) if good]
+            self.stats["errors"] += len(msgs) - len(done)
+            # Failed deletes are only re-deliveries, not failures: the work was done
+            await self._io(lf2.delete_message_batch, done)
+            self.stats["processed"] += len(done)
+        except Exception as e:
+            # unexpected: the messages reappear after their visibility timeout
+            self._heartbeat.remove(msgs)
+            self.stats["batch_failures"] += 1
+            lf2.log_json("ERROR", event="worker_batch_fail", count=len(msgs),
+                         error={"type": type(e).__name__, "message": str(e)[:300]})
+        finally:
+            await self._window.release(len(msgs))
+
+    # ---------- reporting ----------
+    def report(self, elapsed: float) -> dict:
+        held = self._window.used - self._polling if self._window else 0
+        return {**self.stats, "inflight": held,
+                "seconds": round(elapsed, 2),
+                "messages_per_sec": round(self.stats["processed"] / elapsed, 1) if elapsed else None}
+
+    async def _report_every(self, started: float):
+        last = 0
+        while True:
+            await asyncio.sleep(self.stats_interval)
+            done = self.stats["processed"]
+            lf2.log_json("INFO", event="worker_stats", **self.report(time.perf_counter() - started),
+                         interval_per_sec=round((done - last) / self.stats_interval, 1),
+                         backends=lf2.throttle_metrics())
+            last = done
+
+    # ---------- main loop ----------
+    async def run(self, install_signals: bool = True) -> dict:
+        self._loop = asyncio.get_running_loop()
+        self._window = _Window(self.max_inflight)
+        self._stopped = asyncio.Event()
+        if install_signals:
+            self._install_signal_handlers()
+        started = time.perf_counter()
+        lf2.log_json("INFO", event="worker_start", pollers=self.pollers, max_inflight=self.max_inflight,
+                     threads=self.threads, wait_seconds=self.wait_seconds)
+
+        with lf2.VisibilityHeartbeat(self.context) as heartbeat:
+            self._heartbeat = heartbeat
+            reporter = self._loop.create_task(self._report_every(started))
+            pollers = [self._loop.create_task(self._poll(n)) for n in range(self.pollers)]
+            await self._stopped.wait()
+
+            # the budget runs from the signal: wait for started batches only; polls still
+            # open are abandoned (a poll returning before then releases its messages)
+            unfinished = set(self._tasks)
+            if unfinished:
+                _, unfinished = await asyncio.wait(unfinished, timeout=max(0.0, self._deadline - self._loop.time()))
+            abandoned = [p for p in pollers if not p.done()]
+            for t in [*unfinished, *abandoned]:
+                t.cancel()
+            reporter.cancel()
+
+        # after a timeout, don't wait for the stragglers (their heartbeat has stopped)
+        self.io_pool.shutdown(wait=not unfinished, cancel_futures=bool(unfinished))
+        self.work_pool.shutdown(wait=not unfinished, cancel_futures=bool(unfinished))
+        report = self.report(time.perf_counter() - started)
+        lf2.log_json("INFO", event="worker_stopped", **report, unfinished_batches=len(unfinished),
+                     abandoned_polls=len(abandoned),
+                     heartbeat=heartbeat.stats, backends=lf2.throttle_metrics())
+        return report
+
+
+def main():
+    return asyncio.run(Worker().run())
+
+if __name__ == "__main__":
+    main()
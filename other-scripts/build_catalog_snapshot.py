@@ -0,0 +1,40 @@
+import os
+import sys
+import boto3
+
+# catalog_snapshot.py ships with LF2, so the builder and the reader share one format
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "lambda-functions"))
+from catalog_snapshot import write_snapshot, load  # noqa: E402
+
+# ---------- CONFIG ----------
+REGION = "us-east-1"
+TABLE_NAME = "yelp-restaurants"
+OUTPUT_PATH = "catalog.snap"  # bundle next to lambda_function_2.py (or set CATALOG_SNAPSHOT_PATH)
+# ---------------------------
+
+dynamodb = boto3.resource("dynamodb", region_name=REGION)
+table = dynamodb.Table(TABLE_NAME)
+
+def scan_catalog():
+    """Yield every restaurant with just the attributes the suggestion email and city filter need."""
+    kwargs = {
+        "ProjectionExpression": "business_id, #Name, Address, CuisineSet, Coordinates",
+        "ExpressionAttributeNames": {"#Name": "Name"},
+    }
+    while True:
+        resp = table.scan(**kwargs)
+        for it in resp.get("Items", []):
+            it["CuisineSet"] = list(it.get("CuisineSet") or [])
+            yield it
+        start = resp.get("LastEvaluatedKey")
+        if not start:
+            break
+        kwargs["ExclusiveStartKey"] = start
+
+if __name__ == "__main__":
+    out = sys.argv[1] if len(sys.argv) > 1 else OUTPUT_PATH
+    stats = write_snapshot(out, scan_catalog())
+    snap = load(out)
+    print(f"Wrote {out}: {stats['records']} restaurants, {stats['bytes']} bytes")
+    for c in sorted(snap.cuisines()):
+        print(f"  {c}: e.g. {snap.sample(c, 1)[0]['Name']}")
@@ -0,0 +1,305 @@
+"""
+Replay DiningRequestsDLQ after an outage: read the DLQ in parallel, pick messages by
+LF2's logged error class and/or age, then re-enqueue them to the main queue or run
+them through LF2 right here. Rate and concurrency capped so the recovered backend
+isn't knocked over again.
+
+    python other-scripts/dlq_redrive.py --dry-run --errors-from lf2-errors.jsonl
+    python other-scripts/dlq_redrive.py --mode requeue --error-class ClientError:Throttling --rate 50
+    python other-scripts/dlq_redrive.py --mode process --older-than 3600 --concurrency 8 --rate 10
+
+--errors-from takes LF2's log_json lines (send_fail_ses / send_fail_unknown), e.g. from
+`aws logs filter-log-events --log-group-name /aws/lambda/LF2 --filter-pattern '"send_fail"'`.
+They are joined on sqsMessageId: SQS keeps the MessageId when it moves a message to the DLQ.
+Messages that aren't selected or fail (or all of them, with --dry-run) are kept invisible
+while the run lasts, then made visible again at the end; each is counted once.
+"""
+import os
+import sys
+import json
+import time
+import uuid
+import argparse
+import threading
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+import boto3
+
+# ---------- CONFIG ----------
+REGION = os.environ.get("AWS_REGION", "us-east-1")
+DLQ_URL = os.environ.get("DLQ_URL", "")       # DiningRequestsDLQ
+QUEUE_URL = os.environ.get("QUEUE_URL", "")   # DiningRequestsQueue (also what LF2 reads in --mode process)
+READERS = 4                # parallel receive loops on the DLQ
+CONCURRENCY = 8            # parallel requeue / process jobs
+RATE_PER_SEC = 20          # messages/sec handed to the backend (or the main queue)
+VISIBILITY_TIMEOUT = 900   # DLQ messages stay hidden this long while the run holds them
+EMPTY_POLLS = 2            # a reader stops after this many empty long polls in a row
+# ---------------------------
+
+LF2_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "lambda-functions")
+sys.path.insert(0, LF2_DIR)
+from throttle import TokenBucket  # noqa: E402
+
+
+# ---------- Error classes from LF2's logs ----------
+def _log_records(path: str):
+    """log_json dicts from JSON lines, CloudWatch {"message": ...} wrappers or a filter-log-events dump."""
+    with open(path) as f:
+        text = f.read()
+    try:
+        doc = json.loads(text)
+        lines = [e.get("message", "") for e in doc.get("events", [])] if isinstance(doc, dict) else []
+    except json.JSONDecodeError:
+        lines = text.splitlines()
+    for line in lines:
+        try:
+            rec = json.loads(line) if isinstance(line, str) else line
+        except json.JSONDecodeError:
+            continue
+        if isinstance(rec, dict) and isinstance(rec.get("message"), str) and "event" not in rec:
+            try:
+                rec = json.loads(rec["message"])
+            except json.JSONDecodeError:
+                continue
+        if isinstance(rec, dict):
+            yield rec
+
+def error_class(rec: dict) -> str:
+    """send_fail_ses -> "ClientError:<code>", send_fail_unknown -> exception type."""
+    err = rec.get("error") or {}
+    if err.get("type") == "ClientError":
+        return f"ClientError:{err.get('code') or 'Unknown'}"
+    return err.get("type") or rec.get("event") or "unknown"
+
+def load_error_classes(path: str | None) -> dict[str, str]:
+    """sqsMessageId -> class of the last failure logged for it."""
+    classes = {}
+    if not path:
+        return classes
+    for rec in _log_records(path):
+        if rec.get("event", "").startswith("send_fail") and rec.get("sqsMessageId"):
+            classes[rec["sqsMessageId"]] = error_class(rec)
+    return classes
+
+def matches_class(cls: str, wanted: list[str]) -> bool:
+    # "ClientError" selects every ClientError:<code>
+    return not wanted or any(cls == w or cls.split(":", 1)[0] == w for w in wanted)
+
+
+# ---------- Actions ----------
+def _message_attributes(msg: dict) -> dict:
+    # send_message_batch rejects the empty list fields receive_message returns
+    return {k: {f: v for f, v in a.items() if f in ("DataType", "StringValue", "BinaryValue")}
+            for k, a in (msg.get("MessageAttributes") or {}).items()}
+
+def requeue(sqs, msgs: list[dict]) -> list[dict]:
+    """Send up to 10 messages to the main queue; returns those that made it."""
+    entries = [{"Id": str(i), "MessageBody": m["Body"], "MessageAttributes": _message_attributes(m)}
+               for i, m in enumerate(msgs)]
+    resp = sqs.send_message_batch(QueueUrl=QUEUE_URL, Entries=entries)
+    return [msgs[int(s["Id"])] for s in resp.get("Successful", [])]
+
+class _Context:
+    """What LF2's handlers read from a Lambda context."""
+
+    def __init__(self):
+        self.aws_request_id = f"dlq-redrive-{uuid.uuid4()}"
+
+    def get_remaining_time_in_millis(self) -> int:
+        return 15 * 60 * 1000
+
+def process_directly(lf2, msgs: list[dict]) -> list[dict]:
+    """Run each message through LF2 (idempotency, process_request, logging); returns the successes."""
+    ctx = _Context()
+    return [m for m in msgs if lf2.handle_message(m, ctx)]
+
+def delete_batch(sqs, msgs: list[dict]) -> int:
+    if not msgs:
+        return 0
+    resp = sqs.delete_message_batch(QueueUrl=DLQ_URL, Entries=[
+        {"Id": str(i), "ReceiptHandle": m["ReceiptHandle"]} for i, m in enumerate(msgs)])
+    return len(resp.get("Successful", []))
+
+def set_visibility(sqs, msgs: list[dict], seconds: int) -> int:
+    """Change the DLQ visibility of messages in hand; returns how many took it."""
+    changed = 0
+    for i in range(0, len(msgs), 10):
+        chunk = msgs[i:i + 10]
+        resp = sqs.change_message_visibility_batch(QueueUrl=DLQ_URL, Entries=[
+            {"Id": str(k), "ReceiptHandle": m["ReceiptHandle"], "VisibilityTimeout": seconds}
+            for k, m in enumerate(chunk)])
+        changed += len(resp.get("Successful", []))
+    return changed
+
+def release(sqs, msgs: list[dict]) -> int:
+    """Make messages visible on the DLQ again; returns how many were released."""
+    return set_visibility(sqs, msgs, 0)
+
+
+# ---------- Redrive ----------
+def age_bucket(age_s: float) -> str:
+    for limit, name in ((3600, "<1h"), (6 * 3600, "1-6h"), (24 * 3600, "6-24h"), (3 * 86400, "1-3d")):
+        if age_s < limit:
+            return name
+    return ">3d"
+
+def redrive(args, sqs=None, lf2=None) -> dict:
+    sqs = sqs or boto3.client("sqs", region_name=REGION)
+    if args.mode == "process" and lf2 is None and not args.dry_run:
+        import lambda_function_2 as lf2  # needs LF2's env vars (QUEUE_URL, DDB_TABLE, ...)
+    classes = load_error_classes(args.errors_from)
+
+    lock = threading.Lock()
+    stats = Counter()
+    by_class, by_age = Counter(), Counter()
+    # MessageId -> latest receipt of messages not selected, dry run or failed: released
+    # at the end. LF2's own failure path nudges visibility on QUEUE_URL, not the DLQ.
+    held: dict[str, dict] = {}
+    picked_out: dict[str, dict] = {}  # handed to act, not finished yet
+    seen: set[str] = set()
+    bucket = TokenBucket(args.rate, max(1, int(args.rate)))
+    slots = threading.BoundedSemaphore(2 * args.concurrency)  # backpressure on the readers
+    started = time.perf_counter()
+
+    def hold(msgs: list[dict]):
+        # caller holds `lock`
+        for m in msgs:
+            held[m["MessageId"]] = m
+
+    def heartbeat(stop: threading.Event):
+        # a run longer than --visibility must not let the messages it holds reappear
+        while not stop.wait(args.visibility / 3):
+            with lock:
+                in_hand = [*held.values(), *picked_out.values()]
+            try:
+                set_visibility(sqs, in_hand, args.visibility)
+            except Exception as e:
+                with lock:
+                    stats["errors:" + type(e).__name__] += 1
+
+    def act(msgs: list[dict]):
+        try:
+            if args.mode == "requeue":
+                bucket.acquire(len(msgs))
+                done = requeue(sqs, msgs)
+            else:
+                done = []
+                for m in msgs:
+                    bucket.acquire()
+                    done.extend(process_directly(lf2, [m]))
+            deleted = delete_batch(sqs, done)
+            ok = {m["MessageId"] for m in done}
+            with lock:
+                stats["succeeded"] += len(done)
+                stats["failed"] += len(msgs) - len(done)
+                stats["deleted"] += deleted
+                hold([m for m in msgs if m["MessageId"] not in ok])
+        except Exception as e:
+            with lock:
+                stats["failed"] += len(msgs)
+                stats["errors:" + type(e).__name__] += 1
+                hold(msgs)
+        finally:
+            with lock:
+                for m in msgs:
+                    picked_out.pop(m["MessageId"], None)
+            slots.release()
+
+    def read(pool: ThreadPoolExecutor):
+        empty = 0
+        while empty < args.empty_polls:
+            with lock:
+                if args.max_messages and stats["received"] >= args.max_messages:
+                    return
+            resp = sqs.receive_message(QueueUrl=DLQ_URL, MaxNumberOfMessages=10, WaitTimeSeconds=2,
+                                       VisibilityTimeout=args.visibility, AttributeNames=["All"],
+                                       MessageAttributeNames=["All"])
+            now_ms = time.time() * 1000
+            picked, fresh = [], 0
+            for m in resp.get("Messages", []):
+                with lock:
+                    if m["MessageId"] in seen:
+                        # back after --visibility: count it once, release it by its newest receipt
+                        stats["redelivered"] += 1
+                        hold([m])
+                        continue
+                    seen.add(m["MessageId"])
+                fresh += 1
+                cls = classes.get(m["MessageId"], "unknown")
+                age_s = (now_ms - int(m.get("Attributes", {}).get("SentTimestamp", now_ms))) / 1000
+                ok = matches_class(cls, args.error_class) and \
+                    (args.older_than is None or age_s >= args.older_than) and \
+                    (args.newer_than is None or age_s <= args.newer_than)
+                with lock:
+                    stats["received"] += 1
+                    by_class[cls] += 1
+                    by_age[age_bucket(age_s)] += 1
+                    if ok:
+                        stats["matched"] += 1
+                    if not ok or args.dry_run:
+                        hold([m])
+                if ok and not args.dry_run:
+                    picked.append(m)
+                    with lock:
+                        picked_out[m["MessageId"]] = m
+            if picked:
+                slots.acquire()
+                pool.submit(act, picked)
+            # only messages already handled this run: as good as an empty poll
+            empty = 0 if fresh else empty + 1
+
+    stop = threading.Event()
+    beat = threading.Thread(target=heartbeat, args=(stop,), daemon=True)
+    beat.start()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+        readers = [threading.Thread(target=read, args=(pool,), daemon=True) for _ in range(args.readers)]
+        for t in readers:
+            t.start()
+        for t in readers:
+            t.join()
+    stop.set()
+    beat.join()
+    released = release(sqs, list(held.values()))
+
+    elapsed = time.perf_counter() - started
+    return {
+        "mode": args.mode,
+        "dry_run": args.dry_run,
+        "filters": {"error_class": args.error_class, "older_than_s": args.older_than,
+                    "newer_than_s": args.newer_than},
+        **{k: stats[k] for k in ("received", "matched", "succeeded", "failed", "deleted")},
+        "redelivered": stats["redelivered"],
+        "released": released,
+        "errors": {k.split(":", 1)[1]: v for k, v in stats.items() if k.startswith("errors:")},
+        "by_error_class": dict(by_class.most_common()),
+        "by_age": dict(by_age),
+        "seconds": round(elapsed, 2),
+        "messages_per_sec": round(stats["succeeded"] / elapsed, 1) if elapsed else None,
+    }
+
+def main(argv=None):
+    p = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    p.add_argument("--mode", choices=["requeue", "process"], default="requeue",
+                   help="requeue: send back to the main queue; process: run LF2's handler in this process")
+    p.add_argument("--dry-run", action="store_true", help="only report what would be replayed")
+    p.add_argument("--errors-from", help="LF2 log_json export to classify messages by their last failure")
+    p.add_argument("--error-class", action="append", default=[],
+                   help="replay only these classes, e.g. ClientError:Throttling, ClientError, OpenSearchError, unknown")
+    p.add_argument("--older-than", type=float, help="seconds since the original send")
+    p.add_argument("--newer-than", type=float, help="seconds since the original send")
+    p.add_argument("--max-messages", type=int, default=0, help="stop reading after this many (0 = all)")
+    p.add_argument("--readers", type=int, default=READERS)
+    p.add_argument("--concurrency", type=int, default=CONCURRENCY)
+    p.add_argument("--rate", type=float, default=RATE_PER_SEC, help="messages/sec")
+    p.add_argument("--visibility", type=int, default=VISIBILITY_TIMEOUT)
+    p.add_argument("--empty-polls", type=int, default=EMPTY_POLLS)
+    args = p.parse_args(argv)
+    if not DLQ_URL or (args.mode == "requeue" and not QUEUE_URL):
+        p.error("set DLQ_URL (and QUEUE_URL for --mode requeue)")
+
+    report = redrive(args)
+    print(json.dumps(report, indent=2))
+    return report
+
+if __name__ == "__main__":
+    main()
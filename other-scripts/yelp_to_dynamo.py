@@ -1,8 +1,20 @@
+import os
+import sys
+import json
 import time
+import random
+import threading
+import itertools
 import requests
 from decimal import Decimal
 from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from concurrent.futures import ThreadPoolExecutor, as_completed
 import boto3
+from boto3.dynamodb.types import TypeSerializer, TypeDeserializer
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "lambda-functions"))
+from throttle import TokenBucket  # noqa: E402  (shared with LF2 and dlq_redrive)
 
 # ---------- CONFIG ----------
 REGION = "us-east-1"
@@ -15,10 +27,22 @@ LOCATION = "Manhattan"
 CUISINES = ["Italian", "Chinese", "Mexican", "Indian", "Japanese"]  # ≥5 cuisines total
 TARGET_PER_CUISINE = 200  # aim ~200 each
 PAGE_SIZE = 50            # Yelp max 50
+
+FETCH_WORKERS = 8         # concurrent page fetches
+RATE_PER_SEC = 5          # Yelp Fusion QPS quota
+RATE_BURST = 5
+MAX_RETRIES = 5           # per page, on 429 / 5xx / network errors
+WRITE_WORKERS = 4         # parallel BatchWriteItem calls
+FLUSH_PAGES = 10          # write (and checkpoint) the aggregate every N fetched pages
+MERGE_EXISTING = False    # keep stored CuisineSet/insertedAtTimestamp (forced on when resuming a checkpoint)
+CHECKPOINT_PATH = "yelp_checkpoint.json"  # completed (cuisine, offset) pages; delete to start over
+FIXTURES_DIR = os.environ.get("YELP_FIXTURES_DIR")  # replay recorded responses instead of calling Yelp
 # ---------------------------
 
 dynamodb = boto3.resource("dynamodb", region_name=REGION)
 table = dynamodb.Table(TABLE_NAME)
+ddb_client = boto3.client("dynamodb", region_name=REGION)  # low-level, for batch calls
+_ser, _deser = TypeSerializer(), TypeDeserializer()
 
 def as_decimal(x):
     """Convert int/float/None to Decimal-compatible types for DynamoDB."""
@@ -29,7 +53,70 @@ def as_decimal(x):
         return Decimal(str(x))
     return x
 
-def fetch_yelp_page(cuisine: str, offset: int):
+class Checkpoint:
+    """Completed (cuisine, offset) pages, persisted as JSON so a rerun skips them."""
+
+    def __init__(self, path: str | None):
+        self.path = path
+        self.lock = threading.Lock()
+        self.done = set()
+        if path and os.path.exists(path):
+            with open(path) as f:
+                self.done = {tuple(x) for x in json.load(f)}
+
+    def __contains__(self, page):
+        return page in self.done
+
+    def mark(self, cuisine: str, offset: int):
+        with self.lock:
+            self.done.add((cuisine, offset))
+            if self.path:
+                tmp = self.path + ".tmp"
+                with open(tmp, "w") as f:
+                    json.dump(sorted(self.done), f)
+                os.replace(tmp, self.path)
+
+
+def yelp_http_get(url: str, params: dict):
+    """Default transport. Any callable returning (status, headers, json_or_text) can replace it."""
+    r = requests.get(url, headers=HEADERS, params=params, timeout=20)
+    try:
+        data = r.json()
+    except ValueError:
+        data = r.text
+    return r.status_code, r.headers, data
+
+
+def fixture_http_get(fixtures_dir: str):
+    """Replay recorded responses saved as <fixtures_dir>/<term>_<offset>.json (missing file = empty page)."""
+    def _get(url: str, params: dict):
+        name = f"{params['term'].replace(' ', '_').lower()}_{params['offset']}.json"
+        path = os.path.join(fixtures_dir, name)
+        if not os.path.exists(path):
+            return 200, {}, {"businesses": []}
+        with open(path) as f:
+            return 200, {}, json.load(f)
+    return _get
+
+
+def retry_after_seconds(value) -> float | None:
+    """Retry-After as seconds: delta-seconds or an HTTP-date; None if missing or unparseable."""
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except (TypeError, ValueError):
+        pass
+    try:
+        when = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    if when.tzinfo is None:
+        when = when.replace(tzinfo=timezone.utc)
+    return max(0.0, (when - datetime.now(timezone.utc)).total_seconds())
+
+
+def fetch_yelp_page(cuisine: str, offset: int, http_get=yelp_http_get, bucket: TokenBucket | None = None):
     url = "https://api.yelp.com/v3/businesses/search"
     params = {
         "term": f"{cuisine} restaurants",
@@ -37,11 +124,30 @@ def fetch_yelp_page(cuisine: str, offset: int):
         "limit": PAGE_SIZE,
         "offset": offset
     }
-    r = requests.get(url, headers=HEADERS, params=params, timeout=20)
-    if r.status_code != 200:
-        print(f"[WARN] Yelp fetch failed ({cuisine}, offset={offset}): {r.text}")
-        return []
-    return r.json().get("businesses", [])
+    for attempt in range(MAX_RETRIES + 1):
+        if bucket:
+            bucket.acquire()
+        try:
+            status, headers, data = http_get(url, params)
+        except requests.RequestException as e:
+            status, headers, data = None, {}, str(e)
+        if status == 200:
+            return data.get("businesses", [])
+        if status is not None and status != 429 and status < 500:
+            print(f"[WARN] Yelp fetch failed ({cuisine}, offset={offset}): {data}")
+            return []
+        if attempt == MAX_RETRIES:
+            break  # no point waiting before giving up
+        # 429 / 5xx / network error: honour Retry-After, else exponential backoff with jitter
+        delay = retry_after_seconds((headers or {}).get("Retry-After"))
+        if delay is None:
+            delay = random.uniform(0, min(30, 0.5 * 2 ** attempt))
+        if bucket and status == 429:
+            bucket.pause(delay)
+        else:
+            time.sleep(delay)
+    print(f"[WARN] Yelp fetch gave up ({cuisine}, offset={offset}) after {MAX_RETRIES} retries")
+    return None
 
 def normalize_item(biz: dict, cuisine: str):
     # Required fields (assignment)
@@ -68,89 +174,143 @@ def normalize_item(biz: dict, cuisine: str):
         "Rating": as_decimal(rating),
         "ZipCode": zip_code,
         "insertedAtTimestamp": now_iso,                     # assignment asks to attach this when you insert
-        # We'll manage cuisines as a String Set via UpdateItem (ADD) so leave it off here.
+        # CuisineSet is filled in by aggregate_businesses (one item per business across cuisines)
     }
     return item
 
-def upsert_business(item: dict, cuisine: str):
+
+def fetch_all(cuisines=CUISINES, http_get=None, checkpoint: Checkpoint | None = None,
+              workers: int = FETCH_WORKERS, bucket: TokenBucket | None = None):
     """
-    Upsert with UpdateItem:
-      - SET: refresh scalars (Name, Address, NumberOfReviews, Rating, ZipCode, Coordinates)
-              and set insertedAtTimestamp only if not already set.
-      - ADD: add cuisine to CuisineSet (String Set).
+    Fetch every (cuisine, offset) page concurrently under the shared rate limit.
+    Yields (cuisine, offset, businesses) as pages complete; pages already in the
+    checkpoint are skipped. A page is only checkpointed by the caller, after its
+    businesses have been stored.
     """
-    # Only 'Name' is a DynamoDB reserved word. We'll alias just that.
-    expr_attr_names = {
-        "#Name": "Name",
-    }
+    if http_get is None:
+        http_get = fixture_http_get(FIXTURES_DIR) if FIXTURES_DIR else yelp_http_get
+    bucket = bucket or TokenBucket(RATE_PER_SEC, RATE_BURST)
+    pages = (TARGET_PER_CUISINE + PAGE_SIZE - 1) // PAGE_SIZE
+    todo = [(c, p * PAGE_SIZE) for c in cuisines for p in range(pages)
+            if not (checkpoint and (c, p * PAGE_SIZE) in checkpoint)]
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        futures = {pool.submit(fetch_yelp_page, c, off, http_get, bucket): (c, off) for c, off in todo}
+        for fut in as_completed(futures):
+            c, off = futures[fut]
+            yield c, off, fut.result()
+
+
+def aggregate_businesses(pages) -> tuple[dict, list]:
+    """
+    Merge every (cuisine, page) into one item per business_id, with all of its
+    cuisines in CuisineSet. Returns (items by id, pages that were fetched).
+    """
+    items, done = {}, []
+    for cuisine, offset, businesses in pages:
+        if businesses is None:
+            continue  # gave up on this page; not checkpointed, so the next run retries it
+        for biz in businesses:
+            bid = biz.get("id")
+            if not bid:
+                continue
+            if bid in items:
+                items[bid]["CuisineSet"].add(cuisine)
+                continue
+            item = normalize_item(biz, cuisine)
+            item["CuisineSet"] = {cuisine}
+            items[bid] = item
+        done.append((cuisine, offset))
+    return items, done
+
+
+def _with_backoff(call, request: dict, unprocessed_key: str, attempts: int = 8):
+    """Run a batch call until nothing is left unprocessed; returns the responses."""
+    responses = []
+    for attempt in range(attempts):
+        resp = call(request)
+        responses.append(resp)
+        request = resp.get(unprocessed_key) or {}
+        if not request:
+            return responses
+        time.sleep(random.uniform(0, min(5, 0.1 * 2 ** attempt)))
+    raise RuntimeError(f"{unprocessed_key} still pending after {attempts} attempts")
 
-    update_expr_parts = [
-        "#Name = :Name",
-        "Address = :Address",
-        "NumberOfReviews = :NumberOfReviews",
-        "Rating = :Rating",
-        "ZipCode = :ZipCode",
-        "Coordinates = :Coordinates",
-        "insertedAtTimestamp = if_not_exists(insertedAtTimestamp, :ts)",
-    ]
-
-    expr_attr_values = {
-        ":Name": item["Name"],
-        ":Address": item["Address"],
-        ":NumberOfReviews": item["NumberOfReviews"],
-        ":Rating": item["Rating"],
-        ":ZipCode": item["ZipCode"],
-        ":Coordinates": item["Coordinates"],
-        ":ts": item["insertedAtTimestamp"],
-        ":c": set([cuisine]),  # for ADD below
-    }
 
-    update_expr = "SET " + ", ".join(update_expr_parts)
-    add_expr = "ADD CuisineSet :c"
+def load_existing(ids: list) -> dict:
+    """business_id -> {CuisineSet, insertedAtTimestamp} for items already in the table."""
+    existing = {}
+    for i in range(0, len(ids), 100):  # BatchGetItem max 100 keys
+        request = {TABLE_NAME: {
+            "Keys": [{"business_id": {"S": bid}} for bid in ids[i:i + 100]],
+            "ProjectionExpression": "business_id, CuisineSet, insertedAtTimestamp",
+        }}
+        for resp in _with_backoff(lambda r: ddb_client.batch_get_item(RequestItems=r), request, "UnprocessedKeys"):
+            for raw in resp.get("Responses", {}).get(TABLE_NAME, []):
+                it = {k: _deser.deserialize(v) for k, v in raw.items()}
+                existing[it["business_id"]] = it
+    return existing
 
-    table.update_item(
-        Key={"business_id": item["business_id"]},
-        UpdateExpression=f"{update_expr} {add_expr}",
-        ExpressionAttributeNames=expr_attr_names,
-        ExpressionAttributeValues=expr_attr_values,
-        ReturnValues="NONE",
-    )
 
+def batch_write_businesses(items: list, merge: bool = MERGE_EXISTING, workers: int = WRITE_WORKERS) -> int:
+    """
+    Put every business once with parallel BatchWriteItem calls (25 items each),
+    retrying UnprocessedItems. With merge=True, CuisineSet is unioned with the
+    cuisines already stored and insertedAtTimestamp keeps its first value.
+    """
+    if merge:
+        existing = load_existing([it["business_id"] for it in items])
+        for it in items:
+            old = existing.get(it["business_id"])
+            if old:
+                it["CuisineSet"] |= set(old.get("CuisineSet") or ())
+                it["insertedAtTimestamp"] = old.get("insertedAtTimestamp") or it["insertedAtTimestamp"]
+
+    def write_chunk(chunk):
+        request = {TABLE_NAME: [
+            {"PutRequest": {"Item": {k: _ser.serialize(v) for k, v in it.items()}}} for it in chunk
+        ]}
+        return len(_with_backoff(lambda r: ddb_client.batch_write_item(RequestItems=r), request, "UnprocessedItems"))
+
+    chunks = [items[i:i + 25] for i in range(0, len(items), 25)]  # BatchWriteItem max 25
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        return sum(pool.map(write_chunk, chunks))
+
+
+def ingest(http_get=None, checkpoint_path: str | None = CHECKPOINT_PATH, merge: bool = MERGE_EXISTING,
+           flush_pages: int = FLUSH_PAGES):
+    """
+    Fetch, aggregate and write in flushes of `flush_pages` pages, checkpointing each
+    flush once it is stored, so an interrupted run only redoes the pages in flight.
+    """
+    checkpoint = Checkpoint(checkpoint_path)
+    # Businesses from pages of an earlier run are not in this run's aggregate
+    merge = merge or bool(checkpoint.done)
+    started = time.perf_counter()
+
+    pages = fetch_all(CUISINES, http_get, checkpoint)
+    by_cuisine = {c: set() for c in CUISINES}
+    n_pages = calls = written = 0
+    write_s = 0.0
+    while batch := list(itertools.islice(pages, flush_pages)):
+        by_id, done = aggregate_businesses(batch)
+        t0 = time.perf_counter()
+        calls += batch_write_businesses(list(by_id.values()), merge=merge)
+        write_s += time.perf_counter() - t0
+        for cuisine, offset in done:
+            checkpoint.mark(cuisine, offset)
+        for bid, it in by_id.items():
+            for cuisine in it["CuisineSet"] & by_cuisine.keys():
+                by_cuisine[cuisine].add(bid)
+        n_pages += len(done)
+        written += len(by_id)
+        # A business can span flushes: later ones add to the CuisineSet already stored
+        merge = True
 
-def ingest():
-    seen_global = set()  # avoid duplicate PUTs within the same run
     for cuisine in CUISINES:
-        print(f"\n=== Ingesting cuisine: {cuisine} ===")
-        fetched_ids = set()
-        # Compute how many pages we need
-        pages = (TARGET_PER_CUISINE + PAGE_SIZE - 1) // PAGE_SIZE
-
-        for p in range(pages):
-            offset = p * PAGE_SIZE
-            businesses = fetch_yelp_page(cuisine, offset)
-            if not businesses:
-                break
-
-            for biz in businesses:
-                bid = biz.get("id")
-                if not bid or bid in fetched_ids:
-                    continue
-                fetched_ids.add(bid)
-
-                if bid in seen_global:
-                    # Still add cuisine to CuisineSet for already ingested business
-                    item = normalize_item(biz, cuisine)
-                    upsert_business(item, cuisine)
-                    continue
-
-                item = normalize_item(biz, cuisine)
-                upsert_business(item, cuisine)
-                seen_global.add(bid)
-
-            # polite delay for rate limiting
-            time.sleep(0.5)
-
-        print(f"Stored/updated {len(fetched_ids)} unique businesses for {cuisine}")
+        print(f"Stored/updated {len(by_cuisine[cuisine])} unique businesses for {cuisine}")
+    print(f"Fetched {n_pages} pages in {time.perf_counter() - started:.1f}s; "
+          f"wrote {written} items in {calls} BatchWriteItem calls, {write_s:.1f}s")
 
 if __name__ == "__main__":
     ingest()